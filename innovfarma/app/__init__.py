@@ -57,6 +57,28 @@ def create_app(config_object='innovfarma.config.Config'):
     app.register_blueprint(compras_bp, url_prefix='/api')
     app.register_blueprint(users_bp, url_prefix='/api')
 
+    from .products.result_cache import result_cache
+    result_cache.configure(maxsize=app.config.get('SEARCH_CACHE_SIZE'), ttl=app.config.get('SEARCH_CACHE_TTL'))
+
+    # Precargar los índices en memoria de productos de este worker (solo Mongo)
+    if app.config.get('MONGO_URI') and app.config.get('PRODUCT_INDEX_WARMUP', True):
+        try:
+            from . import mongo_models
+            with app.app_context():
+                mongo_models.build_product_indexes()
+        except Exception as e:
+            # no bloquear el arranque: el primer escaneo reintentará la carga
+            app.logger.warning('No se pudieron precargar los índices de productos: %s', e)
+
+    # Comprobantes pendientes de una ejecución anterior (solo backend SQL)
+    if not app.config.get('MONGO_URI'):
+        try:
+            from .invoices import receipts, sql_helpers as invoice_helpers
+            receipts.start(app, invoice_helpers.render_comprobantes)
+        except Exception as e:
+            # se reintentará al crear la primera factura
+            app.logger.warning('No se pudo arrancar la cola de comprobantes: %s', e)
+
     # Serve frontend index.html at root if the static frontend exists; otherwise return API status
     @app.route('/')
     def index():
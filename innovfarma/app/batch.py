@@ -0,0 +1,28 @@
+"""Lecturas por lote (`POST /api/productos/batch`, `POST /api/clientes/batch`).
+
+El cuerpo es `{"ids": [...]}` con hasta `MAX_IDS` identificadores, que pueden
+mezclar `_id` (ObjectId en hex) e ids legados/SQL. La respuesta mantiene el
+orden pedido: un elemento por id, `null` donde no se encontró, y la lista de
+ids no encontrados aparte.
+"""
+
+MAX_IDS = 500
+
+
+def parse_ids(data):
+    """Valida el cuerpo. Devuelve (ids, None) o (None, mensaje de error)."""
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids:
+        return None, 'se requiere ids (lista no vacía)'
+    if len(ids) > MAX_IDS:
+        return None, f'máximo {MAX_IDS} ids por lote'
+    if any(not isinstance(i, (str, int)) or isinstance(i, bool) for i in ids):
+        return None, 'cada id debe ser un string o un entero'
+    return ids, None
+
+
+def in_request_order(ids, found):
+    """(resultados en el orden de `ids`, ids no encontrados) a partir de {id: resultado}."""
+    items = [found.get(i) for i in ids]
+    missing = [i for i, item in zip(ids, items) if item is None]
+    return items, missing
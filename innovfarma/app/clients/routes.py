@@ -8,6 +8,10 @@ except Exception:
     mongo_helpers = None
 
 from . import sql_helpers as sql_helpers
+from ..pagination import decode_cursor, next_cursor
+from ..projection import expand, parse_fields, pick
+from ..etag import conditional_get
+from .. import batch
 
 clients_bp = Blueprint('clients', __name__)
 
@@ -19,11 +23,21 @@ def _helpers():
 
 @clients_bp.route('/clientes', methods=['GET'])
 def get_clientes():
-    """List all clientes with pagination"""
+    """List all clientes with pagination (`page` or opaque `cursor`)
+
+    `fields` (separados por comas) limita los campos devueltos.
+    """
     limit = request.args.get('limit', 100, type=int)
     skip = request.args.get('page', 0, type=int) * limit
+    cursor = request.args.get('cursor')
+    fields = parse_fields(request.args.get('fields'))
+    try:
+        after_id = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     h = _helpers()
-    clientes = h.list_clientes(limit=limit, skip=skip)
+    clientes = h.list_clientes(limit=limit, skip=skip, after_id=after_id,
+                               fields=expand(fields, {'ci': ('nit',), 'documento': ('ci', 'nit')}))
     # Normalizar campo 'ci' y exponer también 'documento' para la UI
     normalized = []
     for c in clientes:
@@ -35,10 +49,11 @@ def get_clientes():
             c['ci'] = c.get('nit') or c.get('NIT') or ''
         # añadir alias 'documento' por compatibilidad con front
         c['documento'] = c.get('ci') or c.get('nit') or ''
-        normalized.append(c)
-    return jsonify({'clientes': normalized, 'total': len(normalized)})
+        normalized.append(pick(c, fields))
+    return jsonify({'clientes': normalized, 'total': len(normalized), 'next_cursor': next_cursor(normalized, limit)})
 
 @clients_bp.route('/clientes/<cliente_id>', methods=['GET'])
+@conditional_get('clientes')
 def get_cliente_detail(cliente_id):
     """Get cliente by ID"""
     h = _helpers()
@@ -51,6 +66,25 @@ def get_cliente_detail(cliente_id):
     cliente['documento'] = cliente.get('ci') or cliente.get('nit') or ''
     return jsonify(cliente)
 
+@clients_bp.route('/clientes/batch', methods=['POST'])
+def get_clientes_batch():
+    """Varios clientes por id en una sola petición
+
+    Body: {"ids": [...]} (máx. 500, ObjectId o ids legados). Devuelve
+    `clientes` en el orden pedido (null si no existe) y `no_encontrados`.
+    """
+    ids, error = batch.parse_ids(request.get_json() or {})
+    if error:
+        return jsonify({'error': error}), 400
+    h = _helpers()
+    found = h.get_clientes_batch(ids)
+    for cliente in found.values():
+        if not cliente.get('ci'):
+            cliente['ci'] = cliente.get('nit') or cliente.get('NIT') or ''
+        cliente['documento'] = cliente.get('ci') or cliente.get('nit') or ''
+    clientes, missing = batch.in_request_order(ids, found)
+    return jsonify({'clientes': clientes, 'no_encontrados': missing, 'total': len(ids) - len(missing)})
+
 @clients_bp.route('/clientes/buscar-por-ci', methods=['POST'])
 def search_by_ci():
     """Search for cliente by CI"""
@@ -1,5 +1,6 @@
 # Funciones helper para clientes con SQLAlchemy
 from ..models import db, Cliente
+from ..projection import pick_rows, sql_columns
 
 
 def create_cliente(nombre, nit='', ci='', direccion='', telefono=''):
@@ -29,6 +30,31 @@ def get_cliente(cliente_id):
         'telefono': cliente.telefono,
     }
 
+def get_clientes_batch(cliente_ids):
+    """{id pedido: cliente} para varios ids (un solo `IN`)"""
+    por_int = {}
+    for cid in cliente_ids:
+        try:
+            por_int[cid] = int(cid)
+        except (TypeError, ValueError):
+            continue
+    if not por_int:
+        return {}
+    clientes = {c.id: c for c in Cliente.query.filter(Cliente.id.in_(set(por_int.values()))).all()}
+    out = {}
+    for cid, i in por_int.items():
+        c = clientes.get(i)
+        if c is not None:
+            out[cid] = {
+                'id': c.id,
+                'nombre': c.nombre,
+                'ci': c.ci,
+                'nit': c.nit,
+                'direccion': c.direccion,
+                'telefono': c.telefono,
+            }
+    return out
+
 def search_cliente_by_ci(ci):
     """Buscar cliente por CI"""
     cliente = Cliente.query.filter_by(ci=ci).first()
@@ -73,20 +99,33 @@ def search_cliente_by_nombre(nombre):
         })
     return out
 
-def list_clientes(limit=100, skip=0):
-    """Listar clientes con paginación"""
-    clientes = Cliente.query.offset(skip).limit(limit).all()
-    out = []
-    for cliente in clientes:
-        out.append({
-            'id': cliente.id,
-            'nombre': cliente.nombre,
-            'ci': cliente.ci,
-            'nit': cliente.nit,
-            'direccion': cliente.direccion,
-            'telefono': cliente.telefono,
-        })
-    return out
+def _cliente_to_dict(cliente):
+    """Convertir cliente a diccionario"""
+    return {
+        'id': cliente.id,
+        'nombre': cliente.nombre,
+        'ci': cliente.ci,
+        'nit': cliente.nit,
+        'direccion': cliente.direccion,
+        'telefono': cliente.telefono,
+    }
+
+def list_clientes(limit=100, skip=0, after_id=None, fields=None):
+    """Listar clientes con paginación (por id; `after_id` pagina por cursor)
+
+    Con `fields` solo se seleccionan esas columnas.
+    """
+    if fields is not None:
+        query = db.session.query(*sql_columns(Cliente, fields)).order_by(Cliente.id)
+    else:
+        query = Cliente.query.order_by(Cliente.id)
+    if after_id is not None:
+        clientes = query.filter(Cliente.id > after_id).limit(limit).all()
+    else:
+        clientes = query.offset(skip).limit(limit).all()
+    if fields is not None:
+        return pick_rows(clientes, _cliente_to_dict, fields)
+    return [_cliente_to_dict(c) for c in clientes]
 
 def update_cliente(cliente_id, **kwargs):
     """Actualizar cliente"""
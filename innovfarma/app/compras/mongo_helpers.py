@@ -19,6 +19,7 @@ def create_proveedor(data):
     if db is None:
         raise RuntimeError('MongoDB not initialized')
     res = db.proveedores.insert_one(data)
+    mongo_models.bump_collection_version('proveedores')
     return str(res.inserted_id)
 
 
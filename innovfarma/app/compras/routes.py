@@ -2,6 +2,9 @@ from flask import jsonify, request
 from datetime import datetime
 from . import compras_bp
 from .. import mongo_models
+from ..etag import conditional_get
+from ..dates import parse_date, iso_fields
+from ..idempotency import idempotent
 
 
 @compras_bp.route('/compras', methods=['GET'])
@@ -13,11 +16,12 @@ def list_compras():
     out = []
     for d in docs:
         d['id'] = str(d.get('_id'))
-        out.append(d)
+        out.append(iso_fields(d, ('fecha',)))
     return jsonify({'compras': out, 'total': len(out)})
 
 
 @compras_bp.route('/compras', methods=['POST'])
+@idempotent('compras')
 def create_compra():
     data = request.get_json() or {}
     db = mongo_models.get_db()
@@ -33,21 +37,11 @@ def create_compra():
     if not isinstance(items, list) or not items:
         return jsonify({'error': 'items (lista) requerida'}), 400
 
-    # normalizar fecha si se proporciona
-    fecha_norm = None
-    if fecha:
-        parsed = None
-        try:
-            parsed = datetime.fromisoformat(fecha)
-        except Exception:
-            try:
-                parsed = datetime.strptime(fecha, '%Y-%m-%d')
-            except Exception:
-                try:
-                    parsed = datetime.strptime(fecha, '%d/%m/%Y')
-                except Exception:
-                    parsed = None
-        fecha_norm = parsed.isoformat() if parsed else str(fecha)
+    # fecha siempre como fecha BSON (por defecto, la de registro)
+    now = datetime.utcnow()
+    fecha_norm = parse_date(fecha) if fecha else now
+    if fecha_norm is None:
+        return jsonify({'error': 'fecha inválida'}), 400
 
     compra = {
         # solo incluir proveedor_id si fue provisto
@@ -55,12 +49,11 @@ def create_compra():
         'items': items,
         'total': float(total) if total is not None else 0.0,
         'fecha': fecha_norm,
-        'created_at': datetime.utcnow()
+        'created_at': now
     }
     # assign sequential numero for compra
     try:
-        if hasattr(mongo_models, 'get_next_sequence'):
-            compra['numero'] = mongo_models.get_next_sequence('compras')
+        compra['numero'] = mongo_models.next_number('compras', data.get('id_sucursal'))
     except Exception:
         pass
 
@@ -82,18 +75,18 @@ def create_compra():
 
     # actualizar existencia (sumar cantidades compradas)
     try:
-        for it in compra.get('items', []):
+        items = compra.get('items', [])
+        # resolver todos los productos de la compra en una consulta
+        oids = mongo_models.resolve_product_ids([it.get('id_producto') or it.get('id') or it.get('producto_id') for it in items],
+                                               use_missing=False)
+        for it in items:
             prod_id = it.get('id_producto') or it.get('id') or it.get('producto_id')
             qty = int(it.get('cantidad') or 0)
-            if not prod_id or qty <= 0:
+            oid = oids.get(prod_id)
+            if oid is None or qty <= 0:
                 continue
-            # intentar ObjectId primero
-            try:
-                from bson import ObjectId
-                oid = ObjectId(prod_id)
-                db.productos.update_one({'_id': oid}, {'$inc': {'existencia': qty}})
-            except Exception:
-                db.productos.update_one({'id': prod_id}, {'$inc': {'existencia': qty}})
+            db.productos.update_one({'_id': oid}, {'$inc': {'existencia': qty}, '$set': mongo_models.product_change_stamp()})
+            mongo_models.refresh_product(oid)
     except Exception:
         # no bloquear la creación de la compra si el ajuste falla; solo loguear en futuro
         pass
@@ -106,10 +99,12 @@ def create_compra():
         doc = db.compras.find_one({'id': compra_id})
     if doc:
         doc['id'] = str(doc.get('_id'))
+        iso_fields(doc, ('fecha',))
     return jsonify(doc or {'id': compra_id}), 201
 
 
 @compras_bp.route('/proveedores', methods=['GET'])
+@conditional_get('proveedores')
 def list_proveedores():
     db = mongo_models.get_db()
     if db is None:
@@ -135,17 +130,25 @@ def create_proveedor():
         'direccion': data.get('direccion'),
         'nit': data.get('nit') or data.get('NIT') or ''
     }
-    # assign sequential numero if helper available
+    # assign sequential numero
     try:
-        if hasattr(mongo_models, 'get_next_sequence'):
-            prov['numero'] = mongo_models.get_next_sequence('proveedores')
+        prov['numero'] = mongo_models.next_number('proveedores')
     except Exception:
         pass
     res = db.proveedores.insert_one(prov)
+    mongo_models.bump_collection_version('proveedores')
     prov['id'] = str(res.inserted_id)
     return jsonify(prov), 201
 
 
+def _cuenta_out(cuenta):
+    """Fechas de una cuenta por pagar (vencimiento y pagos) como ISO para la respuesta."""
+    iso_fields(cuenta, ('fecha_vencimiento',))
+    for pago in cuenta.get('pagos') or []:
+        iso_fields(pago, ('fecha',))
+    return cuenta
+
+
 @compras_bp.route('/cuentas-pagar', methods=['POST'])
 def crear_cuenta_pagar():
     """Registrar una deuda con proveedor: proveedor_id, monto, fecha_vencimiento, descripcion, saldo (inicial = monto)."""
@@ -167,6 +170,10 @@ def crear_cuenta_pagar():
         monto_val = float(monto)
     except (TypeError, ValueError):
         return jsonify({'error': 'monto inválido'}), 400
+    if fecha_vencimiento:
+        fecha_vencimiento = parse_date(fecha_vencimiento)
+        if fecha_vencimiento is None:
+            return jsonify({'error': 'fecha_vencimiento inválida'}), 400
 
     cuenta = {
         'proveedor_id': proveedor_id,
@@ -181,7 +188,7 @@ def crear_cuenta_pagar():
     res = db.cuentas_pagar.insert_one(cuenta)
     cuenta_id = str(res.inserted_id)
     cuenta['id'] = cuenta_id
-    return jsonify(cuenta), 201
+    return jsonify(_cuenta_out(cuenta)), 201
 
 
 @compras_bp.route('/cuentas-pagar', methods=['GET'])
@@ -193,7 +200,7 @@ def list_cuentas_pagar():
     out = []
     for d in docs:
         d['id'] = str(d.get('_id'))
-        out.append(d)
+        out.append(_cuenta_out(d))
     return jsonify({'cuentas': out, 'total': len(out)})
 
 
@@ -210,7 +217,7 @@ def get_cuenta_pagar(cuenta_id):
     if not doc:
         return jsonify({'error': 'cuenta no encontrada'}), 404
     doc['id'] = str(doc.get('_id'))
-    return jsonify(doc)
+    return jsonify(_cuenta_out(doc))
 
 
 @compras_bp.route('/cuentas-pagar/<cuenta_id>/pagar', methods=['PUT'])
@@ -230,6 +237,9 @@ def pagar_cuenta(cuenta_id):
         pago_val = float(monto)
     except (TypeError, ValueError):
         return jsonify({'error': 'monto inválido'}), 400
+    fecha_pago = parse_date(fecha) if fecha else datetime.utcnow()
+    if fecha_pago is None:
+        return jsonify({'error': 'fecha inválida'}), 400
 
     db = mongo_models.get_db()
     if db is None:
@@ -248,7 +258,7 @@ def pagar_cuenta(cuenta_id):
     # registrar pago
     pago = {
         'monto': pago_val,
-        'fecha': fecha or datetime.utcnow().isoformat(),
+        'fecha': fecha_pago,
         'referencia': referencia,
         'created_at': datetime.utcnow()
     }
@@ -272,4 +282,5 @@ def pagar_cuenta(cuenta_id):
             db.cuentas_pagar.update_one({'_id': doc.get('_id')}, {'$set': {'estado': 'pagada', 'paid_at': datetime.utcnow()}})
             doc['estado'] = 'pagada'
         doc['id'] = str(doc.get('_id'))
+        _cuenta_out(doc)
     return jsonify(doc), 200
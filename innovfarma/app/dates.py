@@ -0,0 +1,82 @@
+"""Normalización de fechas para Mongo.
+
+Las fechas (`facturas.fecha`, `compras.fecha`, `lotes.caducidad`...) se
+guardan siempre como fechas BSON (`datetime`), nunca como strings: así los
+filtros por rango comparan fechas y pueden usar los índices. La entrada de
+la API se convierte con `parse_date`; la salida vuelve a ISO con `iso` /
+`iso_fields`, con el mismo formato que devolvían antes los strings.
+
+`scripts/normalize_dates.py` convierte los documentos antiguos; hay que
+correrlo al desplegar. Hasta entonces las alertas de caducidad leen también
+los lotes con la fecha como string (ver `inventarios.routes._near_expiry`).
+"""
+from datetime import date, datetime
+
+# formatos aceptados además de ISO 8601
+FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+
+# campos de fecha por colección (los que convierte scripts/normalize_dates.py)
+DATE_FIELDS = {
+    'facturas': ('fecha',),
+    'compras': ('fecha',),
+    'lotes': ('caducidad',),
+    'pedidos': ('fecha',),
+    'cuentas_pagar': ('fecha_vencimiento',),
+}
+
+# índices para los filtros por rango de fecha (colección, claves)
+DATE_INDEXES = (
+    ('facturas', [('fecha', 1), ('id_usuario', 1)]),
+    ('compras', [('fecha', 1)]),
+    ('lotes', [('caducidad', 1), ('producto_id', 1)]),
+    ('detalle_factura', [('id_factura', 1)]),
+)
+
+
+def parse_date(value):
+    """`datetime` a partir de un datetime, date o string (ISO o `FORMATS`); None si no se puede."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    try:
+        # 'Z' final (JavaScript toISOString) no lo acepta fromisoformat antes de Python 3.11
+        parsed = datetime.fromisoformat(value[:-1] + '+00:00' if value.endswith('Z') else value)
+    except ValueError:
+        parsed = None
+        for fmt in FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+    if parsed is not None and parsed.tzinfo is not None:
+        # Mongo guarda UTC sin zona: normalizar a naive UTC
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def parse_day(value):
+    """Como `parse_date` pero truncado al día (caducidades)."""
+    parsed = parse_date(value)
+    return datetime(parsed.year, parsed.month, parsed.day) if parsed else None
+
+
+def iso(value, day=False):
+    """Fecha -> string ISO para la respuesta JSON (o el valor tal cual si no es fecha)."""
+    if isinstance(value, datetime):
+        return value.date().isoformat() if day else value.isoformat()
+    return value
+
+
+def iso_fields(doc, fields, day=False):
+    """Pasar a ISO, en el propio documento, los campos de fecha indicados."""
+    for f in fields:
+        if f in doc:
+            doc[f] = iso(doc[f], day=day)
+    return doc
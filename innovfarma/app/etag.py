@@ -0,0 +1,38 @@
+"""GET condicional (ETag / If-None-Match) para endpoints de consulta.
+
+El ETag se deriva de la versión de la colección (`mongo_models.collection_version`,
+un contador que avanza con cada escritura) y de la URL pedida. Si el cliente
+ya tiene esa versión se responde 304 sin ejecutar la consulta ni serializar
+la respuesta. Con el backend SQL no hay versiones y la vista se ejecuta tal cual.
+"""
+import hashlib
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+
+def conditional_get(collection):
+    """Decorador: responde 304 si `If-None-Match` coincide con la versión de `collection`."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = None
+            if current_app.config.get('MONGO_URI'):
+                try:
+                    from . import mongo_models
+                    version = mongo_models.collection_version(collection)
+                except Exception:
+                    version = None
+            if version is None:
+                return view(*args, **kwargs)
+            tag = hashlib.sha1(f'{collection}:{version}:{request.full_path}'.encode('utf-8')).hexdigest()
+            if request.if_none_match.contains(tag):
+                resp = make_response('', 304)
+                resp.set_etag(tag)
+                return resp
+            resp = make_response(view(*args, **kwargs))
+            if resp.status_code == 200:
+                resp.set_etag(tag)
+            return resp
+        return wrapper
+    return decorator
@@ -0,0 +1,215 @@
+"""Cabecera `Idempotency-Key` para las altas que mueven stock (facturas, compras).
+
+El cliente manda la misma clave en todos los reintentos de una operación. La
+primera petición reserva (usuario, clave) en la colección `idempotencia` y,
+si termina bien (2xx), guarda su respuesta; los reintentos reciben esa
+respuesta tal cual (con `Idempotent-Replayed: true`) sin volver a ejecutar la
+vista, así que no tocan `productos`.
+
+- Mientras la primera sigue en curso, un reintento recibe 409 con `Retry-After`.
+- La misma clave con otro cuerpo es un error del cliente: 422.
+- Si la primera falla (4xx/5xx o excepción) se libera la clave y el reintento
+  se ejecuta normalmente.
+
+Mientras la vista corre, un hilo renueva `latido` en la reserva cada
+`HEARTBEAT_INTERVAL` segundos; solo se toma una reserva 'en_curso' cuyo latido
+lleva más de `IN_PROGRESS_TIMEOUT` parado (el worker murió), nunca una viva
+por lenta que sea. Tras un 2xx la reserva no se libera nunca: si no se puede
+guardar 'hecho' a la primera, el hilo sigue latiendo y reintentándolo.
+
+Las claves caducan con un índice TTL (`IDEMPOTENCY_TTL`, segundos). Sin
+`Idempotency-Key`, o con el backend SQL, la vista se ejecuta tal cual.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import current_app, jsonify, make_response, request
+from flask_login import current_user
+
+COLLECTION = 'idempotencia'
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+DEFAULT_TTL = 24 * 3600
+# una reserva 'en_curso' sin latido desde hace más se considera abandonada (worker caído)
+IN_PROGRESS_TIMEOUT = 60
+HEARTBEAT_INTERVAL = 10
+# intentos de guardar 'hecho' antes de responder; luego sigue el hilo de latido
+DONE_RETRIES = 3
+
+_ttl_index_ready = False
+
+
+def _ensure_ttl_index(db):
+    global _ttl_index_ready
+    if _ttl_index_ready:
+        return
+    _ttl_index_ready = True
+    try:
+        ttl = int(current_app.config.get('IDEMPOTENCY_TTL', DEFAULT_TTL))
+        db[COLLECTION].create_index('created_at', expireAfterSeconds=ttl)
+    except Exception:
+        pass
+
+
+def _user_id():
+    try:
+        if getattr(current_user, 'is_authenticated', False):
+            return str(current_user.get_id())
+    except Exception:
+        pass
+    return None
+
+
+def _replay(doc):
+    resp = current_app.response_class(doc.get('body') or '', status=doc.get('status', 200), mimetype=doc.get('mimetype'))
+    resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
+
+
+class _Claim:
+    """Reserva viva de este worker: late mientras la vista corre y, tras un 2xx,
+    no para hasta dejarla en 'hecho'."""
+
+    def __init__(self, col, doc_id, owner):
+        self.col = col
+        self.doc_id = doc_id
+        self.owner = owner
+        self._done = threading.Event()
+        self._result = None
+        self._thread = threading.Thread(target=self._beat, name=f'idempotencia:{doc_id}', daemon=True)
+        self._thread.start()
+
+    def _mine(self):
+        return {'_id': self.doc_id, 'estado': 'en_curso', 'owner': self.owner}
+
+    def _beat(self):
+        while not self._done.wait(HEARTBEAT_INTERVAL):
+            try:
+                if self._result is not None and self._save():
+                    return
+                self.col.update_one(self._mine(), {'$set': {'latido': datetime.utcnow()}})
+            except Exception:
+                pass
+
+    def _save(self):
+        fields = dict(self._result, created_at=datetime.utcnow())
+        res = self.col.update_one(self._mine(), {'$set': fields})
+        if res.matched_count:
+            return True
+        # ya la dejó 'hecho' un intento nuestro que sí llegó; si ya no es
+        # nuestra (caducó o la tomó otro worker) tampoco hay nada más que hacer
+        doc = self.col.find_one({'_id': self.doc_id}, {'estado': 1, 'owner': 1}) or {}
+        return doc.get('owner') != self.owner or doc.get('estado') == 'hecho'
+
+    def complete(self, fields):
+        """Guardar la respuesta (2xx). Si Mongo falla, el hilo sigue latiendo
+        y reintentando, así la clave nunca vuelve a quedar libre."""
+        self._result = fields
+        for attempt in range(DONE_RETRIES):
+            try:
+                if self._save():
+                    self._done.set()
+                    return True
+            except Exception:
+                pass
+            time.sleep(0.1 * (attempt + 1))
+        return False
+
+    def release(self):
+        self._done.set()
+        self.col.delete_one(self._mine())
+
+
+def _claim(col, doc_id, fingerprint):
+    """Reservar la clave. Devuelve (reserva, None) si es nuestra o (None, respuesta) si no."""
+    from pymongo.errors import DuplicateKeyError
+
+    now = datetime.utcnow()
+    owner = uuid.uuid4().hex
+    nuevo = {'_id': doc_id, 'estado': 'en_curso', 'hash': fingerprint, 'owner': owner, 'created_at': now, 'latido': now}
+    try:
+        col.insert_one(nuevo)
+        return _Claim(col, doc_id, owner), None
+    except DuplicateKeyError:
+        pass
+    doc = col.find_one({'_id': doc_id})
+    if doc is None:
+        # caducó entre medias: volver a intentarlo una vez
+        try:
+            col.insert_one(nuevo)
+            return _Claim(col, doc_id, owner), None
+        except DuplicateKeyError:
+            doc = col.find_one({'_id': doc_id}) or {}
+    if doc.get('hash') != fingerprint:
+        return None, (jsonify({'error': f'{HEADER} ya usada con otra petición'}), 422)
+    if doc.get('estado') == 'hecho':
+        return None, _replay(doc)
+    # en curso: tomarla solo si su worker dejó de latir
+    taken = col.find_one_and_update(
+        {'_id': doc_id, 'estado': 'en_curso', 'latido': {'$lt': now - timedelta(seconds=IN_PROGRESS_TIMEOUT)}},
+        {'$set': {'owner': owner, 'created_at': now, 'latido': now}},
+    )
+    if taken is not None:
+        return _Claim(col, doc_id, owner), None
+    resp = make_response(jsonify({'error': 'la petición original todavía está en curso'}), 409)
+    resp.headers['Retry-After'] = '1'
+    return None, resp
+
+
+def idempotent(scope):
+    """Decorador: respeta `Idempotency-Key` en la vista (`scope` separa facturas de compras)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key or not current_app.config.get('MONGO_URI'):
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({'error': f'{HEADER} demasiado larga (máximo {MAX_KEY_LENGTH})'}), 400
+            try:
+                from . import mongo_models
+                db = mongo_models.get_db()
+            except Exception:
+                db = None
+            if db is None:
+                return view(*args, **kwargs)
+            _ensure_ttl_index(db)
+            col = db[COLLECTION]
+            user = _user_id()
+            doc_id = f'{scope}:{user or ""}:{key}'
+            fingerprint = hashlib.sha256(request.method.encode('utf-8') + b' ' + request.path.encode('utf-8') + b'\n' + request.get_data()).hexdigest()
+
+            claim, early = _claim(col, doc_id, fingerprint)
+            if early is not None:
+                return early
+            try:
+                resp = make_response(view(*args, **kwargs))
+            except Exception:
+                try:
+                    claim.release()
+                except Exception:
+                    pass
+                raise
+            if 200 <= resp.status_code < 300:
+                saved = claim.complete({
+                    'estado': 'hecho',
+                    'usuario': user,
+                    'status': resp.status_code,
+                    'mimetype': resp.mimetype,
+                    'body': resp.get_data(as_text=True),
+                })
+                if not saved:
+                    current_app.logger.warning('idempotencia: no se pudo guardar %s, se reintenta en segundo plano', doc_id)
+            else:
+                # nada quedó hecho: permitir que el reintento se ejecute
+                try:
+                    claim.release()
+                except Exception:
+                    pass
+            return resp
+        return wrapper
+    return decorator
@@ -4,8 +4,6 @@ Por ahora delegan en `app.mongo_models` y exponen funciones convenientes
 para futuras operaciones: ajustar stock, registrar lotes, etc.
 """
 from .. import mongo_models
-from bson import ObjectId
-from bson.errors import InvalidId
 from typing import Any, Dict, List
 
 
@@ -41,22 +39,14 @@ def adjust_stock(product_id: str, delta: int) -> bool:
     db = mongo_models.get_db()
     if db is None:
         return False
-    # Primero intenta como ObjectId
     try:
-        oid = ObjectId(product_id)
-        res = db.productos.update_one({'_id': oid}, {'$inc': {'existencia': delta}})
+        # acepta ObjectId, `id` legado o `sql_id`
+        oid = mongo_models.resolve_product_id(product_id, use_missing=False)
+        if oid is None:
+            return False
+        res = db.productos.update_one({'_id': oid}, {'$inc': {'existencia': delta}, '$set': mongo_models.product_change_stamp()})
         if res.modified_count > 0:
-            return True
-    except (InvalidId, TypeError):
-        # valor no es ObjectId válido; seguiremos con fallback
-        pass
-    except Exception:
-        # un error inesperado al usar ObjectId — seguiremos al fallback
-        pass
-
-    # fallback por id string (campo `id` usado en algunos documentos)
-    try:
-        res = db.productos.update_one({'id': product_id}, {'$inc': {'existencia': delta}})
+            mongo_models.refresh_product(oid)
         return res.modified_count > 0
     except Exception:
         return False
@@ -3,6 +3,9 @@ from . import inventarios_bp
 from .. import mongo_models as mongo_models
 from datetime import datetime, timedelta
 from flask_login import login_required
+from ..projection import expand, parse_fields, pick
+from ..etag import conditional_get
+from ..dates import parse_date, parse_day, iso, iso_fields
 
 try:
     from ..products import sql_helpers as productos_sql_helpers
@@ -13,28 +16,34 @@ except Exception:
 
 
 @inventarios_bp.route('/inventarios', methods=['GET'])
+@conditional_get('productos')
 def list_inventarios():
-    """Listar productos con información de inventario (stock/existencia)."""
+    """Listar productos con información de inventario (stock/existencia).
+
+    `fields` (separados por comas) limita los campos devueltos.
+    """
     try:
         limit = int(request.args.get('limit', 200))
     except Exception:
         limit = 200
+    fields = parse_fields(request.args.get('fields'))
     # Reutilizamos el helper de productos para listar.
-    items = mongo_models.list_products(limit=limit) or []
+    items = mongo_models.list_products(limit=limit, fields=expand(fields, {'existencia': ('stock', 'cantidad')})) or []
     normalized = []
     for it in items:
         if not isinstance(it, dict):
             # ignorar elementos inesperados
             continue
-        existencia = it.get('existencia')
-        if existencia is None:
-            existencia = it.get('stock', it.get('cantidad', 0))
-        try:
-            existencia = int(existencia)
-        except Exception:
-            existencia = 0
-        it['existencia'] = existencia
-        normalized.append(it)
+        if fields is None or 'existencia' in fields:
+            existencia = it.get('existencia')
+            if existencia is None:
+                existencia = it.get('stock', it.get('cantidad', 0))
+            try:
+                existencia = int(existencia)
+            except Exception:
+                existencia = 0
+            it['existencia'] = existencia
+        normalized.append(pick(it, fields))
     return jsonify({'inventarios': normalized, 'total': len(normalized)})
 
 
@@ -48,7 +57,7 @@ def list_lotes():
     out = []
     for d in docs:
         d['id'] = str(d.get('_id'))
-        out.append(d)
+        out.append(iso_fields(d, ('caducidad',), day=True))
     return jsonify({'lotes': out, 'total': len(out)})
 
 
@@ -70,34 +79,18 @@ def create_lote():
     except Exception:
         return jsonify({'error': 'cantidad inválida'}), 400
 
-    # validar y normalizar caducidad a ISO string (si se proporcionó)
-    cad_iso = None
+    # validar y normalizar caducidad a fecha BSON (día, sin hora) si se proporcionó
+    caducidad = None
     if cad:
-        parsed = None
-        # intentar formatos comunes
-        try:
-            parsed = datetime.fromisoformat(cad)
-        except Exception:
-            try:
-                parsed = datetime.strptime(cad, '%Y-%m-%d')
-            except Exception:
-                try:
-                    parsed = datetime.strptime(cad, '%d/%m/%Y')
-                except Exception:
-                    try:
-                        parsed = datetime.strptime(cad, '%d-%m-%Y')
-                    except Exception:
-                        parsed = None
-        if parsed:
-            cad_iso = parsed.date().isoformat()
-        else:
-            # si no se pudo parsear, dejar el valor tal cual (string) pero advertir en la respuesta
-            cad_iso = str(cad)
+        caducidad = parse_day(cad)
+        if caducidad is None:
+            return jsonify({'error': 'caducidad inválida (use YYYY-MM-DD o DD/MM/YYYY)'}), 400
+    cad_iso = iso(caducidad, day=True)
 
     lote = {
         'producto_id': producto_id,
         'lote': lote_val,
-        'caducidad': cad_iso,
+        'caducidad': caducidad,
         'cantidad': cantidad,
         'created_at': datetime.utcnow()
     }
@@ -106,12 +99,10 @@ def create_lote():
     try:
         pid = lote.get('producto_id')
         qty = lote.get('cantidad', 0)
-        if pid and qty:
-            try:
-                from bson import ObjectId
-                db.productos.update_one({'_id': ObjectId(pid)}, {'$inc': {'existencia': qty}})
-            except Exception:
-                db.productos.update_one({'id': pid}, {'$inc': {'existencia': qty}})
+        oid = mongo_models.resolve_product_id(pid, use_missing=False) if pid and qty else None
+        if oid is not None:
+            db.productos.update_one({'_id': oid}, {'$inc': {'existencia': qty}, '$set': mongo_models.product_change_stamp()})
+            mongo_models.refresh_product(oid)
     except Exception:
         pass
 
@@ -122,6 +113,26 @@ def create_lote():
     return jsonify(resp), 201
 
 
+def _near_expiry(db, near_date):
+    """Lotes con caducidad <= `near_date`.
+
+    Las caducidades son fechas BSON y salen por rango sobre el índice de
+    `caducidad`. Los lotes anteriores a `scripts/normalize_dates.py` la tienen
+    como string ('2024-05-31', '31/05/2024'...), que no entra en ese rango: se
+    leen aparte (`$type`, por el mismo índice) y se comparan ya interpretados.
+    """
+    mongo_models.ensure_date_indexes(db)
+    near = []
+    for l in db.lotes.find({'$or': [{'caducidad': {'$lte': near_date}}, {'caducidad': {'$type': 'string'}}]}):
+        caducidad = l.get('caducidad')
+        if isinstance(caducidad, str):
+            caducidad = parse_day(caducidad)
+            if caducidad is None or caducidad > near_date:
+                continue
+        near.append({'id': str(l.get('_id')), 'producto_id': l.get('producto_id'), 'lote': l.get('lote'), 'caducidad': iso(caducidad, day=True), 'cantidad': l.get('cantidad')})
+    return near
+
+
 @inventarios_bp.route('/inventarios/alertas', methods=['GET'])
 def inventarios_alertas():
     """Return low-stock and near-expiry alerts."""
@@ -137,11 +148,8 @@ def inventarios_alertas():
     low = []
     for p in low_cursor:
         low.append({'id': str(p.get('_id')), 'nombre': p.get('Nombre_comercial'), 'existencia': p.get('existencia', p.get('stock', p.get('cantidad', 0)))})
-    # near expiry: look into lotes collection
-    near_cursor = db.lotes.find({'caducidad': {'$lte': near_date.isoformat()}})
-    near = []
-    for l in near_cursor:
-        near.append({'id': str(l.get('_id')), 'producto_id': l.get('producto_id'), 'lote': l.get('lote'), 'caducidad': l.get('caducidad'), 'cantidad': l.get('cantidad')})
+    # near expiry: look into lotes collection (rango sobre el índice de caducidad)
+    near = _near_expiry(db, near_date)
     return jsonify({'alertas': {'low_stock': low, 'near_expiry': near}})
 
 
@@ -196,20 +204,8 @@ def report_inventario():
     for p in low_cursor:
         low.append({'id': str(p.get('_id')), 'nombre': p.get('Nombre_comercial'), 'existencia': p.get('existencia', p.get('stock', p.get('cantidad', 0)))})
 
-    # near expiry: buscar en lotes por caducidad <= near_date
-    try:
-        near_cursor = db.lotes.find({'caducidad': {'$lte': near_date.isoformat()}})
-    except Exception:
-        # si la caducidad se almacenó como fecha, comparar directamente
-        near_cursor = db.lotes.find()
-    near = []
-    for l in near_cursor:
-        cad = l.get('caducidad')
-        # intentar convertir si es fecha/string
-        try:
-            near.append({'id': str(l.get('_id')), 'producto_id': l.get('producto_id'), 'lote': l.get('lote'), 'caducidad': l.get('caducidad'), 'cantidad': l.get('cantidad')})
-        except Exception:
-            continue
+    # near expiry: buscar en lotes por caducidad <= near_date (fecha BSON, por índice)
+    near = _near_expiry(db, near_date)
 
     # kardex por producto si se solicitó
     kardex = None
@@ -234,14 +230,17 @@ def report_inventario():
             for it in t.get('items', []):
                 if it.get('id_producto') == product_id:
                     out.append({'tipo': 'traspaso', 'cantidad': it.get('cantidad'), 'fecha': t.get('fecha')})
-        try:
-            kardex = sorted(out, key=lambda x: x.get('fecha') or '')
-        except Exception:
-            kardex = out
+        kardex = _sorted_kardex(out)
 
     return jsonify({'kardex': kardex, 'low_stock': low, 'near_expiry': near})
 
 
+def _sorted_kardex(movimientos):
+    """Ordenar movimientos por fecha (los que no la tienen al principio) y devolverla en ISO."""
+    movimientos.sort(key=lambda x: parse_date(x.get('fecha')) or datetime.min)
+    return [iso_fields(m, ('fecha',)) for m in movimientos]
+
+
 @inventarios_bp.route('/inventarios/kardex/<product_id>', methods=['GET'])
 def inventarios_kardex(product_id):
     db = getattr(mongo_models, 'get_db')()
@@ -269,12 +268,7 @@ def inventarios_kardex(product_id):
         for it in t.get('items', []):
             if it.get('id_producto') == product_id:
                 out.append({'tipo': 'traspaso', 'cantidad': it.get('cantidad'), 'fecha': t.get('fecha')})
-    # sort by fecha if exists
-    try:
-        out_sorted = sorted(out, key=lambda x: x.get('fecha') or '')
-    except Exception:
-        out_sorted = out
-    return jsonify({'kardex': out_sorted})
+    return jsonify({'kardex': _sorted_kardex(out)})
 
 
 @inventarios_bp.route('/traspasos', methods=['POST'])
@@ -298,6 +292,10 @@ def create_pedido():
         return jsonify({'error': 'proveedor requerido'}), 400
     if not isinstance(items, list) or not items:
         return jsonify({'error': 'items (lista) requerida'}), 400
+    if fecha:
+        fecha = parse_date(fecha)
+        if fecha is None:
+            return jsonify({'error': 'fecha inválida'}), 400
 
     # validar items: cada item debe tener producto_id/id_producto y cantidad
     for it in items:
@@ -328,7 +326,7 @@ def list_pedidos():
     out = []
     for d in docs:
         d['id'] = str(d.get('_id'))
-        out.append(d)
+        out.append(iso_fields(d, ('fecha',)))
     return jsonify({'pedidos': out, 'total': len(out)})
 
 
@@ -345,7 +343,7 @@ def get_pedido(pedido_id):
     if not doc:
         return jsonify({'error': 'pedido no encontrado'}), 404
     doc['id'] = str(doc.get('_id'))
-    return jsonify(doc)
+    return jsonify(iso_fields(doc, ('fecha',)))
 
 
 @inventarios_bp.route('/pedidos/<pedido_id>/estado', methods=['PUT'])
@@ -376,16 +374,17 @@ def update_pedido_estado(pedido_id):
     # Si se marca como recibido o completado, incrementar stock de productos
     if str(nuevo_estado).lower() in ('recibido', 'completado'):
         try:
-            for it in pedido.get('items', []):
+            items = pedido.get('items', [])
+            oids = mongo_models.resolve_product_ids([it.get('producto_id') or it.get('id_producto') or it.get('id') for it in items],
+                                                   use_missing=False)
+            for it in items:
                 prod_id = it.get('producto_id') or it.get('id_producto') or it.get('id')
                 qty = int(it.get('cantidad') or 0)
-                if not prod_id or qty <= 0:
+                oid = oids.get(prod_id)
+                if oid is None or qty <= 0:
                     continue
-                try:
-                    from bson import ObjectId
-                    db.productos.update_one({'_id': ObjectId(prod_id)}, {'$inc': {'existencia': qty}})
-                except Exception:
-                    db.productos.update_one({'id': prod_id}, {'$inc': {'existencia': qty}})
+                db.productos.update_one({'_id': oid}, {'$inc': {'existencia': qty}, '$set': mongo_models.product_change_stamp()})
+                mongo_models.refresh_product(oid)
         except Exception:
             pass
 
@@ -1,5 +1,6 @@
 # Funciones helper para invoices/facturas en MongoDB
 from ..mongo_client import mongo
+from .. import mongo_models
 from bson import ObjectId
 from datetime import datetime
 
@@ -29,18 +30,14 @@ def create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=None
         'nota': nota,
     }
     # --- validate stock first (don't modify DB yet) ---
+    # resolve every product of the cart in a single query
+    prods = mongo_models.find_product_docs([item.get('id_producto') for item in items], use_missing=False)
     for item in items:
         prod_id = item.get('id_producto')
         cantidad = int(item.get('cantidad') or 0)
         if not prod_id or not cantidad:
             continue
-        try:
-            oid = ObjectId(prod_id)
-            query = {'_id': oid}
-        except Exception:
-            query = {'id': str(prod_id)}
-
-        doc = db.productos.find_one(query)
+        doc = prods.get(prod_id)
         if not doc:
             raise ValueError(f'Producto {prod_id} no encontrado')
 
@@ -77,26 +74,16 @@ def create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=None
 
         # intentar decrementar stock en productos
         try:
-            prod_id = item.get('id_producto')
-            if not prod_id:
-                continue
-            # si parece ObjectId
-            try:
-                oid = ObjectId(prod_id)
-                query = {'_id': oid}
-            except Exception:
-                query = {'id': str(prod_id)}
-
+            doc = prods.get(item.get('id_producto'))
             cantidad = int(item.get('cantidad') or 0)
-            if cantidad:
-                doc = db.productos.find_one(query)
-                if doc:
-                    updates = {}
-                    for f in ('cantidad', 'stock', 'existencia'):
-                        if f in doc:
-                            updates[f] = -cantidad
-                    if updates:
-                        db.productos.update_one(query, {'$inc': updates})
+            if cantidad and doc:
+                updates = {}
+                for f in ('cantidad', 'stock', 'existencia'):
+                    if f in doc:
+                        updates[f] = -cantidad
+                if updates:
+                    db.productos.update_one({'_id': doc['_id']}, {'$inc': updates, '$set': mongo_models.product_change_stamp()})
+                    mongo_models.refresh_product(doc['_id'])
         except Exception:
             pass
 
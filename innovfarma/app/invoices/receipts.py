@@ -0,0 +1,281 @@
+"""Generación de comprobantes TXT en segundo plano (backend SQL).
+
+`sql_helpers.create_factura` ya no formatea ni escribe el comprobante dentro
+de la venta: solo anota el id de la factura en una cola local y responde. Un
+pool de hilos (`RECEIPT_WORKERS`) toma las facturas pendientes por lotes,
+resuelve los nombres de productos de todo el lote en una consulta y escribe
+los ficheros en `receipts/` (ver `sql_helpers.render_comprobantes`).
+
+La cola es durable: vive en un SQLite propio (`receipts/pendientes.sqlite`)
+y una factura solo sale de ella cuando su comprobante está escrito, así que
+lo que quede pendiente al parar la app se procesa al volver a arrancar. La
+comparten todos los procesos que usan la misma carpeta (workers de gunicorn):
+cada uno reserva las filas que va a procesar (`owner` + `lease`, con un
+`UPDATE` condicionado a que nadie las tenga), así cada comprobante lo genera
+un solo proceso. Si el proceso muere, la reserva caduca y otro la retoma.
+Los reintentos también van en la tabla (`siguiente`), no en temporizadores
+de cada proceso; las facturas que agotan `MAX_INTENTOS` pasan a `fallidos`.
+
+`GET /api/facturas/<id>/comprobante` devuelve el resultado.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+DEFAULT_DIR = Path(__file__).resolve().parents[2] / 'receipts'
+DEFAULT_WORKERS = 2
+BATCH_SIZE = 50
+MAX_INTENTOS = 5
+# segundos que una fila queda reservada por el proceso que la tomó (debe cubrir un lote)
+LEASE = 120
+# cada cuánto mira un hilo ocioso si hay trabajo de otros procesos o reintentos vencidos
+POLL_INTERVAL = 1.0
+
+
+def receipt_path(id_factura, carpeta=None):
+    return Path(carpeta or DEFAULT_DIR) / f"factura_{id_factura}.txt"
+
+
+def write_receipt(id_factura, texto, carpeta=None):
+    """Escribir el comprobante de forma atómica (fichero temporal + `os.replace`)."""
+    nombre = receipt_path(id_factura, carpeta)
+    nombre.parent.mkdir(parents=True, exist_ok=True)
+    tmp = nombre.with_name(f"{nombre.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(texto)
+    os.replace(tmp, nombre)
+    return str(nombre)
+
+
+class ReceiptQueue:
+    """Ids de factura pendientes de comprobante, persistidos en SQLite y
+    compartidos entre procesos; `owner` identifica a este proceso en las reservas."""
+
+    def __init__(self, path, owner=None, lease=LEASE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.owner = owner or uuid.uuid4().hex
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS pendientes ('
+            'id_factura TEXT PRIMARY KEY, intentos INTEGER NOT NULL DEFAULT 0, '
+            'creado REAL NOT NULL, error TEXT)'
+        )
+        # colas creadas antes de las reservas
+        columnas = {r[1] for r in self._conn.execute('PRAGMA table_info(pendientes)')}
+        for columna, tipo in (('owner', 'TEXT'), ('lease', 'REAL'), ('siguiente', 'REAL NOT NULL DEFAULT 0')):
+            if columna not in columnas:
+                self._conn.execute(f'ALTER TABLE pendientes ADD COLUMN {columna} {tipo}')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS pendientes_siguiente ON pendientes (siguiente, creado)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS fallidos ('
+            'id_factura TEXT PRIMARY KEY, intentos INTEGER NOT NULL, error TEXT, fecha REAL NOT NULL)'
+        )
+
+    def put(self, id_factura):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO pendientes (id_factura, creado) VALUES (?, ?)',
+                (str(id_factura), time.time()),
+            )
+
+    def claim(self, limit):
+        """Reservar hasta `limit` ids libres (o con la reserva caducada) cuyo reintento ya toca."""
+        now = time.time()
+        with self._lock:
+            candidatos = self._conn.execute(
+                'SELECT id_factura FROM pendientes WHERE siguiente <= ? AND (owner IS NULL OR lease < ?) '
+                'ORDER BY creado LIMIT ?', (now, now, limit)
+            ).fetchall()
+            if not candidatos:
+                return []
+            tomados = []
+            self._conn.execute('BEGIN')
+            try:
+                for (id_factura,) in candidatos:
+                    # otro proceso pudo reservarla entre el SELECT y aquí: solo cuenta si la fila cambió
+                    cur = self._conn.execute(
+                        'UPDATE pendientes SET owner = ?, lease = ? '
+                        'WHERE id_factura = ? AND (owner IS NULL OR lease < ?)',
+                        (self.owner, now + self.lease, id_factura, now),
+                    )
+                    if cur.rowcount:
+                        tomados.append(id_factura)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return tomados
+
+    def done(self, ids):
+        with self._lock:
+            self._conn.executemany('DELETE FROM pendientes WHERE id_factura = ? AND owner = ?',
+                                   [(str(i), self.owner) for i in ids])
+
+    def failed(self, id_factura, error):
+        """Sumar un intento fallido y liberar la reserva con espera creciente (2, 4, 8... s).
+
+        Al agotar `MAX_INTENTOS` la factura pasa a `fallidos`. Devuelve los
+        intentos hechos (0 si ya no está en la cola o no es nuestra).
+        """
+        error = str(error)[:500]
+        with self._lock:
+            row = self._conn.execute('SELECT intentos FROM pendientes WHERE id_factura = ? AND owner = ?',
+                                     (str(id_factura), self.owner)).fetchone()
+            if not row:
+                return 0
+            intentos = row[0] + 1
+            self._conn.execute('BEGIN')
+            try:
+                if intentos >= MAX_INTENTOS:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO fallidos (id_factura, intentos, error, fecha) VALUES (?, ?, ?, ?)',
+                        (str(id_factura), intentos, error, time.time()),
+                    )
+                    self._conn.execute('DELETE FROM pendientes WHERE id_factura = ?', (str(id_factura),))
+                else:
+                    self._conn.execute(
+                        'UPDATE pendientes SET intentos = ?, error = ?, owner = NULL, lease = NULL, siguiente = ? '
+                        'WHERE id_factura = ?',
+                        (intentos, error, time.time() + 2 ** intentos, str(id_factura)),
+                    )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return intentos
+
+    def get(self, id_factura):
+        """{'intentos', 'error', 'agotado'} de una factura en la cola o en `fallidos`; None si no está."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT intentos, error FROM pendientes WHERE id_factura = ?', (str(id_factura),)
+            ).fetchone()
+            if row:
+                return {'intentos': row[0], 'error': row[1], 'agotado': False}
+            row = self._conn.execute(
+                'SELECT intentos, error FROM fallidos WHERE id_factura = ?', (str(id_factura),)
+            ).fetchone()
+        return {'intentos': row[0], 'error': row[1], 'agotado': True} if row else None
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM pendientes').fetchone()[0]
+
+    def count_failed(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM fallidos').fetchone()[0]
+
+
+class ReceiptWorkerPool:
+    """Hilos que vacían la cola llamando a `render(ids) -> {id: texto | Exception}`."""
+
+    def __init__(self, app, render, carpeta=None, workers=DEFAULT_WORKERS, batch_size=BATCH_SIZE):
+        self.app = app
+        self.render = render
+        self.carpeta = Path(carpeta or DEFAULT_DIR)
+        self.batch_size = batch_size
+        # lo que quedó pendiente de una ejecución anterior se reserva de la cola como lo demás
+        self.store = ReceiptQueue(self.carpeta / 'pendientes.sqlite')
+        self._wake = threading.Event()
+        self._threads = []
+        self.escritos = 0
+        self.errores = 0
+        for i in range(max(1, int(workers))):
+            t = threading.Thread(target=self._run, name=f'comprobantes-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, id_factura):
+        self.store.put(id_factura)
+        self._wake.set()
+
+    def _take_batch(self):
+        while True:
+            self._wake.clear()
+            try:
+                ids = self.store.claim(self.batch_size)
+            except sqlite3.Error:
+                # base ocupada por otro proceso más allá del timeout: probar en la siguiente vuelta
+                ids = []
+            if ids:
+                return ids
+            self._wake.wait(POLL_INTERVAL)
+
+    def _run(self):
+        while True:
+            ids = self._take_batch()
+            try:
+                with self.app.app_context():
+                    textos = self.render(ids)
+            except Exception as e:
+                textos = {i: e for i in ids}
+            hechos = []
+            for id_factura in ids:
+                texto = textos.get(id_factura)
+                try:
+                    if isinstance(texto, Exception):
+                        raise texto
+                    if texto is None:
+                        # la factura ya no existe: nada que generar
+                        hechos.append(id_factura)
+                        continue
+                    write_receipt(id_factura, texto, self.carpeta)
+                    hechos.append(id_factura)
+                    self.escritos += 1
+                except Exception as e:
+                    self.errores += 1
+                    try:
+                        self.store.failed(id_factura, e)
+                    except sqlite3.Error:
+                        # la reserva caduca y se reintenta igual
+                        pass
+            if hechos:
+                self.store.done(hechos)
+
+    def status(self, id_factura):
+        """'listo', 'pendiente', 'error' (intentos agotados) o None si no hay rastro."""
+        if receipt_path(id_factura, self.carpeta).exists():
+            return 'listo'
+        estado = self.store.get(id_factura)
+        if estado is None:
+            return None
+        return 'error' if estado['agotado'] else 'pendiente'
+
+    def stats(self):
+        return {
+            'workers': len(self._threads),
+            'en_cola': self.store.count(),
+            'fallidos': self.store.count_failed(),
+            'escritos': self.escritos,
+            'errores': self.errores,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def start(app, render):
+    """Arrancar (una vez por proceso) el pool de comprobantes."""
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ReceiptWorkerPool(
+                app, render,
+                carpeta=app.config.get('RECEIPTS_DIR'),
+                workers=app.config.get('RECEIPT_WORKERS', DEFAULT_WORKERS),
+            )
+    return _pool
+
+
+def get_pool():
+    return _pool
@@ -8,6 +8,9 @@ except Exception:
     mongo_helpers = None
 
 from . import sql_helpers as sql_helpers
+from ..pagination import decode_cursor, next_cursor
+from ..projection import parse_fields
+from ..idempotency import idempotent
 
 invoices_bp = Blueprint('invoices', __name__)
 
@@ -21,12 +24,31 @@ def _helpers():
 @invoices_bp.route('/facturas', methods=['GET'])
 @login_required
 def list_invoices():
+    """Listar facturas (más recientes primero) por `page` u opaco `cursor`.
+
+    Sin `cursor` se devuelve la lista como siempre y el cursor siguiente va en
+    la cabecera `X-Next-Cursor`; con `cursor` (vacío = primera página) la
+    respuesta es {'facturas': [...], 'next_cursor': ...}. `fields` (separados
+    por comas) limita los campos devueltos.
+    """
     page = request.args.get('page', 0, type=int)
     limit = request.args.get('limit', 100, type=int)
     skip = page * limit
+    cursor = request.args.get('cursor')
+    fields = parse_fields(request.args.get('fields'))
+    try:
+        after_id = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     h = _helpers()
-    facturas = h.list_facturas(limit=limit, skip=skip)
-    return jsonify(facturas)
+    facturas = h.list_facturas(limit=limit, skip=skip, after_id=after_id, fields=fields)
+    siguiente = next_cursor(facturas, limit)
+    if cursor is not None:
+        return jsonify({'facturas': facturas, 'total': len(facturas), 'next_cursor': siguiente})
+    resp = jsonify(facturas)
+    if siguiente:
+        resp.headers['X-Next-Cursor'] = siguiente
+    return resp
 
 
 @invoices_bp.route('/facturas/informe', methods=['GET'])
@@ -71,6 +93,7 @@ def get_invoice(factura_id):
 
 @invoices_bp.route('/facturas', methods=['POST'])
 @login_required
+@idempotent('facturas')
 def create_invoice():
     data = request.get_json() or {}
     cliente_id = data.get('id_cliente')
@@ -110,8 +133,9 @@ def create_invoice():
                 return jsonify({'error': 'Acción no permitida: solo vendedores pueden crear facturas'}), 403
 
         h = _helpers()
-        # pass payment details when creating invoice
-        factura_id = h.create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=recibido, cambio=cambio, nota=nota)
+        # pass payment details when creating invoice (y el usuario ya leído, para no volver a buscarlo)
+        extra = {'usuario': doc} if doc else {}
+        factura_id = h.create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=recibido, cambio=cambio, nota=nota, **extra)
         # try to return the full factura object so frontend can show recibo/cambio/fecha/numero immediately
         try:
             factura = h.get_factura(factura_id)
@@ -136,3 +160,21 @@ def get_invoice_detail(factura_id):
     if detalle is None:
         return jsonify({'error': 'factura no encontrada'}), 404
     return jsonify(detalle)
+
+
+@invoices_bp.route('/facturas/<factura_id>/comprobante', methods=['GET'])
+@login_required
+def get_invoice_receipt(factura_id):
+    """Comprobante TXT de la factura, generado en segundo plano al crearla.
+
+    200 con {'estado': 'listo', 'comprobante': texto}; 202 mientras sigue en
+    la cola ('pendiente'); 500 si se agotaron los reintentos ('error').
+    """
+    h = _helpers()
+    if not hasattr(h, 'get_comprobante'):
+        return jsonify({'error': 'Comprobante no soportado por el adaptador actual'}), 501
+    comprobante = h.get_comprobante(factura_id)
+    if comprobante is None:
+        return jsonify({'error': 'factura no encontrada'}), 404
+    status = {'listo': 200, 'pendiente': 202}.get(comprobante.get('estado'), 500)
+    return jsonify(comprobante), status
@@ -1,11 +1,16 @@
 # Funciones helper para facturas con SQLAlchemy
 from ..models import db, Factura, DetalleFactura, Cliente, Product
 from datetime import datetime
-from pathlib import Path
+from flask import current_app
 from sqlalchemy import func
+from . import receipts
+from ..projection import pick_rows, sql_columns
+from ..products.result_cache import result_cache
 
 
-def _formatear_comprobante_txt(datos_factura, cliente, detalles):
+def _formatear_comprobante_txt(datos_factura, cliente, detalles, nombres=None):
+    """Texto del comprobante. `nombres`: {id_producto: Nombre_comercial} ya resuelto."""
+    nombres = nombres or {}
     lineas = []
     lineas.append(f"FACTURA ID: {datos_factura.get('id')}")
     lineas.append(f"FECHA: {datos_factura.get('fecha')}")
@@ -20,19 +25,13 @@ def _formatear_comprobante_txt(datos_factura, cliente, detalles):
     lineas.append(f"{'Cant':>4}  {'Descripción':<40} {'P.Unit':>8} {'Subtotal':>10}")
     lineas.append("-" * 70)
     for d in detalles:
-        # intentar obtener nombre del producto
-        prod = None
-        try:
-            prod = Product.query.get(d.get('id_producto'))
-        except Exception:
-            prod = None
-        desc = prod.Nombre_comercial if prod and getattr(prod, 'Nombre_comercial', None) else str(d.get('id_producto'))
+        desc = nombres.get(d.get('id_producto')) or str(d.get('id_producto'))
         cantidad = d.get('cantidad') or 0
         precio_unit = d.get('precio_unitario') or 0
         subtotal = d.get('subtotal') or (cantidad * precio_unit)
         lineas.append(f"{cantidad:>4}  {desc:<40} {precio_unit:>8.2f} {subtotal:>10.2f}")
     lineas.append("-" * 70)
-    lineas.append(f"TOTAL: {datos_factura.get('total'):.2f}")
+    lineas.append(f"TOTAL: {(datos_factura.get('total') or 0):.2f}")
     if datos_factura.get('recibido') is not None:
         lineas.append(f"EFECTIVO RECIBIDO: {datos_factura.get('recibido'):.2f}")
     if datos_factura.get('cambio') is not None:
@@ -43,15 +42,87 @@ def _formatear_comprobante_txt(datos_factura, cliente, detalles):
     return "\n".join(lineas)
 
 
-def _guardar_comprobante_txt(id_factura, texto):
-    # Guardar en carpeta receipts bajo el root del proyecto
-    raiz = Path(__file__).resolve().parents[2]
-    carpeta = raiz / 'receipts'
-    carpeta.mkdir(parents=True, exist_ok=True)
-    nombre = carpeta / f"factura_{id_factura}.txt"
-    with open(nombre, 'w', encoding='utf-8') as f:
-        f.write(texto)
-    return str(nombre)
+def _factura_ids(ids):
+    out = []
+    for i in ids:
+        try:
+            out.append(int(i))
+        except (TypeError, ValueError):
+            continue
+    return out
+
+
+def render_comprobantes(ids):
+    """Textos de comprobante de un lote de facturas: {id (str): texto}; None si la factura no existe.
+
+    Facturas, detalles, clientes y nombres de productos se leen con una
+    consulta `IN` cada uno para todo el lote (lo usa el pool de `receipts`).
+    """
+    fids = _factura_ids(ids)
+    facturas = {f.id: f for f in Factura.query.filter(Factura.id.in_(fids)).all()} if fids else {}
+    detalles = {}
+    if facturas:
+        for d in DetalleFactura.query.filter(DetalleFactura.id_factura.in_(list(facturas))).order_by(DetalleFactura.id).all():
+            detalles.setdefault(d.id_factura, []).append({
+                'id_producto': d.id_producto,
+                'cantidad': d.cantidad or 0,
+                'precio_unitario': d.precio_unitario or 0,
+                'subtotal': d.subtotal,
+            })
+    cids = {f.id_cliente for f in facturas.values() if f.id_cliente is not None}
+    clientes = {c.id: c for c in Cliente.query.filter(Cliente.id.in_(cids)).all()} if cids else {}
+    pids = {d['id_producto'] for ds in detalles.values() for d in ds if d['id_producto'] is not None}
+    nombres = {}
+    if pids:
+        for pid, nombre in db.session.query(Product.id, Product.Nombre_comercial).filter(Product.id.in_(pids)):
+            if nombre:
+                nombres[pid] = nombre
+
+    out = {}
+    for i in ids:
+        try:
+            factura = facturas.get(int(i))
+        except (TypeError, ValueError):
+            factura = None
+        if factura is None:
+            out[i] = None
+            continue
+        datos_factura = {
+            'id': factura.id,
+            'fecha': factura.fecha.isoformat() if factura.fecha else None,
+            'total': factura.total,
+            'recibido': factura.recibido,
+            'cambio': factura.cambio,
+            'nota': factura.nota,
+        }
+        out[i] = _formatear_comprobante_txt(datos_factura, clientes.get(factura.id_cliente), detalles.get(factura.id, []), nombres)
+    return out
+
+
+def _receipt_pool():
+    return receipts.start(current_app._get_current_object(), render_comprobantes)
+
+
+def get_comprobante(factura_id):
+    """Comprobante TXT de una factura: {'id_factura', 'estado', 'comprobante'}; None si no existe.
+
+    Mientras el pool no lo haya escrito, `estado` es 'pendiente' y
+    `comprobante` None. Facturas anteriores a la cola (o cuyo comprobante se
+    borró) se generan en el momento.
+    """
+    pool = _receipt_pool()
+    ruta = receipts.receipt_path(factura_id, pool.carpeta)
+    if ruta.exists():
+        return {'id_factura': factura_id, 'estado': 'listo', 'comprobante': ruta.read_text(encoding='utf-8')}
+    estado = pool.status(factura_id)
+    if estado in ('pendiente', 'error'):
+        return {'id_factura': factura_id, 'estado': estado, 'comprobante': None}
+    texto = render_comprobantes([str(factura_id)]).get(str(factura_id))
+    if texto is None:
+        return None
+    receipts.write_receipt(factura_id, texto, pool.carpeta)
+    return {'id_factura': factura_id, 'estado': 'listo', 'comprobante': texto}
+
 
 def create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=None, cambio=None, nota=None):
     """
@@ -78,6 +149,7 @@ def create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=None
     
     # Crear detalles de factura
     # Validar stock y crear detalles de factura, descontando existencia
+    vendidos = []
     for item in items:
         pid = item.get('id_producto') or item.get('id') or None
         cantidad = int(item.get('cantidad') or 0)
@@ -97,6 +169,7 @@ def create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=None
         # descontar existencia (si estaba definido)
         if exist_val is not None:
             prod.existencia = exist_val - cantidad
+            vendidos.append(prod.id)
 
         detalle = DetalleFactura()
         detalle.id_factura = factura.id
@@ -107,30 +180,14 @@ def create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=None
         db.session.add(detalle)
     
     db.session.commit()
-    # después de crear la factura, generar comprobante TXT
+    for pid in vendidos:
+        result_cache.invalidate_product(pid)
+    # el comprobante TXT lo genera el pool en segundo plano (ver receipts.py)
     try:
-        datos_factura = {
-            'id': factura.id,
-            'fecha': factura.fecha.isoformat() if factura.fecha else None,
-            'total': factura.total,
-            'recibido': factura.recibido,
-            'cambio': factura.cambio,
-            'nota': factura.nota,
-        }
-        lista_detalles = []
-        for item in items:
-            lista_detalles.append({
-                'id_producto': item.get('id_producto') or item.get('id') or None,
-                'cantidad': item.get('cantidad') or 0,
-                'precio_unitario': item.get('precio_unitario') or item.get('precio') or 0,
-                'subtotal': item.get('subtotal') or ( (item.get('cantidad') or 0) * (item.get('precio_unitario') or item.get('precio') or 0) ),
-            })
-        texto = _formatear_comprobante_txt(datos_factura, cliente, lista_detalles)
-        ruta = _guardar_comprobante_txt(factura.id, texto)
-        # opcional: podríamos guardar la ruta en la base o loggear
+        _receipt_pool().submit(factura.id)
     except Exception:
-        # no debemos fallar la creación de la factura por un error en el guardado del txt
-        ruta = None
+        # no debemos fallar la creación de la factura por la cola de comprobantes
+        pass
 
     return factura.id
 
@@ -165,20 +222,34 @@ def get_factura(factura_id):
         'detalles': detalles_data,
     }
 
-def list_facturas(limit=100, skip=0):
-    """Listar facturas con paginación"""
-    facturas = Factura.query.order_by(Factura.fecha.desc()).offset(skip).limit(limit).all()
-    out = []
-    for factura in facturas:
-        out.append({
-            'id': factura.id,
-            'id_usuario': factura.id_usuario,
-            'id_cliente': factura.id_cliente,
-            'id_sucursal': factura.id_sucursal,
-            'fecha': factura.fecha.isoformat() if factura.fecha else None,
-            'total': factura.total,
-        })
-    return out
+def _factura_resumen(factura):
+    """Factura tal como sale en el listado (sin detalles)"""
+    return {
+        'id': factura.id,
+        'id_usuario': factura.id_usuario,
+        'id_cliente': factura.id_cliente,
+        'id_sucursal': factura.id_sucursal,
+        'fecha': factura.fecha.isoformat() if factura.fecha else None,
+        'total': factura.total,
+    }
+
+def list_facturas(limit=100, skip=0, after_id=None, fields=None):
+    """Listar facturas con paginación, de la más reciente a la más antigua
+
+    Con `after_id` (cursor) se pagina por id descendente en lugar de offset;
+    con `fields` solo se seleccionan esas columnas.
+    """
+    if fields is not None:
+        query = db.session.query(*sql_columns(Factura, fields)).order_by(Factura.id.desc())
+    else:
+        query = Factura.query.order_by(Factura.id.desc())
+    if after_id is not None:
+        facturas = query.filter(Factura.id < after_id).limit(limit).all()
+    else:
+        facturas = query.offset(skip).limit(limit).all()
+    if fields is not None:
+        return pick_rows(facturas, _factura_resumen, fields)
+    return [_factura_resumen(f) for f in facturas]
 
 def get_detalle_factura(factura_id):
     """Retorna los items/detalles de una factura"""
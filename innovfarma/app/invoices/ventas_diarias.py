@@ -0,0 +1,258 @@
+"""Rollups de ventas por día (`ventas_diarias`) para el informe de ventas.
+
+Una fila por (dia, id_sucursal, id_usuario, id_producto):
+
+- con `id_producto` nulo, los totales de las facturas de ese día, sucursal y
+  vendedor (`total`, `facturas`);
+- con producto, lo vendido de ese producto (`cantidad`, `importe`).
+
+Además, por cada factura sumada hay una marca `{'_id': 'factura:<id>'}` en
+la misma colección: `apply_factura` solo suma una factura si puede crear su
+marca, así que aplicarla dos veces no la cuenta dos veces. Las marcas viajan
+con los rollups cuando `rebuild` sustituye la colección.
+
+`mongo_models.create_factura` los incrementa con `$inc` en la misma
+transacción que la factura. `rebuild` los recalcula desde `facturas` y
+`detalle_factura` (ver `scripts/rebuild_ventas_diarias.py`); hasta que se
+ejecuta por primera vez, `is_ready` es False y el informe se calcula sobre
+las facturas.
+"""
+from datetime import datetime
+
+from pymongo import ASCENDING, UpdateOne
+
+from ..dates import parse_date
+
+COLLECTION = 'ventas_diarias'
+STATE_COLLECTION = 'rollups_estado'
+KEY_FIELDS = ('dia', 'id_sucursal', 'id_usuario', 'id_producto')
+MARK_PREFIX = 'factura:'
+
+BATCH_SIZE = 1000
+
+
+def day_key(fecha):
+    """'YYYY-MM-DD' de una fecha (datetime o string ISO)."""
+    if not fecha:
+        return None
+    if hasattr(fecha, 'date'):
+        return fecha.date().isoformat()
+    return str(fecha)[:10]
+
+
+def is_whole_day(fecha):
+    """True si la fecha no lleva hora (medianoche exacta): se interpreta como el día entero."""
+    return (fecha.hour, fecha.minute, fecha.second, fecha.microsecond) == (0, 0, 0, 0)
+
+
+def day_range(fecha_inicio=None, fecha_fin=None):
+    """Rango de días (inclusivo) equivalente al filtro, o None si no cae en días enteros.
+
+    Los rollups solo pueden responder filtros por fecha sin hora (p. ej.
+    `fecha_fin=2024-01-31` cuenta todo el 31; el informe sobre las facturas
+    usa el mismo criterio); con hora, el informe se calcula sobre las facturas.
+    """
+    out = []
+    for f in (fecha_inicio, fecha_fin):
+        if not f:
+            out.append(None)
+            continue
+        f = parse_date(f)
+        if f is None or not is_whole_day(f):
+            return None
+        out.append(f.date().isoformat())
+    return tuple(out)
+
+
+def _num(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _qty(value):
+    v = _num(value)
+    return int(v) if v.is_integer() else v
+
+
+def _key(dia, factura, producto=None):
+    return {
+        'dia': dia,
+        'id_sucursal': factura.get('id_sucursal'),
+        'id_usuario': factura.get('id_usuario'),
+        'id_producto': producto,
+    }
+
+
+def increments(factura, detalles):
+    """Operaciones `$inc` (upsert) que suman una factura a los rollups."""
+    dia = day_key(factura.get('fecha'))
+    if dia is None:
+        return []
+    ops = [UpdateOne(_key(dia, factura), {'$inc': {'total': _num(factura.get('total')), 'facturas': 1}}, upsert=True)]
+    por_producto = {}
+    for d in detalles:
+        pid = d.get('id_producto')
+        if pid in (None, ''):
+            continue
+        cantidad, importe = por_producto.get(pid, (0, 0.0))
+        cantidad += _qty(d.get('cantidad'))
+        importe += _num(d.get('subtotal')) or _num(d.get('cantidad')) * _num(d.get('precio_unitario'))
+        por_producto[pid] = (cantidad, importe)
+    for pid, (cantidad, importe) in por_producto.items():
+        ops.append(UpdateOne(_key(dia, factura, pid), {'$inc': {'cantidad': cantidad, 'importe': importe}}, upsert=True))
+    return ops
+
+
+def mark_id(factura_id):
+    return MARK_PREFIX + str(factura_id)
+
+
+def _marks_range():
+    # las marcas son los `_id` string con el prefijo (';' sigue a ':' en ASCII)
+    return {'_id': {'$gte': MARK_PREFIX, '$lt': MARK_PREFIX[:-1] + ';'}}
+
+
+def apply_factura(db, factura, detalles, session=None):
+    """Sumar una factura a los rollups si aún no estaba sumada.
+
+    Primero crea la marca de la factura (upsert sobre `_id`, a prueba de
+    concurrencia) y solo si es nueva aplica los `$inc` en un `bulk_write`.
+    Devuelve True si la sumó.
+    """
+    col = db[COLLECTION]
+    res = col.update_one({'_id': mark_id(factura['_id'])}, {'$setOnInsert': {'factura': str(factura['_id'])}},
+                         upsert=True, session=session)
+    if res.upserted_id is None:
+        return False
+    ops = increments(factura, detalles)
+    if ops:
+        col.bulk_write(ops, ordered=False, session=session)
+    return True
+
+
+def ensure_indexes(db, collection=COLLECTION):
+    # las marcas no tienen campos de clave: quedan fuera del índice único
+    db[collection].create_index([(f, ASCENDING) for f in KEY_FIELDS], unique=True, name='dia_sucursal_usuario_producto',
+                                partialFilterExpression={'dia': {'$type': 'string'}})
+    db[collection].create_index([('id_usuario', ASCENDING), ('dia', ASCENDING)], name='usuario_dia')
+
+
+def is_ready(db):
+    estado = db[STATE_COLLECTION].find_one({'_id': COLLECTION}, {'listo': 1})
+    return bool(estado and estado.get('listo'))
+
+
+def _write_rows(col, rows):
+    batch = []
+    for key, values in rows.items():
+        batch.append(UpdateOne(dict(zip(KEY_FIELDS, key)), {'$inc': values}, upsert=True))
+        if len(batch) >= BATCH_SIZE:
+            col.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        col.bulk_write(batch, ordered=False)
+
+
+def _write_marks(col, fids):
+    for i in range(0, len(fids), BATCH_SIZE):
+        col.insert_many([{'_id': mark_id(fid), 'factura': fid} for fid in fids[i:i + BATCH_SIZE]], ordered=False)
+
+
+def rebuild(db, log=print):
+    """Recalcular `ventas_diarias` desde cero sin dejar el informe sin datos.
+
+    Se construye (rollups y marcas) en una colección temporal que luego
+    reemplaza a la actual con `rename`. Las facturas que se sumaron a la
+    colección antigua mientras tanto y no entraron en el recorrido se
+    detectan después por no tener marca y se suman con `apply_factura`; las
+    que se crean después del `rename` ya se suman a la nueva, y su marca
+    evita contarlas otra vez. Devuelve el número de facturas procesadas.
+    """
+    tmp_name = COLLECTION + '_tmp'
+    db[tmp_name].drop()
+    tmp = db[tmp_name]
+    ensure_indexes(db, tmp_name)
+
+    # cabeceras: totales por día, sucursal y vendedor; y fid -> clave para los detalles
+    rows = {}
+    claves = {}
+    n = 0
+    for f in db.facturas.find({}, {'fecha': 1, 'id_sucursal': 1, 'id_usuario': 1, 'total': 1}):
+        fid = str(f['_id'])
+        dia = day_key(f.get('fecha'))
+        if dia is None:
+            claves[fid] = None
+            continue
+        base = (dia, f.get('id_sucursal'), f.get('id_usuario'))
+        claves[fid] = base
+        v = rows.setdefault(base + (None,), {'total': 0.0, 'facturas': 0})
+        v['total'] += _num(f.get('total'))
+        v['facturas'] += 1
+        n += 1
+    log(f'facturas procesadas: {n}')
+
+    for d in db.detalle_factura.find({}, {'id_factura': 1, 'id_producto': 1, 'cantidad': 1, 'subtotal': 1, 'precio_unitario': 1}):
+        base = claves.get(str(d.get('id_factura')))
+        pid = d.get('id_producto')
+        if base is None or pid in (None, ''):
+            continue
+        v = rows.setdefault(base + (pid,), {'cantidad': 0, 'importe': 0.0})
+        v['cantidad'] += _qty(d.get('cantidad'))
+        v['importe'] += _num(d.get('subtotal')) or _num(d.get('cantidad')) * _num(d.get('precio_unitario'))
+    _write_rows(tmp, rows)
+    _write_marks(tmp, list(claves))
+    log(f'filas de rollup: {len(rows)}')
+
+    tmp.rename(COLLECTION, dropTarget=True)
+
+    # facturas sumadas a la colección reemplazada durante el recorrido: sin marca en la nueva
+    marcadas = {d['_id'][len(MARK_PREFIX):] for d in db[COLLECTION].find(_marks_range(), {'_id': 1})}
+    recuperadas = 0
+    for f in db.facturas.find({}, {'_id': 1}):
+        if str(f['_id']) in marcadas:
+            continue
+        f = db.facturas.find_one({'_id': f['_id']})
+        if f and apply_factura(db, f, list(db.detalle_factura.find({'id_factura': str(f['_id'])}))):
+            recuperadas += 1
+    if recuperadas:
+        log(f'facturas creadas durante la reconstrucción: {recuperadas}')
+    db[STATE_COLLECTION].update_one({'_id': COLLECTION}, {'$set': {'listo': True, 'reconstruido_at': datetime.utcnow()}}, upsert=True)
+    return n
+
+
+def report(db, dia_inicio=None, dia_fin=None, id_usuario=None, top_n=10):
+    """Informe de ventas desde los rollups, con la forma de `generar_informe_ventas`."""
+    # `dia` string: filas de rollup, no marcas de factura
+    match = {'dia': {'$type': 'string'}}
+    if dia_inicio:
+        match['dia']['$gte'] = dia_inicio
+    if dia_fin:
+        match['dia']['$lte'] = dia_fin
+    if id_usuario:
+        match['id_usuario'] = id_usuario
+    pipeline = [
+        {'$match': match},
+        {'$facet': {
+            'dias': [
+                {'$match': {'id_producto': None}},
+                {'$group': {'_id': '$dia', 'total': {'$sum': '$total'}, 'facturas': {'$sum': '$facturas'}}},
+                {'$sort': {'_id': 1}},
+            ],
+            'top': [
+                {'$match': {'id_producto': {'$ne': None}}},
+                {'$group': {'_id': '$id_producto', 'vendidos': {'$sum': '$cantidad'}}},
+                {'$sort': {'vendidos': -1}},
+                {'$limit': int(top_n)},
+            ],
+        }},
+    ]
+    res = next(db[COLLECTION].aggregate(pipeline), {})
+    dias = res.get('dias', [])
+    return {
+        'total_vendido': sum(d.get('total', 0) for d in dias),
+        'numero_facturas': sum(d.get('facturas', 0) for d in dias),
+        'ventas_por_dia': [{'fecha': d['_id'], 'total': d.get('total', 0)} for d in dias],
+        'top_productos': [{'producto': t['_id'], 'vendidos': t.get('vendidos', 0)} for t in res.get('top', [])],
+    }
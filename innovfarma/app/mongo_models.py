@@ -1,10 +1,27 @@
 from .mongo_client import mongo
+from .products.barcode_index import BarcodeIndex, BarcodePrefixIndex
+from .products.search_index import ProductSearchIndex, could_match
+from .products.fuzzy_index import FuzzyNameIndex
+from .products.substitute_index import SubstituteIndex, in_stock, price_order
+from .products.facet_index import FacetIndex, FACET_FIELDS
+from .products.id_cache import ProductIdCache, MISSING
+from .products.result_cache import result_cache, SEARCH_QUERY, FACET_QUERIES
+from .products.change_follower import ChangeFollower
+from .projection import expand, mongo_projection, pick
+from .pagination import encode_cursor
+from .dates import DATE_INDEXES, parse_date
+from .sequences import BlockAllocator, DEFAULT_BLOCK_SIZE, series_name
+from .products import bulk, repricing
+from .invoices import ventas_diarias
 from typing import cast
 from pymongo.database import Database
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 from werkzeug.security import generate_password_hash, check_password_hash
+from flask import current_app, g, has_app_context, has_request_context
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
+import re
 
 # Collections: usuarios, productos, facturas, clientes, detalle_factura
 
@@ -29,6 +46,91 @@ def get_next_sequence(name: str) -> int:
     except Exception:
         return 0
 
+def reserve_sequence(name: str, count: int) -> int:
+    """Reservar `count` valores consecutivos del contador `name` con un solo $inc.
+
+    Devuelve el primero del bloque.
+    """
+    db = get_db()
+    if db is None:
+        raise RuntimeError('MongoDB not initialized')
+    doc = db.counters.find_one_and_update({'_id': name}, {'$inc': {'seq': count}}, upsert=True, return_document=ReturnDocument.AFTER)
+    return int(doc.get('seq', count)) - count + 1
+
+
+_numbers = BlockAllocator(reserve_sequence)
+
+
+def next_number(name, id_sucursal=None):
+    """Siguiente `numero` visible de `name` (facturas, clientes, compras, proveedores).
+
+    Sale del bloque reservado por este worker (`SEQUENCE_BLOCK_SIZE` números
+    por `$inc`), no de un `$inc` por alta. Con `SEQUENCE_PER_SUCURSAL` e
+    `id_sucursal`, cada sucursal lleva su propia serie.
+    """
+    if has_app_context():
+        _numbers.configure(current_app.config.get('SEQUENCE_BLOCK_SIZE', DEFAULT_BLOCK_SIZE))
+        if not current_app.config.get('SEQUENCE_PER_SUCURSAL'):
+            id_sucursal = None
+    else:
+        id_sucursal = None
+    return _numbers.next(series_name(name, id_sucursal))
+
+
+def next_revs(count):
+    """`count` valores consecutivos de `rev` para una escritura sobre `productos`.
+
+    Se reservan con un solo `$inc` sobre `counters/productos_rev` por
+    escritura (no por línea), nunca por bloques: `rev` tiene que crecer con
+    cada cambio y `collection_version('productos')`, la base de los ETags de
+    `/productos` e `/inventarios`, tiene que moverse con cada escritura. Solo
+    los `numero` visibles salen de bloques (`next_number`).
+    """
+    if count <= 0:
+        return []
+    first = reserve_sequence('productos_rev', count)
+    return list(range(first, first + count))
+
+
+def sequence_stats():
+    return _numbers.stats()
+
+
+def collection_version(name):
+    """Versión actual de una colección (contador `<name>_rev`); base de los ETags."""
+    db = get_db()
+    if db is None:
+        return None
+    doc = db.counters.find_one({'_id': f'{name}_rev'}, {'seq': 1})
+    return int(doc.get('seq', 0)) if doc else 0
+
+
+def bump_collection_version(name):
+    """Avanzar la versión de `name` tras escribir en ella (invalida sus ETags)."""
+    try:
+        return get_next_sequence(f'{name}_rev')
+    except Exception:
+        return None
+
+
+def product_change_stamp():
+    """Campos `rev`/`updated_at` para cualquier escritura sobre `productos`.
+
+    `rev` es único en todo el catálogo y `updated_at` ordena los cambios;
+    junto con los tombstones de `productos_eliminados` permiten la
+    sincronización incremental (`get_product_changes`). Usar como
+    `'$set': product_change_stamp()`.
+    """
+    return {'rev': get_next_sequence('productos_rev'), 'updated_at': datetime.utcnow()}
+
+
+def _cursor_id(value):
+    """Id decodificado de un cursor de paginación -> valor de `_id` para comparar."""
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    return value
+
+
 def find_user_by_id(user_id):
     try:
         db = get_db()
@@ -90,10 +192,11 @@ def create_cliente_doc(cliente_data):
     if db is None:
         raise RuntimeError('MongoDB not initialized')
     try:
-        cliente_data['numero'] = get_next_sequence('clientes')
+        cliente_data['numero'] = next_number('clientes')
     except Exception:
         pass
     res = db.clientes.insert_one(cliente_data)
+    bump_collection_version('clientes')
     return str(res.inserted_id)
 
 
@@ -109,21 +212,14 @@ def create_cliente(nombre, ci, direccion='', telefono=''):
     if db is None:
         raise RuntimeError('MongoDB not initialized')
     try:
-        cliente_data['numero'] = get_next_sequence('clientes')
+        cliente_data['numero'] = next_number('clientes')
     except Exception:
         pass
     res = db.clientes.insert_one(cliente_data)
+    bump_collection_version('clientes')
     return str(res.inserted_id)
 
-def get_cliente(cliente_id):
-    """Get cliente by ID"""
-    try:
-        db = get_db()
-        if db is None:
-            return None
-        doc = db.clientes.find_one({'_id': ObjectId(cliente_id)})
-    except Exception:
-        return None
+def _cliente_doc_to_dict(doc):
     if not doc:
         return None
     doc['id'] = str(doc['_id'])
@@ -136,32 +232,90 @@ def get_cliente(cliente_id):
             doc['display_id'] = str(doc.get('numero'))
     return doc
 
-def list_clientes(skip=0, limit=100):
-    """List all clientes with pagination"""
+
+def get_cliente(cliente_id):
+    """Get cliente by ID"""
+    try:
+        db = get_db()
+        if db is None:
+            return None
+        doc = db.clientes.find_one({'_id': ObjectId(cliente_id)})
+    except Exception:
+        return None
+    return _cliente_doc_to_dict(doc)
+
+
+def get_clientes_batch(cliente_ids):
+    """{id pedido: cliente} para varios ids en una sola consulta.
+
+    Como `find_product_docs`: cada id puede ser el `_id`, el `id` legado o el
+    `sql_id` de la migración, con esa prioridad.
+    """
     db = get_db()
     if db is None:
-        return []
-    docs = db.clientes.find().skip(skip).limit(limit)
-    out = []
-    for d in docs:
-        d['id'] = str(d['_id'])
-        if 'numero' in d:
-            try:
-                d['numero'] = int(d.get('numero'))
-                d['display_id'] = str(d['numero'])
-            except Exception:
-                d['display_id'] = str(d.get('numero'))
-        out.append(d)
+        return {}
+    pending = []
+    oids, legacy, sql_ids = set(), set(), set()
+    for cid in dict.fromkeys(c for c in cliente_ids if c not in (None, '')):
+        oid, leg, sid = _id_candidates(cid)
+        pending.append((cid, oid, leg, sid))
+        if oid is not None:
+            oids.add(oid)
+        if leg is not None:
+            legacy.add(leg)
+        if sid is not None:
+            legacy.add(sid)
+            sql_ids.add(sid)
+    conds = []
+    if oids:
+        conds.append({'_id': {'$in': list(oids)}})
+    if legacy:
+        conds.append({'id': {'$in': list(legacy)}})
+    if sql_ids:
+        conds.append({'sql_id': {'$in': list(sql_ids)}})
+    if not conds:
+        return {}
+    by_oid, by_legacy, by_sql = {}, {}, {}
+    for d in db.clientes.find({'$or': conds}):
+        by_oid[d['_id']] = d
+        if d.get('id') is not None:
+            by_legacy.setdefault(str(d['id']), d)
+        if d.get('sql_id') is not None:
+            by_sql.setdefault(d['sql_id'], d)
+    out = {}
+    for cid, oid, leg, sid in pending:
+        doc = by_oid.get(oid) or by_legacy.get(leg) or by_sql.get(sid)
+        if doc is not None:
+            out[cid] = _cliente_doc_to_dict(dict(doc))
     return out
 
+_CLIENTE_DERIVED = {'display_id': ('numero',)}
+
+
+def list_clientes(skip=0, limit=100, after_id=None, fields=None):
+    """List all clientes with pagination
+
+    Con `after_id` (cursor) se pagina por `_id` en lugar de `skip`; con
+    `fields` solo se leen esos campos (proyección).
+    """
+    db = get_db()
+    if db is None:
+        return []
+    projection = mongo_projection(expand(fields, _CLIENTE_DERIVED))
+    if after_id is not None:
+        docs = db.clientes.find({'_id': {'$gt': _cursor_id(after_id)}}, projection).sort('_id', 1).limit(limit)
+    else:
+        docs = db.clientes.find({}, projection).sort('_id', 1).skip(skip).limit(limit)
+    return [pick(_cliente_doc_to_dict(d), fields) for d in docs]
+
 # === FACTURAS ===
 
 def create_factura_doc(factura_data):
     """Create new factura from a factura_data dict"""
-    factura_data['fecha'] = factura_data.get('fecha', datetime.now())
+    factura_data['fecha'] = parse_date(factura_data.get('fecha')) or datetime.utcnow()
     # assign sequential numero for display (Mongo compatibility)
     try:
-        factura_data['numero'] = get_next_sequence('facturas')
+        factura_data['numero'] = next_number('facturas', factura_data.get('id_sucursal'))
     except Exception:
         pass
     db = get_db()
@@ -171,15 +325,123 @@ def create_factura_doc(factura_data):
     return str(res.inserted_id)
 
 
-def create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=None, cambio=None, nota=None):
+# None: sin comprobar; False: el servidor no admite transacciones (standalone)
+_transactions_supported = None
+
+
+def _mark_transactions(supported):
+    global _transactions_supported
+    _transactions_supported = supported
+
+
+def _transactions_unavailable(error):
+    """True si `error` indica que el servidor no admite transacciones (no hay réplica)."""
+    msg = str(error)
+    return error.code in (20, 263) or 'Transaction numbers are only allowed' in msg or 'replica set' in msg
+
+
+def _restore_stock(db, lines):
+    """Compensar los descuentos ya aplicados fuera de transacción."""
+    if not lines:
+        return
+    now = datetime.utcnow()
+    try:
+        revs = next_revs(len(lines))
+        db.productos.bulk_write([
+            UpdateOne({'_id': line['oid']}, {'$inc': {'existencia': line['cantidad']},
+                                             '$set': {'rev': revs[n], 'updated_at': now}})
+            for n, line in enumerate(lines)
+        ], ordered=False)
+    except Exception:
+        pass
+
+
+def _check_stock_lines(db, lines, revs, session=None):
+    """Tras un descuento incompleto: qué líneas se aplicaron y cuál falló.
+
+    Relee los productos del carrito (en la sesión, si la hay). `rev` es única
+    por escritura, así que una línea se aplicó si su producto tiene la `rev`
+    que le asignamos. Devuelve (líneas aplicadas, (línea que falló, documento)).
+    """
+    docs = {d['_id']: d for d in db.productos.find({'_id': {'$in': [line['oid'] for line in lines]}},
+                                                   {'rev': 1, 'existencia': 1}, session=session)}
+    aplicadas, fallida = [], None
+    for n, line in enumerate(lines):
+        doc = docs.get(line['oid'])
+        if doc is not None and doc.get('rev') == revs[n]:
+            aplicadas.append(line)
+        elif fallida is None:
+            fallida = (line, doc)
+    return aplicadas, fallida
+
+
+def _write_factura(db, factura_data, detalles, lines, revs, now, session=None):
+    """Descontar stock y guardar cabecera y detalles de una factura.
+
+    El stock se descuenta con un único `bulk_write` ordenado y sin upsert,
+    condicionado a `existencia >= cantidad`. Si no coinciden todas las líneas
+    (`matched_count`), se averigua cuál falló (ver `_check_stock_lines`).
+    Con `session` todo va en una transacción y un error la aborta; sin ella,
+    los descuentos ya hechos se compensan antes de lanzar el error.
+    """
+    ops = [
+        UpdateOne({'_id': line['oid'], 'existencia': {'$gte': line['cantidad']}},
+                  {'$inc': {'existencia': -line['cantidad']}, '$set': {'rev': revs[n], 'updated_at': now}})
+        for n, line in enumerate(lines)
+    ]
+    if ops:
+        try:
+            res = db.productos.bulk_write(ops, ordered=True, session=session)
+        except BulkWriteError:
+            if session is None:
+                _restore_stock(db, _check_stock_lines(db, lines, revs)[0])
+            raise
+        if res.matched_count < len(ops):
+            aplicadas, (line, doc) = _check_stock_lines(db, lines, revs, session=session)
+            if session is None:
+                _restore_stock(db, aplicadas)
+            if doc is None:
+                # el producto se eliminó entre la validación y el descuento
+                raise ValueError(f"Producto {line['pid']} no encontrado")
+            raise ValueError(f"Stock insuficiente para '{line.get('nombre') or line['pid']}': "
+                             f"disponible {doc.get('existencia')}, solicitado {line['cantidad']}")
+
+    try:
+        db.facturas.insert_one(factura_data, session=session)
+        if detalles:
+            db.detalle_factura.insert_many(detalles, ordered=True, session=session)
+    except Exception:
+        if session is None:
+            db.detalle_factura.delete_many({'id_factura': str(factura_data['_id'])})
+            db.facturas.delete_one({'_id': factura_data['_id']})
+            _restore_stock(db, lines)
+        raise
+
+    # rollups del informe: dentro de la transacción si la hay; sin ella un
+    # fallo aquí no anula la venta (scripts/rebuild_ventas_diarias.py lo corrige)
+    try:
+        ventas_diarias.apply_factura(db, factura_data, detalles, session=session)
+    except Exception:
+        if session is not None:
+            raise
+
+
+def create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=None, cambio=None, nota=None,
+                   usuario=None):
     """Compat wrapper con la firma SQL: crea factura y detalles a partir de los parámetros dados.
     Ahora acepta recibido, cambio y nota para guardar información de pago.
+
+    El número de operaciones no crece con el carrito: una lectura `$in` para
+    validar, un `bulk_write` para el stock y la cabecera + `insert_many` de los
+    detalles, en una transacción si el servidor la admite (ver `_write_factura`).
+    `usuario` es el documento del vendedor si el llamador ya lo leyó (la ruta
+    lo lee para validar el rol); si no, se busca su nombre en `usuarios`.
     """
     factura_data = {
         'id_usuario': user_id,
         'id_cliente': cliente_id,
         'id_sucursal': sucursal_id,
-        'fecha': datetime.now(),
+        'fecha': datetime.utcnow(),
         'total': total,
         'recibido': recibido,
         'cambio': cambio,
@@ -190,95 +452,145 @@ def create_factura(user_id, cliente_id, sucursal_id, items, total, recibido=None
         raise RuntimeError('MongoDB not initialized')
     # assign sequential invoice numero
     try:
-        factura_data['numero'] = get_next_sequence('facturas')
+        factura_data['numero'] = next_number('facturas', factura_data.get('id_sucursal'))
     except Exception:
         pass
     # try to include vendedor nombre for easier display in frontend
     try:
-        user_doc = None
-        if user_id:
-            user_doc = db.usuarios.find_one({'_id': ObjectId(user_id)})
+        user_doc = usuario if usuario is not None and str(usuario.get('_id')) == str(user_id) else None
+        if user_doc is None and user_id:
+            user_doc = db.usuarios.find_one({'_id': ObjectId(user_id)}, _USER_NAME_PROJECTION)
         if user_doc:
             factura_data['vendedor_nombre'] = user_doc.get('nombre') or user_doc.get('name') or user_doc.get('username') or user_doc.get('email')
     except Exception:
         # ignore user lookup errors
         pass
 
-    # Insertar factura primero
-    res = db.facturas.insert_one(factura_data)
-    fid = str(res.inserted_id)
-
-    # --- Validar stock en Mongo y descontar existencia antes de insertar detalles ---
-    # Primer pase: comprobar que todos los productos existen y tienen suficiente existencia
-    checks = []
+    # --- Validar todo el carrito con una sola lectura ($in) ---
+    # documentos completos: con ellos se parchean también los índices tras la venta
+    prods = find_product_docs([item.get('id_producto') or item.get('id') for item in items], use_missing=False)
+    lines = {}  # _id -> línea de stock (cantidades del mismo producto sumadas)
     for item in items:
         pid = item.get('id_producto') or item.get('id') or None
         cantidad = int(item.get('cantidad') or 0)
         if not pid:
-            # intentar continuar, pero marcar error
             raise ValueError(f"Producto inválido en detalle: {item}")
-        # intentar resolver como ObjectId primero
-        prod = None
-        try:
-            prod = db.productos.find_one({'_id': ObjectId(pid)})
-        except Exception:
-            prod = db.productos.find_one({'id': pid})
+        prod = prods.get(pid)
         if not prod:
             raise ValueError(f"Producto {pid} no encontrado")
-        existencia = prod.get('existencia', 0) or 0
+        line = lines.setdefault(prod['_id'], {'pid': pid, 'oid': prod['_id'], 'cantidad': 0,
+                                              'nombre': prod.get('Nombre_comercial'), 'doc': prod})
+        line['cantidad'] += cantidad
         try:
-            existencia_val = int(existencia)
+            existencia_val = int(prod.get('existencia', 0) or 0)
         except Exception:
             existencia_val = 0
-        if existencia_val < cantidad:
-            raise ValueError(f"Stock insuficiente para '{prod.get('Nombre_comercial') or pid}': disponible {existencia_val}, solicitado {cantidad}")
-        checks.append({'pid': pid, 'cantidad': cantidad})
-
-    # Segundo pase: aplicar decrementos de existencia (mejor hacerlos después de validar todo)
-    updated = []
-    for c in checks:
-        pid = c['pid']
-        cantidad = c['cantidad']
-        updated_ok = False
+        line['existencia'] = existencia_val
+        if existencia_val < line['cantidad']:
+            raise ValueError(f"Stock insuficiente para '{prod.get('Nombre_comercial') or pid}': disponible {existencia_val}, solicitado {line['cantidad']}")
+    lines = list(lines.values())
+
+    factura_data['_id'] = ObjectId()
+    fid = str(factura_data['_id'])
+    detalles = [{
+        'id_factura': fid,
+        'id_producto': item.get('id_producto') or item.get('id') or None,
+        'cantidad': item.get('cantidad'),
+        'precio_unitario': item.get('precio_unitario'),
+        'subtotal': item.get('subtotal')
+    } for item in items]
+    revs = next_revs(len(lines))
+    now = datetime.utcnow()
+
+    if _transactions_supported is not False:
         try:
-            oid = ObjectId(pid)
-            resu = db.productos.find_one_and_update({'_id': oid, 'existencia': {'$gte': cantidad}}, {'$inc': {'existencia': -cantidad}}, return_document=ReturnDocument.AFTER)
-            if resu:
-                updated_ok = True
-        except Exception:
-            # intentar con campo 'id'
-            resu = db.productos.find_one_and_update({'id': pid, 'existencia': {'$gte': cantidad}}, {'$inc': {'existencia': -cantidad}}, return_document=ReturnDocument.AFTER)
-            if resu:
-                updated_ok = True
-        if not updated_ok:
-            # rollback los anteriores
-            for u in updated:
-                try:
-                    # intentar revertir por _id o id
-                    try:
-                        db.productos.update_one({'_id': ObjectId(u['pid'])}, {'$inc': {'existencia': u['cantidad']}})
-                    except Exception:
-                        db.productos.update_one({'id': u['pid']}, {'$inc': {'existencia': u['cantidad']}})
-                except Exception:
-                    pass
-            raise ValueError(f"No se pudo descontar existencia para el producto {pid}; operación abortada")
-        updated.append({'pid': pid, 'cantidad': cantidad})
-
-    # insertar detalles ahora que stock fue descontado
-    for item in items:
-        detalle = {
-            'id_factura': fid,
-            'id_producto': item.get('id_producto') or item.get('id') or None,
-            'cantidad': item.get('cantidad'),
-            'precio_unitario': item.get('precio_unitario'),
-            'subtotal': item.get('subtotal')
-        }
-        db.detalle_factura.insert_one(detalle)
-
+            with db.client.start_session() as session:
+                # with_transaction reintenta los errores transitorios (conflictos de escritura)
+                session.with_transaction(lambda s: _write_factura(db, factura_data, detalles, lines, revs, now, session=s))
+            _mark_transactions(True)
+        except OperationFailure as e:
+            if not _transactions_unavailable(e):
+                raise
+            # standalone sin réplica: nada se escribió, seguir sin transacción
+            _mark_transactions(False)
+            _write_factura(db, factura_data, detalles, lines, revs, now)
+    else:
+        _write_factura(db, factura_data, detalles, lines, revs, now)
+
+    # índices en memoria: los documentos leídos al validar con el descuento aplicado, sin
+    # releerlos. No se anotan como vistos (`note=False`): si otra escritura los tocó entre la
+    # validación y el descuento, la próxima puesta al día los relee de Mongo.
+    productos = []
+    for n, line in enumerate(lines):
+        doc = dict(line['doc'], existencia=line['existencia'] - line['cantidad'], rev=revs[n], updated_at=now)
+        productos.append(_product_doc_to_dict(doc))
+    _index_products(productos, note=False)
     return fid
 
+_PRODUCT_NAME_PROJECTION = {'Nombre_comercial': 1, 'nombre': 1, 'Nombre_generico': 1}
+_USER_NAME_PROJECTION = {'nombre': 1, 'name': 1, 'username': 1, 'email': 1}
+
+
+def _docs_by_ids(collection, ids, projection=None):
+    """{id pedido: documento} en una consulta: `_id` para los ObjectId válidos, `id` legado para el resto."""
+    oids, legacy = {}, set()
+    for i in ids:
+        if isinstance(i, ObjectId):
+            oids[i] = i
+        elif isinstance(i, str) and ObjectId.is_valid(i):
+            oids[i] = ObjectId(i)
+        elif i not in (None, ''):
+            legacy.add(i)
+    conds = []
+    if oids:
+        conds.append({'_id': {'$in': list(set(oids.values()))}})
+    if legacy:
+        conds.append({'id': {'$in': list(legacy)}})
+    if not conds:
+        return {}
+    by_oid, by_legacy = {}, {}
+    for d in collection.find({'$or': conds}, projection):
+        by_oid[d['_id']] = d
+        if d.get('id') is not None:
+            by_legacy.setdefault(d['id'], d)
+    out = {i: by_oid[oid] for i, oid in oids.items() if oid in by_oid}
+    out.update({i: by_legacy[i] for i in legacy if i in by_legacy})
+    return out
+
+
+def _client_name(doc):
+    return doc.get('nombre') or doc.get('name') or ''
+
+
+def _seller_name(doc):
+    return doc.get('nombre') or doc.get('name') or doc.get('username') or ''
+
+
+def _resolve_names(collection_name, ids, name_fn, projection):
+    """{id: nombre} para los ids dados, con una consulta `$in` para los que faltan.
+
+    Los resultados (también los no encontrados) se memorizan durante la
+    petición en curso, así varias páginas o lecturas de la misma petición no
+    repiten consultas.
+    """
+    memo = {}
+    if has_request_context():
+        memo = g.setdefault('_mongo_names', {}).setdefault(collection_name, {})
+    pending = [i for i in dict.fromkeys(ids) if i not in (None, '') and i not in memo]
+    if pending:
+        db = get_db()
+        docs = _docs_by_ids(db[collection_name], pending, projection) if db is not None else {}
+        for i in pending:
+            memo[i] = name_fn(docs[i]) if i in docs else None
+    return {i: memo.get(i) for i in ids if i not in (None, '')}
+
+
 def get_factura(factura_id):
-    """Get factura by ID with detalles"""
+    """Get factura by ID with detalles
+
+    Consultas fijas por petición: la factura, el vendedor, los detalles y
+    sus productos (estos dos últimos en `get_detalles_factura`).
+    """
     try:
         db = get_db()
         if db is None:
@@ -312,10 +624,7 @@ def get_factura(factura_id):
     try:
         uid = doc.get('id_usuario') or doc.get('id_vendedor') or doc.get('usuario')
         if uid:
-            try:
-                udoc = db.usuarios.find_one({'_id': ObjectId(uid)})
-            except Exception:
-                udoc = db.usuarios.find_one({'id': uid})
+            udoc = _docs_by_ids(db.usuarios, [uid], _USER_NAME_PROJECTION).get(uid)
             if udoc:
                 vname = udoc.get('nombre') or udoc.get('name') or udoc.get('username') or udoc.get('email')
                 if vname:
@@ -324,41 +633,45 @@ def get_factura(factura_id):
         pass
 
     # get detalles and enrich with product names / short ids
-    detalles = db.detalle_factura.find({'id_factura': factura_id})
-    doc['detalles'] = []
-    for d in detalles:
-        d['id'] = str(d['_id'])
-        # add short id
-        d['short_id'] = d['id'][:8]
-        # try to resolve product name
-        pid = d.get('id_producto') or d.get('id') or d.get('producto_id')
-        prod = None
-        try:
-            if pid:
-                try:
-                    prod = db.productos.find_one({'_id': ObjectId(pid)})
-                except Exception:
-                    prod = db.productos.find_one({'id': pid})
-        except Exception:
-            prod = None
-        if prod:
-            pname = prod.get('Nombre_comercial') or prod.get('nombre') or prod.get('Nombre_generico')
-            if pname:
-                d['producto_nombre'] = pname
-            # include product short id
-            try:
-                d['producto_short_id'] = str(prod.get('_id'))[:8]
-            except Exception:
-                d['producto_short_id'] = str(prod.get('id'))[:8]
-        doc['detalles'].append(d)
+    doc['detalles'] = get_detalles_factura(factura_id)
     return doc
 
-def list_facturas(skip=0, limit=50):
-    """List facturas with pagination"""
+_FACTURA_DERIVED = {
+    'display_id': ('numero',),
+    'clientName': ('id_cliente', 'cliente_id', 'cliente'),
+    'vendedor_nombre': ('id_usuario', 'id_vendedor'),
+}
+
+
+def list_facturas(skip=0, limit=50, after_id=None, fields=None):
+    """List facturas with pagination, most recent first
+
+    Con `after_id` (cursor) se pagina por `_id` descendente en lugar de `skip`.
+    Con `fields` solo se leen esos campos, y los nombres de cliente/vendedor
+    solo se resuelven si se piden (`clientName`, `vendedor_nombre`).
+    """
     db = get_db()
     if db is None:
         return []
-    docs = db.facturas.find().skip(skip).limit(limit)
+    projection = mongo_projection(expand(fields, _FACTURA_DERIVED))
+    if after_id is not None:
+        docs = db.facturas.find({'_id': {'$lt': _cursor_id(after_id)}}, projection).sort('_id', -1).limit(limit)
+    else:
+        docs = db.facturas.find({}, projection).sort('_id', -1).skip(skip).limit(limit)
+    want_client = fields is None or 'clientName' in fields
+    want_seller = fields is None or 'vendedor_nombre' in fields
+    docs = list(docs)
+    # nombres de cliente y vendedor de toda la página: dos consultas $in como máximo
+    client_ids = [d.get('id_cliente') or d.get('cliente_id') or d.get('cliente') for d in docs] if want_client else []
+    seller_ids = [d.get('id_usuario') or d.get('id_vendedor') for d in docs] if want_seller else []
+    try:
+        client_names = _resolve_names('clientes', client_ids, _client_name, {'nombre': 1, 'name': 1})
+    except Exception:
+        client_names = {}
+    try:
+        seller_names = _resolve_names('usuarios', seller_ids, _seller_name, {'nombre': 1, 'name': 1, 'username': 1})
+    except Exception:
+        seller_names = {}
     out = []
     for d in docs:
         d['id'] = str(d['_id'])
@@ -372,38 +685,23 @@ def list_facturas(skip=0, limit=50):
             except Exception:
                 d['display_id'] = str(d.get('numero'))
         # normalize fecha if datetime
-        try:
-            fval = d.get('fecha')
-            if hasattr(fval, 'isoformat'):
-                d['fecha'] = fval.isoformat()
-            else:
-                d['fecha'] = str(fval)
-        except Exception:
-            d['fecha'] = str(d.get('fecha'))
-        # try to attach client name and vendedor nombre for frontend convenience
-        try:
-            cid = d.get('id_cliente') or d.get('cliente_id') or d.get('cliente')
-            if cid:
-                try:
-                    cdoc = db.clientes.find_one({'_id': ObjectId(cid)})
-                except Exception:
-                    cdoc = db.clientes.find_one({'id': cid})
-                if cdoc:
-                    d['clientName'] = cdoc.get('nombre') or cdoc.get('name') or ''
-        except Exception:
-            pass
-        try:
-            uid = d.get('id_usuario') or d.get('id_vendedor')
-            if uid:
-                try:
-                    udoc = db.usuarios.find_one({'_id': ObjectId(uid)})
-                except Exception:
-                    udoc = db.usuarios.find_one({'id': uid})
-                if udoc:
-                    d['vendedor_nombre'] = udoc.get('nombre') or udoc.get('name') or udoc.get('username') or ''
-        except Exception:
-            pass
-        out.append(d)
+        if fields is None or 'fecha' in fields:
+            try:
+                fval = d.get('fecha')
+                if hasattr(fval, 'isoformat'):
+                    d['fecha'] = fval.isoformat()
+                else:
+                    d['fecha'] = str(fval)
+            except Exception:
+                d['fecha'] = str(d.get('fecha'))
+        # attach client name and vendedor nombre for frontend convenience
+        cid = (d.get('id_cliente') or d.get('cliente_id') or d.get('cliente')) if want_client else None
+        if cid and client_names.get(cid) is not None:
+            d['clientName'] = client_names[cid]
+        uid = (d.get('id_usuario') or d.get('id_vendedor')) if want_seller else None
+        if uid and seller_names.get(uid) is not None:
+            d['vendedor_nombre'] = seller_names[uid]
+        out.append(pick(d, fields))
     return out
 
 # === DETALLE_FACTURA ===
@@ -422,32 +720,31 @@ def create_detalle_factura(detalle_data):
     return str(res.inserted_id)
 
 def get_detalles_factura(factura_id):
-    """Get all detalles for a factura"""
+    """Get all detalles for a factura
+
+    Dos consultas sin importar el número de líneas: los detalles y, en un
+    solo `$in` (`find_product_docs`), los productos que referencian.
+    """
     db = get_db()
     if db is None:
         return []
-    docs = db.detalle_factura.find({'id_factura': factura_id})
-    out = []
-    for d in docs:
+    out = list(db.detalle_factura.find({'id_factura': factura_id}))
+    pids = [d.get('id_producto') or d.get('id') or d.get('producto_id') for d in out]
+    try:
+        prods = find_product_docs([p for p in pids if p], projection=_PRODUCT_NAME_PROJECTION)
+    except Exception:
+        prods = {}
+    for d, pid in zip(out, pids):
         d['id'] = str(d['_id'])
         # short id
         d['short_id'] = d['id'][:8]
         # enrich with product name when available
-        pid = d.get('id_producto') or d.get('id') or d.get('producto_id')
-        try:
-            if pid:
-                try:
-                    prod = db.productos.find_one({'_id': ObjectId(pid)})
-                except Exception:
-                    prod = db.productos.find_one({'id': pid})
-                if prod:
-                    pname = prod.get('Nombre_comercial') or prod.get('nombre') or prod.get('Nombre_generico')
-                    if pname:
-                        d['producto_nombre'] = pname
-                    d['producto_short_id'] = str(prod.get('_id'))[:8] if prod.get('_id') else str(prod.get('id'))[:8]
-        except Exception:
-            pass
-        out.append(d)
+        prod = prods.get(pid) if pid else None
+        if prod:
+            pname = prod.get('Nombre_comercial') or prod.get('nombre') or prod.get('Nombre_generico')
+            if pname:
+                d['producto_nombre'] = pname
+            d['producto_short_id'] = str(prod.get('_id'))[:8] if prod.get('_id') else str(prod.get('id'))[:8]
     return out
 
 
@@ -488,12 +785,196 @@ def _product_doc_to_dict(d):
     return out
 
 
-def list_products(limit=100):
+def list_products(limit=100, skip=0, after_id=None, fields=None):
+    """Listar productos por `_id`; `after_id` (cursor) evita el coste de `skip`.
+
+    Con `fields` se proyecta en Mongo y solo se devuelven esos campos.
+    """
     db = get_db()
     if db is None:
         return []
-    docs = db.productos.find().limit(limit)
-    return [_product_doc_to_dict(d) for d in docs]
+    projection = mongo_projection(fields)
+    if after_id is not None:
+        docs = db.productos.find({'_id': {'$gt': _cursor_id(after_id)}}, projection).sort('_id', 1).limit(limit)
+    else:
+        docs = db.productos.find({}, projection).sort('_id', 1).skip(skip).limit(limit)
+    return [pick(_product_doc_to_dict(d), fields) for d in docs]
+
+
+# === ÍNDICES EN MEMORIA DE PRODUCTOS (por worker) ===
+barcode_index = BarcodeIndex()
+barcode_prefix_index = BarcodePrefixIndex()
+search_index = ProductSearchIndex()
+fuzzy_index = FuzzyNameIndex()
+substitute_index = SubstituteIndex()
+facet_index = FacetIndex()
+
+
+product_changes = ChangeFollower()
+
+
+def build_product_indexes():
+    """(Re)construir los índices en memoria de productos de este worker.
+
+    Se llama al arrancar la app; si falla, el primer escaneo lo reintenta.
+    Desde ahí `sync_product_indexes` los mantiene al día.
+    """
+    db = get_db()
+    if db is None:
+        return False
+    ensure_catalog_indexes(db)
+    # versión y hora antes de leer: lo que se escriba durante la carga entra en la primera puesta al día
+    version = collection_version('productos')
+    started = datetime.utcnow()
+    productos = [_product_doc_to_dict(d) for d in db.productos.find()]
+    barcode_index.build(productos)
+    barcode_prefix_index.build(productos)
+    search_index.build(productos)
+    fuzzy_index.build(productos)
+    substitute_index.build(productos)
+    facet_index.build(productos)
+    product_changes.reset(version, started)
+    return True
+
+
+def _ensure_product_indexes():
+    """Índices construidos y al día con lo que escribieron otros workers."""
+    if not barcode_index.built:
+        try:
+            build_product_indexes()
+        except Exception:
+            pass
+        return
+    sync_product_indexes()
+
+
+def _product_change_stamps(since):
+    db = get_db()
+    q = {'updated_at': {'$gte': since}}
+    for d in db.productos.find(q, {'rev': 1}):
+        yield str(d['_id']), d.get('rev'), False
+    for d in db.productos_eliminados.find(q, {'product_id': 1, 'rev': 1}):
+        yield d.get('product_id'), d.get('rev'), True
+
+
+def _apply_product_changes(changed, deleted):
+    productos = []
+    if changed:
+        db = get_db()
+        docs = db.productos.find({'_id': {'$in': [_cursor_id(pid) for pid in changed]}})
+        productos = [_product_doc_to_dict(d) for d in docs]
+    _index_products(productos)
+    if productos:
+        # pueden ser altas de otro worker que este recordaba como inexistentes
+        product_ids.forget_missing()
+    found = {p['id'] for p in productos}
+    # los que ya no están se borraron entre la lectura de sellos y esta
+    for pid in list(deleted) + [pid for pid in changed if pid not in found]:
+        product_ids.invalidate(_cursor_id(pid))
+        _unindex_product(pid)
+
+
+def sync_product_indexes():
+    """Aplicar a los índices de este worker lo que escribieron otros workers,
+    instancias o scripts (ver `products.change_follower`).
+
+    Cuesta una lectura de `counters` por `PRODUCT_INDEX_SYNC_INTERVAL` y,
+    solo si hubo escrituras, la de los productos cambiados.
+    """
+    if has_app_context():
+        product_changes.configure(interval=current_app.config.get('PRODUCT_INDEX_SYNC_INTERVAL'),
+                                  overlap=current_app.config.get('PRODUCT_SYNC_LAG'))
+    try:
+        return product_changes.poll(lambda: collection_version('productos'),
+                                    _product_change_stamps, _apply_product_changes)
+    except Exception:
+        return 0
+
+
+def _invalidate_searches(tokens):
+    """Descartar las búsquedas cacheadas en las que pueden aparecer productos con esos tokens."""
+    if tokens:
+        result_cache.invalidate_matching(SEARCH_QUERY, lambda key: could_match(key[1], tokens))
+
+
+def _index_product(producto):
+    """Parchear los índices en memoria con un producto ya serializado
+    (y descartar de `result_cache` lo que pudo cambiar con él)."""
+    if producto:
+        barcode_index.upsert(producto)
+        barcode_prefix_index.upsert(producto)
+        _invalidate_searches(search_index.upsert(producto))
+        fuzzy_index.upsert(producto)
+        substitute_index.upsert(producto)
+        if facet_index.upsert(producto):
+            result_cache.invalidate_kind(*FACET_QUERIES)
+        result_cache.invalidate_product(producto.get('id'))
+        product_changes.note(producto.get('id'), producto.get('rev'))
+
+
+def _index_products(productos, note=True):
+    """Como `_index_product` para muchos productos (cargas masivas).
+
+    Con `note=False` los cambios no se dan por aplicados y `sync_product_indexes`
+    los vuelve a leer (para copias que pueden no ser exactamente las de Mongo).
+    """
+    productos = [p for p in productos if p]
+    if not productos:
+        return
+    _invalidate_searches(search_index.upsert_many(productos))
+    facetas = False
+    for producto in productos:
+        barcode_index.upsert(producto)
+        barcode_prefix_index.upsert(producto)
+        fuzzy_index.upsert(producto)
+        substitute_index.upsert(producto)
+        facetas = facet_index.upsert(producto) or facetas
+        result_cache.invalidate_product(producto.get('id'))
+        if note:
+            product_changes.note(producto.get('id'), producto.get('rev'))
+    if facetas:
+        result_cache.invalidate_kind(*FACET_QUERIES)
+
+
+def _unindex_product(product_id):
+    barcode_index.remove(product_id)
+    barcode_prefix_index.remove(product_id)
+    search_index.remove(product_id)
+    fuzzy_index.remove(product_id)
+    substitute_index.remove(product_id)
+    if facet_index.remove(product_id):
+        result_cache.invalidate_kind(*FACET_QUERIES)
+    result_cache.invalidate_product(str(product_id))
+
+
+def refresh_product(product_id):
+    """Re-sincronizar los índices en memoria tras escribir un producto.
+
+    Los módulos que modifican `productos` directamente (compras, lotes,
+    pedidos...) deben llamarla para no dejar existencias desactualizadas.
+    """
+    try:
+        producto = get_product(product_id)
+    except Exception:
+        return
+    if producto:
+        _index_product(producto)
+    else:
+        _unindex_product(product_id)
+
+
+def product_index_stats():
+    return {
+        'barcode': barcode_index.stats(),
+        'barcode_prefix': barcode_prefix_index.stats(),
+        'search': search_index.stats(),
+        'fuzzy': fuzzy_index.stats(),
+        'substitutes': substitute_index.stats(),
+        'facets': facet_index.stats(),
+        'ids': product_ids.stats(),
+        'results': result_cache.stats(),
+        'sync': product_changes.stats(),
+    }
 
 
 def generar_informe_ventas(fecha_inicio=None, fecha_fin=None, id_usuario=None, top_n=10):
@@ -507,99 +988,135 @@ def generar_informe_ventas(fecha_inicio=None, fecha_fin=None, id_usuario=None, t
     if db is None:
         return {'total_vendido': 0.0, 'numero_facturas': 0, 'ventas_por_dia': [], 'top_productos': []}
 
+    # días enteros: responder desde los rollups `ventas_diarias` si ya se construyeron
+    dias = ventas_diarias.day_range(fecha_inicio, fecha_fin)
+    if dias is not None:
+        try:
+            if ventas_diarias.is_ready(db):
+                return ventas_diarias.report(db, dias[0], dias[1], id_usuario=id_usuario, top_n=top_n)
+        except Exception:
+            pass
+
     q = {}
-    # filtros por fecha
-    try:
-        if fecha_inicio:
-            if isinstance(fecha_inicio, str):
-                from datetime import datetime as _dt
-                fecha_inicio_dt = _dt.fromisoformat(fecha_inicio)
-            else:
-                fecha_inicio_dt = fecha_inicio
-            q['fecha'] = q.get('fecha', {})
-            q['fecha']['$gte'] = fecha_inicio_dt.isoformat() if hasattr(fecha_inicio_dt, 'isoformat') else fecha_inicio_dt
-        if fecha_fin:
-            if isinstance(fecha_fin, str):
-                from datetime import datetime as _dt
-                fecha_fin_dt = _dt.fromisoformat(fecha_fin)
-            else:
-                fecha_fin_dt = fecha_fin
-            q['fecha'] = q.get('fecha', {})
-            q['fecha']['$lte'] = fecha_fin_dt.isoformat() if hasattr(fecha_fin_dt, 'isoformat') else fecha_fin_dt
-    except Exception:
-        # si el parse falla, ignorar el filtro de fecha
-        q.pop('fecha', None)
+    # filtros por fecha: `fecha` es una fecha BSON, se compara con datetimes (rango por índice)
+    fecha_inicio_dt = parse_date(fecha_inicio)
+    fecha_fin_dt = parse_date(fecha_fin)
+    if fecha_inicio_dt is not None:
+        q.setdefault('fecha', {})['$gte'] = fecha_inicio_dt
+    if fecha_fin_dt is not None:
+        if ventas_diarias.is_whole_day(fecha_fin_dt):
+            # fecha sin hora: incluye todo ese día, igual que los rollups
+            q.setdefault('fecha', {})['$lt'] = fecha_fin_dt + timedelta(days=1)
+        else:
+            q.setdefault('fecha', {})['$lte'] = fecha_fin_dt
 
     if id_usuario:
         q['id_usuario'] = id_usuario
 
-    # total vendido y numero de facturas
-    try:
-        numero = db.facturas.count_documents(q)
-    except Exception:
-        numero = 0
-    total_vendido = 0.0
+    ensure_date_indexes(db)
+    # una sola agregación: total, número, serie por día y top productos en el servidor
+    as_number = {'$convert': {'input': '$total', 'to': 'double', 'onError': 0.0, 'onNull': 0.0}}
+    pipeline = [
+        {'$match': q},
+        {'$facet': {
+            'totales': [
+                {'$group': {'_id': None, 'total': {'$sum': as_number}, 'n': {'$sum': 1}}},
+            ],
+            'dias': [
+                # fecha datetime o string ISO: los 10 primeros caracteres son el día
+                {'$group': {'_id': {'$substrCP': [{'$toString': '$fecha'}, 0, 10]}, 'total': {'$sum': as_number}}},
+                {'$match': {'_id': {'$nin': [None, '']}}},
+                {'$sort': {'_id': 1}},
+            ],
+            'top': [
+                {'$project': {'fid': {'$toString': '$_id'}}},
+                {'$lookup': {'from': 'detalle_factura', 'localField': 'fid', 'foreignField': 'id_factura', 'as': 'd'}},
+                {'$unwind': '$d'},
+                {'$group': {'_id': '$d.id_producto', 'vendidos': {'$sum': '$d.cantidad'}}},
+                {'$sort': {'vendidos': -1}},
+                {'$limit': int(top_n)},
+            ],
+        }},
+    ]
     try:
-        cur = db.facturas.find(q)
-        for f in cur:
-            try:
-                total_vendido += float(f.get('total') or 0)
-            except Exception:
-                continue
+        res = next(db.facturas.aggregate(pipeline, allowDiskUse=True), {})
     except Exception:
-        total_vendido = 0.0
+        res = {}
+    totales = (res.get('totales') or [{}])[0]
+    return {
+        'total_vendido': float(totales.get('total') or 0.0),
+        'numero_facturas': int(totales.get('n') or 0),
+        'ventas_por_dia': [{'fecha': d['_id'], 'total': d.get('total', 0.0)} for d in res.get('dias', [])],
+        'top_productos': [{'producto': a.get('_id'), 'vendidos': a.get('vendidos', 0)} for a in res.get('top', [])],
+    }
 
-    # ventas por dia (simple grouping by fecha ISO date prefix)
-    ventas_por_dia = {}
-    try:
-        cur = db.facturas.find(q)
-        for f in cur:
-            fecha = f.get('fecha')
-            if not fecha:
-                continue
-            if hasattr(fecha, 'date'):
-                key = fecha.date().isoformat()
-            else:
-                # assume ISO string
-                key = str(fecha)[:10]
-            ventas_por_dia[key] = ventas_por_dia.get(key, 0.0) + (float(f.get('total') or 0))
-    except Exception:
-        ventas_por_dia = {}
 
-    ventas_por_dia_list = [{'fecha': k, 'total': v} for k, v in sorted(ventas_por_dia.items())]
+_date_indexes_ready = False
+_catalog_indexes_ready = False
 
-    # top productos: aggregate detalle_factura
-    top_products = []
-    try:
-        pipeline = []
-        if q:
-            # match by factura ids from facturas that match q
-            fid_cursor = db.facturas.find(q, {'_id': 1})
-            fids = [str(x.get('_id')) for x in fid_cursor]
-            if fids:
-                pipeline.append({'$match': {'id_factura': {'$in': fids}}})
-        pipeline.extend([
-            {'$group': {'_id': '$id_producto', 'vendidos': {'$sum': '$cantidad'}}},
-            {'$sort': {'vendidos': -1}},
-            {'$limit': int(top_n)}
-        ])
-        agg = list(db.detalle_factura.aggregate(pipeline)) if pipeline else list(db.detalle_factura.aggregate([{'$group': {'_id': '$id_producto', 'vendidos': {'$sum': '$cantidad'}}}, {'$sort': {'vendidos': -1}}, {'$limit': int(top_n)}]))
-        for a in agg:
-            top_products.append({'producto': a.get('_id'), 'vendidos': a.get('vendidos', 0)})
-    except Exception:
-        top_products = []
+# índices de `productos` (colección, claves): `updated_at` para la puesta al día de los
+# índices en memoria y `/productos/cambios` (los mismos que crea scripts/backfill_product_revs.py),
+# más los que necesitan las consultas de respaldo
+CATALOG_INDEXES = (
+    ('productos', [('updated_at', 1), ('rev', 1)]),
+    ('productos_eliminados', [('updated_at', 1), ('rev', 1)]),
+    # alta/actualización masiva y escaneo sin índice en memoria: búsqueda exacta por código de barras
+    ('productos', [('Cod_barrras', 1)]),
+    # sustitutos (`get_substitutes` sin índice en memoria): igualdad, orden por precio y stock
+    ('productos', [('Principio_activo', 1), ('Concentracion', 1), ('Presentacion', 1),
+                   ('Precio_venta', 1), ('existencia', 1)]),
+)
+
+
+def ensure_date_indexes(db=None):
+    """Índices de los filtros por fecha (`dates.DATE_INDEXES`), una vez por worker.
+
+    Cubren el informe de ventas (rango de `fecha` + `id_usuario` y el
+    `$lookup` de detalles) y las alertas de caducidad de lotes.
+    """
+    global _date_indexes_ready
+    if _date_indexes_ready:
+        return
+    db = db if db is not None else get_db()
+    if db is None:
+        return
+    # un solo intento: si ya existen con otro nombre, create_index falla y no hace falta reintentar
+    _date_indexes_ready = True
+    for name, keys in DATE_INDEXES:
+        try:
+            db[name].create_index(keys)
+        except Exception:
+            pass
 
-    return {
-        'total_vendido': total_vendido,
-        'numero_facturas': numero,
-        'ventas_por_dia': ventas_por_dia_list,
-        'top_productos': top_products
-    }
+
+def ensure_catalog_indexes(db=None):
+    """Índices de `CATALOG_INDEXES`, una vez por worker (como `ensure_date_indexes`)."""
+    global _catalog_indexes_ready
+    if _catalog_indexes_ready:
+        return
+    db = db if db is not None else get_db()
+    if db is None:
+        return
+    _catalog_indexes_ready = True
+    for name, keys in CATALOG_INDEXES:
+        try:
+            db[name].create_index(keys)
+        except Exception:
+            pass
 
 
 def filter_products(term, limit=200):
+    """Buscar productos por término, ordenados por relevancia.
+
+    Se resuelve en el índice invertido en memoria (`search_index`), puesto al
+    día antes con los cambios de otros workers (`sync_product_indexes`); si
+    aún no está construido se cae a la búsqueda por `$regex` sin ranking.
+    """
     if not term:
         return list_products(limit)
+    _ensure_product_indexes()
+    if search_index.built:
+        return search_index.search(term, limit=int(limit))
     regex = {'$regex': term, '$options': 'i'}
     q = {'$or': [{'Nombre_comercial': regex}, {'codigo': regex}, {'Nombre_generico': regex}, {'Cod_barrras': regex}]}
     db = get_db()
@@ -609,6 +1126,71 @@ def filter_products(term, limit=200):
     return [_product_doc_to_dict(d) for d in docs]
 
 
+def fuzzy_filter_products(term, limit=50, max_distance=None, budget_ms=15):
+    """Búsqueda tolerante a errores de tipeo en Nombre_comercial/Nombre_generico.
+
+    Cada producto devuelto incluye `distancia` (errores totales respecto al término).
+    """
+    if not term:
+        return []
+    _ensure_product_indexes()
+    if not fuzzy_index.built:
+        return []
+    out = []
+    for producto, distancia in fuzzy_index.search(term, limit=int(limit), max_distance=max_distance, budget_ms=budget_ms):
+        producto['distancia'] = distancia
+        out.append(producto)
+    return out
+
+
+def get_substitutes(product_id, limit=50, solo_con_stock=True):
+    """Sustitutos de un producto: mismo Principio_activo + Concentracion +
+    Presentacion, con existencia y ordenados por Precio_venta.
+
+    El grupo sale del índice en memoria; la existencia y el precio de sus
+    miembros se releen con una consulta `$in` por `_id`, porque otro worker
+    pudo venderlos un instante antes. Sin índice, una consulta sobre el
+    índice compuesto de `CATALOG_INDEXES`. Devuelve None si el producto no existe.
+    """
+    producto = get_product(product_id)
+    if not producto:
+        return None
+    _ensure_product_indexes()
+    db = get_db()
+    if substitute_index.built:
+        grupo = substitute_index.substitutes(producto, limit=None, solo_con_stock=False)
+        if not grupo or db is None:
+            return grupo[:int(limit)]
+        actual = {str(d['_id']): d for d in db.productos.find(
+            {'_id': {'$in': [_cursor_id(p['id']) for p in grupo]}}, {'existencia': 1, 'Precio_venta': 1})}
+        out = []
+        for p in grupo:
+            d = actual.get(p['id'])
+            if d is None:
+                continue
+            p['existencia'] = d.get('existencia')
+            p['Precio_venta'] = d.get('Precio_venta')
+            if not solo_con_stock or in_stock(p):
+                out.append(p)
+        out.sort(key=price_order)
+        return out[:int(limit)]
+    if not producto.get('Principio_activo'):
+        return []
+    if db is None:
+        return []
+    ensure_catalog_indexes(db)
+    q = {
+        'Principio_activo': producto.get('Principio_activo'),
+        'Concentracion': producto.get('Concentracion'),
+        'Presentacion': producto.get('Presentacion'),
+    }
+    if solo_con_stock:
+        q['existencia'] = {'$gt': 0}
+    docs = db.productos.find(q).sort('Precio_venta', 1).limit(int(limit) + 1)
+    out = [_product_doc_to_dict(d) for d in docs]
+    return [p for p in out if p.get('id') != producto.get('id')][:int(limit)]
+
+
 def filter_advanced(marca_id=None, categoria_id=None, subcategoria_id=None, forma_id=None,
                    laboratorio_id=None, limit=100, skip=0):
     q = {}
@@ -627,41 +1209,214 @@ def filter_advanced(marca_id=None, categoria_id=None, subcategoria_id=None, form
     return [_product_doc_to_dict(d) for d in cursor]
 
 
+def filter_advanced_facets(marca_id=None, categoria_id=None, subcategoria_id=None, forma_id=None,
+                           laboratorio_id=None, limit=100, skip=0):
+    """Como `filter_advanced` pero devuelve también los conteos por faceta.
+
+    Retorna {'productos', 'facets': {campo: {valor: n}}, 'total_filtrados'}.
+    Los conteos de cada faceta ignoran su propio filtro. Se resuelve en el
+    índice de facetas en memoria; si no está
+    construido, con una única agregación `$facet`.
+    """
+    filters = {
+        'id_marca': marca_id,
+        'id_forma_farmaceutica': forma_id,
+        'id_laboratorio': laboratorio_id,
+        'id_subcategoria': subcategoria_id,
+    }
+    filters = {k: v for k, v in filters.items() if v}
+    _ensure_product_indexes()
+    if facet_index.built:
+        productos, facets, total = facet_index.query(filters, limit=int(limit), skip=int(skip))
+        return {'productos': productos, 'facets': facets, 'total_filtrados': total}
+    db = get_db()
+    if db is None:
+        return {'productos': [], 'facets': {}, 'total_filtrados': 0}
+    stages = {
+        'productos': [{'$match': filters}, {'$sort': {'_id': 1}}, {'$skip': int(skip)}, {'$limit': int(limit)}],
+        'total': [{'$match': filters}, {'$count': 'n'}],
+    }
+    for field in FACET_FIELDS:
+        others = {k: v for k, v in filters.items() if k != field}
+        stages[field] = [{'$match': others}, {'$group': {'_id': '$' + field, 'n': {'$sum': 1}}}, {'$sort': {'n': -1}}]
+    res = next(db.productos.aggregate([{'$facet': stages}]), {})
+    facets = {}
+    for field in FACET_FIELDS:
+        facets[field] = {g['_id']: g['n'] for g in res.get(field, []) if g.get('_id') not in (None, '')}
+    total = res.get('total') or [{}]
+    return {
+        'productos': [_product_doc_to_dict(d) for d in res.get('productos', [])],
+        'facets': facets,
+        'total_filtrados': total[0].get('n', 0),
+    }
+
+
+# === RESOLUCIÓN DE IDS DE PRODUCTO ===
+product_ids = ProductIdCache()
+
+
+def _id_candidates(product_id):
+    """Formas en que `product_id` puede identificar un producto: (_id, `id` legado, `sql_id`)."""
+    if isinstance(product_id, ObjectId):
+        return product_id, None, None
+    oid = ObjectId(product_id) if isinstance(product_id, str) and ObjectId.is_valid(product_id) else None
+    sql_id = None
+    if isinstance(product_id, int) and not isinstance(product_id, bool):
+        sql_id = product_id
+    elif isinstance(product_id, str) and product_id.isdigit():
+        sql_id = int(product_id)
+    return oid, str(product_id), sql_id
+
+
+def find_product_docs(product_ids_in, projection=None, use_missing=True):
+    """Resolver varios identificadores de producto en una sola consulta.
+
+    Acepta `_id` (ObjectId o hex), el `id` legado o el `sql_id` de la
+    migración, con esa prioridad. Devuelve {identificador: documento} solo
+    con los encontrados. Los `_id` ya resueltos y los ids inexistentes se
+    recuerdan en `product_ids`.
+
+    Antes de dar un id por inexistente según la caché negativa se aplican
+    las altas de otros workers (`sync_product_indexes`, que la vacía). Las
+    rutas que escriben (ventas, compras, lotes, ajustes) pasan
+    `use_missing=False` y lo buscan siempre en Mongo.
+    """
+    db = get_db()
+    if db is None:
+        return {}
+    pending = []
+    oids, legacy, sql_ids = set(), set(), set()
+    synced = False
+    for pid in dict.fromkeys(p for p in product_ids_in if p not in (None, '')):
+        cached = product_ids.get(pid)
+        if cached is MISSING and use_missing and not synced:
+            synced = True
+            sync_product_indexes()
+            cached = product_ids.get(pid)
+        if cached is MISSING:
+            if use_missing:
+                continue
+            cached = None
+        if cached is not None:
+            oid, leg, sid = cached, None, None
+        else:
+            oid, leg, sid = _id_candidates(pid)
+        pending.append((pid, oid, leg, sid, cached is not None))
+        if oid is not None:
+            oids.add(oid)
+        if leg is not None:
+            legacy.add(leg)
+            if sid is not None:
+                legacy.add(sid)
+        if sid is not None:
+            sql_ids.add(sid)
+    if not pending:
+        return {}
+    conds = []
+    if oids:
+        conds.append({'_id': {'$in': list(oids)}})
+    if legacy:
+        conds.append({'id': {'$in': list(legacy)}})
+    if sql_ids:
+        conds.append({'sql_id': {'$in': list(sql_ids)}})
+    if projection is not None:
+        projection = dict(projection, _id=1, id=1, sql_id=1)
+    by_oid, by_legacy, by_sql = {}, {}, {}
+    for d in db.productos.find({'$or': conds}, projection):
+        by_oid[d['_id']] = d
+        if d.get('id') is not None:
+            by_legacy.setdefault(str(d['id']), d)
+        if d.get('sql_id') is not None:
+            by_sql.setdefault(d['sql_id'], d)
+    out = {}
+    for pid, oid, leg, sid, was_cached in pending:
+        doc = by_oid.get(oid) or by_legacy.get(leg) or by_sql.get(sid)
+        if doc is None:
+            if was_cached:
+                product_ids.invalidate(oid)
+            product_ids.put_missing(pid)
+            continue
+        product_ids.put(pid, doc['_id'])
+        out[pid] = doc
+    return out
+
+
+def resolve_product_ids(product_ids_in, use_missing=True):
+    """{identificador: `_id` canónico} para los productos que existen (una consulta)."""
+    docs = find_product_docs(product_ids_in, projection={'_id': 1}, use_missing=use_missing)
+    return {pid: d['_id'] for pid, d in docs.items()}
+
+
+def resolve_product_id(product_id, use_missing=True):
+    """`_id` canónico de un producto a partir de cualquiera de sus identificadores, o None."""
+    return resolve_product_ids([product_id], use_missing=use_missing).get(product_id)
+
+
 def get_product(product_id):
-    try:
-        from bson import ObjectId
-        db = get_db()
-        if db is None:
-            return None
-        doc = db.productos.find_one({'_id': ObjectId(product_id)})
-    except Exception:
-        # try direct id match
-        db = get_db()
-        if db is None:
-            return None
-        doc = db.productos.find_one({'id': product_id})
+    doc = find_product_docs([product_id]).get(product_id)
     return _product_doc_to_dict(doc)
 
 
+def get_products_batch(product_ids_in):
+    """{id pedido: producto} para varios ids de cualquier tipo, en una sola consulta."""
+    docs = find_product_docs(product_ids_in)
+    return {pid: _product_doc_to_dict(d) for pid, d in docs.items()}
+
+
 def get_product_by_barcode(codigo_barras):
+    """Producto por código de barras exacto (escaneo del POS).
+
+    El índice en memoria resuelve el código al `_id` sin recorrer
+    `Cod_barrras`, y el producto se relee por `_id`: existencia y precio son
+    siempre los de Mongo, no los que vio este worker en su última puesta al
+    día, porque con ellos se vende.
+    """
+    _ensure_product_indexes()
+    producto = barcode_index.get(codigo_barras)
     db = get_db()
     if db is None:
-        return None
+        return producto
+    if producto is not None:
+        doc = db.productos.find_one({'_id': _cursor_id(producto['id'])})
+        if doc is not None and str(doc.get('Cod_barrras') or '').strip() == str(codigo_barras).strip():
+            producto = _product_doc_to_dict(doc)
+            _index_product(dict(producto))
+            return producto
+        # se borró o cambió de código desde la última puesta al día
+        refresh_product(producto['id'])
+    # miss: puede ser un producto creado desde otro worker
     doc = db.productos.find_one({'Cod_barrras': codigo_barras})
-    return _product_doc_to_dict(doc)
+    producto = _product_doc_to_dict(doc)
+    if producto:
+        _index_product(dict(producto))
+    return producto
+
 
+def search_by_barcode(codigo_barras, limit=10, modo='prefijo'):
+    """Buscar productos por código de barras parcial.
 
-def search_by_barcode(codigo_barras):
-    regex = {'$regex': codigo_barras, '$options': 'i'}
+    modo: 'prefijo' (por defecto) o 'sufijo' se resuelven en el índice en
+    memoria; 'contiene' mantiene la búsqueda por subcadena en Mongo.
+    """
+    if modo in ('prefijo', 'sufijo'):
+        _ensure_product_indexes()
+        if barcode_prefix_index.built:
+            return barcode_prefix_index.search(codigo_barras, limit=limit, suffix=(modo == 'sufijo'))
+        # índice no disponible: consulta anclada equivalente
+        escaped = re.escape(str(codigo_barras))
+        pattern = f'^{escaped}' if modo == 'prefijo' else f'{escaped}$'
+        regex = {'$regex': pattern, '$options': 'i'}
+    else:
+        regex = {'$regex': codigo_barras, '$options': 'i'}
     db = get_db()
     if db is None:
         return []
-    docs = db.productos.find({'Cod_barrras': regex}).limit(10)
+    docs = db.productos.find({'Cod_barrras': regex}).limit(limit)
     return [_product_doc_to_dict(d) for d in docs]
 
 
-def search_suggestions_by_barcode(codigo_barras):
-    return search_by_barcode(codigo_barras)
+def search_suggestions_by_barcode(codigo_barras, limit=10, modo='prefijo'):
+    return search_by_barcode(codigo_barras, limit=limit, modo=modo)
 
 
 def create_product(codigo, Nombre_comercial, Nombre_generico=None, Precio_venta=0, Precio_compra=0, **kwargs):
@@ -704,42 +1459,239 @@ def create_product(codigo, Nombre_comercial, Nombre_generico=None, Precio_venta=
         doc['numero'] = get_next_sequence('productos')
     except Exception:
         pass
+    doc.update(product_change_stamp())
     res = db.productos.insert_one(doc)
+    product_ids.forget_missing()
+    _index_product(_product_doc_to_dict(doc))
     return str(res.inserted_id)
 
 
+def bulk_upsert_products(rows):
+    """Alta/actualización masiva de productos, identificados por `codigo` (o
+    `Cod_barrras` si la fila no trae código).
+
+    `rows` puede ser cualquier iterable (p. ej. un stream NDJSON): se valida y
+    escribe por lotes de `bulk.BATCH_SIZE` con `bulk_write` no ordenado, y por
+    lote se reservan de una vez los `numero` y `rev` necesarios. Devuelve una
+    lista con el resultado de cada fila: {'fila', 'estado' ('creado',
+    'actualizado' o 'error'), 'id' | 'error'}.
+
+    Una fila sin `Nombre_comercial` solo puede actualizar: se escribe sin
+    upsert y, si el producto no existe, queda como error.
+    """
+    db = get_db()
+    if db is None:
+        raise RuntimeError('MongoDB not initialized')
+    # upsert y relectura por `codigo` / `Cod_barrras`
+    ensure_catalog_indexes(db)
+    results = []
+    for batch in bulk.batches(rows):
+        docs = []
+        keys = []
+        seen = set()
+        for i, row in batch:
+            doc, error = bulk.clean_row(row)
+            if error is None and bulk.upsert_key(doc) in seen:
+                error = f'{bulk.upsert_key(doc)[0]} repetido en el mismo lote'
+            if error is not None:
+                results.append({'fila': i, 'estado': 'error', 'error': error})
+                continue
+            docs.append((i, doc))
+            keys.append(bulk.upsert_key(doc))
+            seen.add(keys[-1])
+        if not docs:
+            continue
+
+        revs = next_revs(len(docs))
+        numero = reserve_sequence('productos', len(docs))
+        now = datetime.utcnow()
+        ops = []
+        for n, (_, doc) in enumerate(docs):
+            field, value = keys[n]
+            doc['rev'] = revs[n]
+            doc['updated_at'] = now
+            if doc.get('Nombre_comercial'):
+                ops.append(UpdateOne({field: value}, {'$set': doc, '$setOnInsert': {'numero': numero + n}}, upsert=True))
+            else:
+                ops.append(UpdateOne({field: value}, {'$set': doc}))
+        try:
+            res = db.productos.bulk_write(ops, ordered=False)
+            upserted = dict(res.upserted_ids or {})
+            errors = {}
+        except BulkWriteError as e:
+            upserted = {u['index']: u['_id'] for u in e.details.get('upserted', [])}
+            errors = {w['index']: w.get('errmsg') for w in e.details.get('writeErrors', [])}
+
+        # releer el lote en una consulta: ids de cada fila y parche de los índices en memoria
+        codigos = [v for f, v in keys if f == 'codigo']
+        barras = [v for f, v in keys if f == 'Cod_barrras']
+        ids = {}
+        productos = []
+        for d in db.productos.find({'$or': [{'codigo': {'$in': codigos}}, {'Cod_barrras': {'$in': barras}}]}):
+            p = _product_doc_to_dict(d)
+            productos.append(p)
+            ids.setdefault(('codigo', p.get('codigo')), p['id'])
+            ids.setdefault(('Cod_barrras', p.get('Cod_barrras')), p['id'])
+        _index_products(productos)
+        if upserted:
+            product_ids.forget_missing()
+
+        for n, (i, doc) in enumerate(docs):
+            if n in errors:
+                results.append({'fila': i, 'estado': 'error', 'error': errors[n]})
+            elif keys[n] not in ids and not doc.get('Nombre_comercial'):
+                results.append({'fila': i, 'estado': 'error', 'error': bulk.NEW_WITHOUT_NAME})
+            else:
+                results.append({'fila': i, 'estado': 'creado' if n in upserted else 'actualizado', 'id': ids.get(keys[n])})
+    results.sort(key=lambda r: r['fila'])
+    return results
+
+
+def reprice_products(regla, dry_run=True):
+    """Reprecio masivo según `regla` (ver `products.repricing.parse_rule`).
+
+    Lee solo los campos de precio de los productos que cumplen los filtros,
+    calcula los nuevos precios en bloque y, salvo en modo prueba, los escribe
+    con `bulk_write` por lotes. Devuelve {'total', 'actualizados', 'muestra'}.
+    """
+    db = get_db()
+    if db is None:
+        raise RuntimeError('MongoDB not initialized')
+    projection = {'_id': 1, 'codigo': 1, 'Nombre_comercial': 1, 'Precio_compra': 1, 'Precio_venta': 1, 'Margen_utilidad': 1}
+    productos = list(db.productos.find(regla['filtros'], projection))
+    nuevos = repricing.compute(productos, regla)
+    out = {'total': len(productos), 'actualizados': 0, 'muestra': repricing.preview(productos, nuevos)}
+    if dry_run or not productos:
+        return out
+
+    now = datetime.utcnow()
+    for start in range(0, len(productos), bulk.BATCH_SIZE):
+        lote = productos[start:start + bulk.BATCH_SIZE]
+        revs = next_revs(len(lote))
+        ops = []
+        for n, (p, (compra, venta, margen)) in enumerate(zip(lote, nuevos[start:start + bulk.BATCH_SIZE])):
+            ops.append(UpdateOne({'_id': p['_id']}, {'$set': {
+                'Precio_compra': compra, 'Precio_venta': venta, 'Margen_utilidad': margen,
+                'rev': revs[n], 'updated_at': now,
+            }}))
+        res = db.productos.bulk_write(ops, ordered=False)
+        out['actualizados'] += res.modified_count
+        ids = [p['_id'] for p in lote]
+        _index_products([_product_doc_to_dict(d) for d in db.productos.find({'_id': {'$in': ids}})])
+    return out
+
+
 def update_product(product_id, **kwargs):
-    try:
-        from bson import ObjectId
-        oid = ObjectId(product_id)
-        db = get_db()
-        if db is None:
-            return False
-        res = db.productos.update_one({'_id': oid}, {'$set': kwargs})
-        return res.modified_count > 0
-    except Exception:
-        db = get_db()
-        if db is None:
-            return False
-        res = db.productos.update_one({'id': product_id}, {'$set': kwargs})
-        return res.modified_count > 0
+    db = get_db()
+    if db is None:
+        return False
+    oid = resolve_product_id(product_id, use_missing=False)
+    if oid is None:
+        return False
+    res = db.productos.update_one({'_id': oid}, {'$set': dict(kwargs, **product_change_stamp())})
+    if res.modified_count > 0:
+        refresh_product(oid)
+    return res.modified_count > 0
 
 
 def delete_product(product_id):
+    db = get_db()
+    if db is None:
+        return False
+    oid = resolve_product_id(product_id, use_missing=False)
+    if oid is None:
+        return False
+    doc = db.productos.find_one_and_delete({'_id': oid})
+    if not doc:
+        return False
+    product_ids.invalidate(oid)
+    _unindex_product(str(doc.get('_id')))
+    now = datetime.utcnow()
     try:
-        from bson import ObjectId
-        oid = ObjectId(product_id)
-        db = get_db()
-        if db is None:
-            return False
-        res = db.productos.delete_one({'_id': oid})
-        return res.deleted_count > 0
+        db.productos_eliminados.insert_one({
+            'product_id': str(doc.get('_id')),
+            'codigo': doc.get('codigo'),
+            'rev': get_next_sequence('productos_rev'),
+            'deleted_at': now,
+            'updated_at': now,
+        })
     except Exception:
-        db = get_db()
-        if db is None:
-            return False
-        res = db.productos.delete_one({'id': product_id})
-        return res.deleted_count > 0
+        pass
+    return True
+
+
+# margen (s) que se deja a las escrituras en curso antes de publicarlas en `cambios`
+DEFAULT_SYNC_LAG = 30
+
+
+def _sync_lag():
+    if has_app_context():
+        return float(current_app.config.get('PRODUCT_SYNC_LAG', DEFAULT_SYNC_LAG))
+    return DEFAULT_SYNC_LAG
+
+
+def _change_position(since=None, cursor=None):
+    """(updated_at, rev) desde donde seguir; None = desde el principio.
+
+    `cursor` es el que devolvió la llamada anterior (ya decodificado). `since` (una `rev`) es
+    el parámetro de las versiones anteriores: se traduce a la posición del
+    cambio con esa `rev` y, si ya no existe, se empieza de cero.
+    """
+    if cursor:
+        ts, rev = cursor
+        return datetime.fromisoformat(ts), rev
+    if not since:
+        return None
+    db = get_db()
+    for col in (db.productos, db.productos_eliminados):
+        doc = col.find_one({'rev': since, 'updated_at': {'$exists': True}}, {'updated_at': 1})
+        if doc:
+            return doc['updated_at'], since
+    return None
+
+
+def get_product_changes(since=0, limit=500, cursor=None):
+    """Productos modificados y eliminados desde la última llamada, en orden de `updated_at`.
+
+    Retorna {'productos', 'eliminados' (ids), 'cursor', 'rev', 'has_more'}.
+    El cliente guarda `cursor` y lo envía la próxima vez; si `has_more`,
+    vuelve a pedir enseguida.
+
+    `rev` se asigna antes de que la escritura se confirme, así que un cambio
+    puede hacerse visible después de otro posterior. Para no saltárselo solo
+    se devuelven cambios con más de `PRODUCT_SYNC_LAG` segundos: el cursor
+    nunca avanza más allá de una escritura que pueda seguir en curso. Los
+    productos anteriores a las revisiones no tienen `rev`/`updated_at` (ver
+    scripts/backfill_product_revs.py).
+    """
+    db = get_db()
+    if db is None:
+        return {'productos': [], 'eliminados': [], 'cursor': None, 'rev': since, 'has_more': False}
+    horizon = datetime.utcnow() - timedelta(seconds=_sync_lag())
+    q = {'updated_at': {'$lte': horizon}, 'rev': {'$exists': True}}
+    pos = _change_position(since, cursor)
+    if pos is not None:
+        ts, rev = pos
+        q['$or'] = [{'updated_at': {'$gt': ts}}, {'updated_at': ts, 'rev': {'$gt': rev}}]
+    order = [('updated_at', 1), ('rev', 1)]
+    key = lambda e: (e[2]['updated_at'], e[0])
+    changed = [(d['rev'], 'p', d) for d in db.productos.find(q).sort(order).limit(limit + 1)]
+    deleted = [(d['rev'], 'd', d) for d in db.productos_eliminados.find(q).sort(order).limit(limit + 1)]
+    merged = sorted(changed + deleted, key=key)
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    productos = [_product_doc_to_dict(d) for _, kind, d in merged if kind == 'p']
+    eliminados = [d.get('product_id') for _, kind, d in merged if kind == 'd']
+    if merged:
+        pos = key(merged[-1])
+        since = pos[1]
+    return {
+        'productos': productos,
+        'eliminados': eliminados,
+        'cursor': encode_cursor([pos[0].isoformat(), pos[1]]) if pos is not None else None,
+        'rev': since,
+        'has_more': has_more,
+    }
 
 
 def get_product_full_details(product_id):
@@ -789,11 +1741,12 @@ def update_cliente(cliente_id, **kwargs):
         if db is None:
             return False
         res = db.clientes.update_one({'_id': oid}, {'$set': kwargs})
-        return res.modified_count > 0
     except Exception:
         db = get_db()
         if db is None:
             return False
         res = db.clientes.update_one({'id': cliente_id}, {'$set': kwargs})
-        return res.modified_count > 0
+    if res.modified_count > 0:
+        bump_collection_version('clientes')
+    return res.modified_count > 0
 
@@ -0,0 +1,34 @@
+"""Paginación por cursor (keyset) para los listados.
+
+El cursor es opaco para el cliente: codifica el id del último elemento de la
+página en base64. Los helpers filtran `_id > cursor` (o `<` en orden
+descendente) sobre el índice de `_id`, así que una página profunda cuesta lo
+mismo que la primera, a diferencia de `skip`.
+"""
+import base64
+import json
+
+
+def encode_cursor(last_id):
+    raw = json.dumps({'id': last_id}, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Devuelve el id codificado en `cursor`; ValueError si no es válido."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return data['id']
+    except Exception:
+        raise ValueError('cursor inválido')
+
+
+def next_cursor(items, limit):
+    """Cursor de la página siguiente, o None si esta fue la última."""
+    if not items or len(items) < limit:
+        return None
+    last = items[-1]
+    if not isinstance(last, dict) or last.get('id') is None:
+        return None
+    return encode_cursor(last.get('id'))
@@ -0,0 +1,214 @@
+"""Índices en memoria por código de barras (exacto y por prefijo/sufijo).
+
+Cada proceso (worker) mantiene su propia copia. Se construyen al arrancar la
+app (ver `mongo_models.build_product_indexes`), se parchean en cada escritura
+de productos y se ponen al día con las de otros workers
+(`mongo_models.sync_product_indexes`). Las sugerencias en caja se responden
+desde aquí; el escaneo exacto resuelve aquí el `_id` y relee el producto por
+`_id` (existencia y precio al momento).
+"""
+import bisect
+import threading
+import time
+
+
+class BarcodeIndex:
+    """Hash `Cod_barrras` -> dict del producto (ya pasado por `_product_doc_to_dict`)."""
+
+    def __init__(self):
+        self._by_code = {}
+        self._code_by_id = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.built_at = None
+
+    @property
+    def built(self):
+        return self.built_at is not None
+
+    @staticmethod
+    def _key(codigo):
+        if codigo is None:
+            return None
+        key = str(codigo).strip()
+        return key or None
+
+    def build(self, productos):
+        """Reconstruye el índice completo a partir de productos serializados."""
+        by_code = {}
+        code_by_id = {}
+        for p in productos:
+            key = self._key(p.get('Cod_barrras'))
+            if not key:
+                continue
+            # ante códigos duplicados se queda el primero, igual que find_one
+            if key in by_code:
+                continue
+            by_code[key] = p
+            code_by_id[p.get('id')] = key
+        with self._lock:
+            self._by_code = by_code
+            self._code_by_id = code_by_id
+            self.built_at = time.time()
+
+    def get(self, codigo):
+        """Devuelve una copia del producto o None; actualiza los contadores."""
+        p = self._by_code.get(self._key(codigo))
+        if p is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(p)
+
+    def upsert(self, producto):
+        """Inserta o reemplaza la entrada de un producto (por su `id`)."""
+        if not producto:
+            return
+        pid = producto.get('id')
+        key = self._key(producto.get('Cod_barrras'))
+        with self._lock:
+            old_key = self._code_by_id.pop(pid, None)
+            if old_key is not None and self._by_code.get(old_key, {}).get('id') == pid:
+                del self._by_code[old_key]
+            if not key:
+                return
+            current = self._by_code.get(key)
+            if current is not None and current.get('id') != pid:
+                # código ocupado por otro producto: no pisarlo
+                return
+            self._by_code[key] = producto
+            self._code_by_id[pid] = key
+
+    def remove(self, product_id):
+        pid = str(product_id)
+        with self._lock:
+            key = self._code_by_id.pop(pid, None)
+            if key is not None and self._by_code.get(key, {}).get('id') == pid:
+                del self._by_code[key]
+
+    def clear(self):
+        with self._lock:
+            self._by_code = {}
+            self._code_by_id = {}
+            self.built_at = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._by_code),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits / total) if total else 0.0,
+            'built_at': self.built_at,
+        }
+
+
+class BarcodePrefixIndex:
+    """Arreglos ordenados de códigos de barras para sugerencias por prefijo o sufijo.
+
+    Sustituye el `$regex` sin anclar sobre `Cod_barrras`: la búsqueda es un
+    `bisect` sobre la lista ordenada y recorre solo los códigos que comparten
+    el prefijo. El modo sufijo usa una segunda lista con los códigos invertidos
+    (para buscar por los últimos dígitos de la etiqueta).
+    """
+
+    def __init__(self):
+        self._prefix = []      # [(codigo, id)] ordenado
+        self._suffix = []      # [(codigo invertido, id)] ordenado
+        self._products = {}    # id -> producto serializado
+        self._code_by_id = {}  # id -> codigo normalizado
+        self._lock = threading.Lock()
+        self.built_at = None
+
+    @property
+    def built(self):
+        return self.built_at is not None
+
+    @staticmethod
+    def _key(codigo):
+        if codigo is None:
+            return None
+        key = str(codigo).strip().lower()
+        return key or None
+
+    def build(self, productos):
+        prefix = []
+        suffix = []
+        products = {}
+        code_by_id = {}
+        for p in productos:
+            key = self._key(p.get('Cod_barrras'))
+            if not key:
+                continue
+            pid = p.get('id')
+            prefix.append((key, pid))
+            suffix.append((key[::-1], pid))
+            products[pid] = p
+            code_by_id[pid] = key
+        prefix.sort()
+        suffix.sort()
+        with self._lock:
+            self._prefix = prefix
+            self._suffix = suffix
+            self._products = products
+            self._code_by_id = code_by_id
+            self.built_at = time.time()
+
+    def _discard(self, pid):
+        key = self._code_by_id.pop(pid, None)
+        self._products.pop(pid, None)
+        if key is None:
+            return
+        for arr, entry in ((self._prefix, (key, pid)), (self._suffix, (key[::-1], pid))):
+            i = bisect.bisect_left(arr, entry)
+            if i < len(arr) and arr[i] == entry:
+                del arr[i]
+
+    def upsert(self, producto):
+        if not producto:
+            return
+        pid = producto.get('id')
+        key = self._key(producto.get('Cod_barrras'))
+        with self._lock:
+            self._discard(pid)
+            if not key:
+                return
+            bisect.insort(self._prefix, (key, pid))
+            bisect.insort(self._suffix, (key[::-1], pid))
+            self._products[pid] = producto
+            self._code_by_id[pid] = key
+
+    def remove(self, product_id):
+        with self._lock:
+            self._discard(str(product_id))
+
+    def search(self, codigo, limit=10, suffix=False):
+        """Devuelve hasta `limit` productos cuyo código empieza (o termina) por `codigo`."""
+        q = self._key(codigo)
+        if not q or limit <= 0:
+            return []
+        if suffix:
+            q = q[::-1]
+        out = []
+        with self._lock:
+            arr = self._suffix if suffix else self._prefix
+            i = bisect.bisect_left(arr, (q,))
+            while i < len(arr) and len(out) < limit:
+                key, pid = arr[i]
+                if not key.startswith(q):
+                    break
+                out.append(dict(self._products[pid]))
+                i += 1
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._prefix = []
+            self._suffix = []
+            self._products = {}
+            self._code_by_id = {}
+            self.built_at = None
+
+    def stats(self):
+        return {'entries': len(self._prefix), 'built_at': self.built_at}
@@ -0,0 +1,92 @@
+"""Carga masiva de productos (`POST /api/productos/bulk`).
+
+Lectura en streaming de NDJSON y validación fila a fila, compartidas por los
+helpers de Mongo y SQL. Cada fila válida queda como un dict con solo los
+campos conocidos y los tipos normalizados; las inválidas, como un mensaje
+de error que se devuelve en el resultado de esa fila.
+"""
+import json
+
+TEXT_FIELDS = (
+    'codigo', 'Nombre_comercial', 'Nombre_generico', 'Cod_barrras', 'Accion_terapeutica',
+    'Principio_activo', 'Concentracion', 'Presentacion', 'Cod_imp_nacionales', 'Cod_nandina',
+)
+FLOAT_FIELDS = (
+    'Precio_venta', 'Precio_compra', 'Margen_utilidad', 'Cantidad_minima_pedido',
+    'Cantidad_maxima_inventario', 'Cantidad_minima_inventario',
+)
+INT_FIELDS = ('existencia', 'Tiempo_sin_movimiento', 'Alerta_caducidad_dias')
+FLAG_FIELDS = ('Control_inventario', 'Receta_medica', 'Favorito', 'Granel', 'Medicamento_controlado', 'Solo_compra')
+REF_FIELDS = ('id_subcategoria', 'id_forma_farmaceutica', 'id_marca', 'id_laboratorio', 'id_unidad_medida', 'vencimiento')
+
+# filas por bulk_write / commit
+BATCH_SIZE = 1000
+# tope del cuerpo en modo arreglo JSON, que se carga entero en memoria (NDJSON no tiene tope)
+JSON_MAX_BYTES = 10 * 1024 * 1024
+
+# una fila sin nombre solo puede actualizar un producto existente
+NEW_WITHOUT_NAME = 'el producto no existe y para crearlo se requiere Nombre_comercial'
+
+
+def iter_ndjson(lines):
+    """Una fila por línea no vacía: produce el dict o un ValueError si la línea no es JSON."""
+    for raw in lines:
+        if isinstance(raw, bytes):
+            raw = raw.decode('utf-8')
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            yield json.loads(raw)
+        except ValueError as e:
+            yield ValueError(f'JSON inválido: {e}')
+
+
+def clean_row(row):
+    """Valida y normaliza una fila. Devuelve (doc, None) o (None, mensaje de error)."""
+    if isinstance(row, Exception):
+        return None, str(row)
+    if not isinstance(row, dict):
+        return None, 'cada fila debe ser un objeto'
+    doc = {}
+    for f in TEXT_FIELDS:
+        v = row.get(f)
+        if v is not None and v != '':
+            doc[f] = str(v).strip()
+    if not doc.get('codigo') and not doc.get('Cod_barrras'):
+        return None, 'se requiere codigo o Cod_barrras'
+    try:
+        for f in FLOAT_FIELDS:
+            if row.get(f) not in (None, ''):
+                doc[f] = float(row[f])
+        for f in INT_FIELDS:
+            if row.get(f) not in (None, ''):
+                doc[f] = int(row[f])
+    except (TypeError, ValueError):
+        return None, f'valor numérico inválido en {f}'
+    for f in FLAG_FIELDS:
+        if f in row:
+            doc[f] = 1 if row.get(f) else 0
+    for f in REF_FIELDS:
+        if row.get(f) not in (None, ''):
+            doc[f] = row[f]
+    return doc, None
+
+
+def upsert_key(doc):
+    """Campo y valor con que se identifica el producto: `codigo`, o `Cod_barrras` si no hay código."""
+    if doc.get('codigo'):
+        return 'codigo', doc['codigo']
+    return 'Cod_barrras', doc['Cod_barrras']
+
+
+def batches(rows, size=BATCH_SIZE):
+    """Agrupa (índice de fila, fila) en lotes de `size` sin materializar toda la entrada."""
+    batch = []
+    for i, row in enumerate(rows):
+        batch.append((i, row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
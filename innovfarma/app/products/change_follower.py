@@ -0,0 +1,131 @@
+"""Puesta al día de los índices en memoria con lo que escriben otros procesos.
+
+Cada worker (y cada instancia) tiene su propia copia de los índices de
+productos, y las escrituras de los demás workers, instancias o scripts solo
+le llegan a través de Mongo. Antes de responder desde un índice,
+`mongo_models` llama a `ChangeFollower.poll`, que como mucho cada
+`interval` segundos:
+
+1. lee la versión de `productos` (`counters/productos_rev`, una lectura por
+   `_id`), que se mueve con cada escritura;
+2. si se movió, o se movió hace menos de `overlap` segundos, lee los sellos
+   (`_id`, `rev`) de los productos y tombstones con `updated_at` dentro de
+   la ventana;
+3. pasa a `apply` solo los que todavía no aplicó este worker.
+
+`rev` y `updated_at` se asignan antes de confirmar la escritura, así que cada
+ventana se solapa `overlap` segundos con la anterior: un cambio que se
+confirma tarde se ve en la lectura siguiente. Como la versión y la ventana
+solo se mueven cuando la lectura termina bien, un fallo de Mongo no hace que
+se pierda ningún cambio.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_OVERLAP = 30.0
+
+
+class ChangeFollower:
+    """Versión y ventana (`updated_at`) ya leídas, más los sellos ya aplicados."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, overlap=DEFAULT_OVERLAP):
+        self.interval = interval
+        self.overlap = overlap
+        self._lock = threading.Lock()
+        # `apply` vuelve a entrar por `note` (vía los índices), así que `_seen` tiene su propio cerrojo
+        self._seen_lock = threading.Lock()
+        self._next_poll = 0.0
+        self._version = None
+        self._since = None
+        self._active_until = 0.0
+        self._seen = {}  # id de producto -> (rev aplicada, cuándo)
+        self.polls = 0
+        self.reads = 0
+        self.applied = 0
+
+    def configure(self, interval=None, overlap=None):
+        if interval is not None:
+            self.interval = float(interval)
+        if overlap is not None:
+            self.overlap = float(overlap)
+
+    def reset(self, version, started):
+        """Tras una carga completa: `started` es la hora (UTC) a la que empezó."""
+        with self._lock:
+            self._version = version
+            self._since = started - timedelta(seconds=self.overlap)
+            self._active_until = time.monotonic() + self.overlap
+            self._next_poll = 0.0
+        with self._seen_lock:
+            self._seen = {}
+
+    def note(self, product_id, rev):
+        """Un cambio que este worker ya aplicó (p. ej. su propia escritura)."""
+        if product_id is not None and rev is not None:
+            with self._seen_lock:
+                self._seen[product_id] = (rev, time.monotonic())
+
+    def poll(self, read_version, read_stamps, apply):
+        """Aplicar los cambios nuevos, como mucho una vez cada `interval` segundos.
+
+        `read_version()` -> versión actual; `read_stamps(desde)` -> iterable de
+        (id, rev, eliminado); `apply(cambiados, eliminados)` con listas de ids.
+        Devuelve cuántos cambios se aplicaron.
+        """
+        now = time.monotonic()
+        if self._since is None or now < self._next_poll:
+            return 0
+        if not self._lock.acquire(blocking=False):
+            # otro hilo ya está leyendo
+            return 0
+        try:
+            if now < self._next_poll:
+                return 0
+            self._next_poll = now + self.interval
+            self.polls += 1
+            version = read_version()
+            if version == self._version and now > self._active_until:
+                return 0
+            started = datetime.utcnow()
+            stamps = list(read_stamps(self._since))
+            with self._seen_lock:
+                seen = dict(self._seen)
+            fresh = {}
+            for pid, rev, deleted in stamps:
+                if pid is None or seen.get(pid, (None,))[0] == rev:
+                    continue
+                fresh[pid] = (rev, deleted)
+            self.reads += 1
+            changed = [pid for pid, (_, deleted) in fresh.items() if not deleted]
+            deleted = [pid for pid, (_, gone) in fresh.items() if gone]
+            if fresh:
+                apply(changed, deleted)
+                self.applied += len(fresh)
+            if version != self._version:
+                self._active_until = now + self.overlap
+            self._version = version
+            self._since = started - timedelta(seconds=self.overlap)
+            # lo que quedó fuera de la ventana ya no se vuelve a leer
+            cutoff = now - 2 * self.overlap
+            with self._seen_lock:
+                for pid, (rev, _) in fresh.items():
+                    # si `apply` ya anotó una rev más nueva (`note`), se queda esa
+                    if self._seen.get(pid, (None, 0.0))[1] < now:
+                        self._seen[pid] = (rev, now)
+                self._seen = {pid: v for pid, v in self._seen.items() if v[1] >= cutoff}
+            return len(fresh)
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'overlap': self.overlap,
+            'version': self._version,
+            'since': self._since.isoformat() if self._since else None,
+            'polls': self.polls,
+            'reads': self.reads,
+            'applied': self.applied,
+        }
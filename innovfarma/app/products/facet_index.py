@@ -0,0 +1,152 @@
+"""Índice de facetas para el filtro avanzado de productos.
+
+Por cada campo de faceta guarda valor -> {ids de producto}. Una consulta
+intersecta los conjuntos de los filtros activos y, en la misma pasada,
+cuenta los productos por valor de cada faceta. Los conteos de una faceta se
+calculan sin su propio filtro (así la UI puede mostrar cuántos productos
+habría al cambiar de marca sin perder el resto de filtros).
+
+Los valores se comparan como en Mongo: 5 y '5' son valores distintos, igual
+que True y 1. Los resultados no se cachean aquí sino en `result_cache`, que
+`mongo_models` invalida cuando `upsert`/`remove` avisan de que cambiaron los
+valores de faceta de algún producto. Hay una copia por worker, mantenida
+desde `mongo_models` como los demás índices de productos.
+"""
+import threading
+import time
+from collections import Counter
+
+FACET_FIELDS = ('id_marca', 'id_laboratorio', 'id_subcategoria', 'id_forma_farmaceutica')
+
+
+def _key(value):
+    """Clave del valor en el índice, o None si no se indexa (vacío o no hashable).
+
+    Los booleanos van aparte porque en Python True == 1 (y hashean igual).
+    """
+    if value is None or value == '':
+        return None
+    try:
+        hash(value)
+    except TypeError:
+        return None
+    return (isinstance(value, bool), value)
+
+
+class FacetIndex:
+    """Campo -> valor -> {ids}."""
+
+    def __init__(self, fields=FACET_FIELDS):
+        self.fields = tuple(fields)
+        self._postings = {f: {} for f in self.fields}
+        self._values_by_id = {}
+        self._products = {}
+        self._lock = threading.Lock()
+        self.built_at = None
+
+    @property
+    def built(self):
+        return self.built_at is not None
+
+    def _discard(self, pid):
+        self._products.pop(pid, None)
+        values = self._values_by_id.pop(pid, None)
+        if not values:
+            return values
+        for field, value in values.items():
+            members = self._postings[field].get(value)
+            if members is not None:
+                members.discard(pid)
+                if not members:
+                    del self._postings[field][value]
+        return values
+
+    def _insert(self, producto):
+        pid = producto.get('id')
+        values = {}
+        for field in self.fields:
+            value = _key(producto.get(field))
+            if value is not None:
+                self._postings[field].setdefault(value, set()).add(pid)
+                values[field] = value
+        self._values_by_id[pid] = values
+        self._products[pid] = producto
+        return values
+
+    def build(self, productos):
+        with self._lock:
+            self._postings = {f: {} for f in self.fields}
+            self._values_by_id = {}
+            self._products = {}
+            for p in productos:
+                self._insert(p)
+            self.built_at = time.time()
+
+    def upsert(self, producto):
+        """Indexar `producto`; True si es nuevo o cambiaron sus valores de faceta."""
+        if not producto:
+            return False
+        with self._lock:
+            pid = producto.get('id')
+            nuevo = pid not in self._products
+            antes = self._discard(pid)
+            despues = self._insert(producto)
+            return nuevo or despues != antes
+
+    def remove(self, product_id):
+        """True si el producto estaba indexado (cambian los conteos)."""
+        with self._lock:
+            pid = str(product_id)
+            estaba = pid in self._products
+            self._discard(pid)
+            return estaba
+
+    def clear(self):
+        with self._lock:
+            self._postings = {f: {} for f in self.fields}
+            self._values_by_id = {}
+            self._products = {}
+            self.built_at = None
+
+    def _matching(self, filters, skip_field=None):
+        """Ids que cumplen todos los filtros (salvo `skip_field`); None = todos."""
+        sets = []
+        for field, value in filters.items():
+            if field == skip_field:
+                continue
+            sets.append(self._postings[field].get(value, set()))
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return set(sets[0]).intersection(*sets[1:])
+
+    def query(self, filters, limit=100, skip=0):
+        """Página de productos que cumplen `filters` ({campo: valor}) más los conteos.
+
+        Devuelve (productos, conteos por faceta {campo: {valor: n}}, total de coincidencias).
+        """
+        filters = {f: _key(v) for f, v in filters.items() if f in self.fields and _key(v) is not None}
+        with self._lock:
+            ids = self._matching(filters)
+            # ids de ObjectId ordenados = orden de `_id`, el mismo que usa list_products
+            ordered = sorted(self._products if ids is None else ids)
+            facets = {}
+            for field in self.fields:
+                base = self._matching(filters, skip_field=field) if field in filters else ids
+                if base is None:
+                    counts = {v: len(m) for v, m in self._postings[field].items()}
+                else:
+                    values_by_id = self._values_by_id
+                    counts = Counter(values_by_id[pid].get(field) for pid in base)
+                    counts.pop(None, None)
+                ranked = sorted(counts.items(), key=lambda kv: (-kv[1], str(kv[0][1])))
+                facets[field] = {value: n for (_, value), n in ranked}
+            page = [dict(self._products[pid]) for pid in ordered[skip:skip + limit]]
+        return page, facets, len(ordered)
+
+    def stats(self):
+        return {
+            'entries': len(self._products),
+            'values': {f: len(self._postings[f]) for f in self.fields},
+            'built_at': self.built_at,
+        }
@@ -0,0 +1,223 @@
+"""Búsqueda tolerante a errores de tipeo sobre los nombres de productos.
+
+Índice de trigramas sobre las palabras de `Nombre_comercial` y
+`Nombre_generico`: los trigramas compartidos seleccionan candidatos
+('amoxicillina' comparte casi todos con 'amoxicilina') y solo a esos se les
+calcula la distancia de edición, con un presupuesto fijo de tiempo por
+consulta. Se mantiene por worker igual que `search_index`.
+"""
+import threading
+import time
+
+from .search_index import normalize, tokenize
+
+FUZZY_FIELDS = {
+    'Nombre_comercial': 1.0,
+    'Nombre_generico': 0.9,
+}
+
+# distancia máxima por defecto según la longitud de la palabra buscada
+MAX_DISTANCE = 3
+
+
+def default_distance(word):
+    if len(word) <= 3:
+        return 0
+    if len(word) <= 6:
+        return 1
+    return 2
+
+
+def padded_trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def levenshtein(a, b, max_dist):
+    """Distancia de edición entre `a` y `b`, o None si supera `max_dist`."""
+    if abs(len(a) - len(b)) > max_dist:
+        return None
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            cost = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            cur.append(cost)
+            if cost < row_min:
+                row_min = cost
+        if row_min > max_dist:
+            return None
+        prev = cur
+    return prev[-1] if prev[-1] <= max_dist else None
+
+
+class FuzzyNameIndex:
+    """Palabra -> {id producto: peso} más trigrama -> {palabras}."""
+
+    def __init__(self, fields=None):
+        self.fields = dict(fields or FUZZY_FIELDS)
+        self._postings = {}
+        self._trigrams = {}
+        self._products = {}
+        self._words_by_id = {}
+        self._sort_keys = {}
+        self._lock = threading.Lock()
+        self.built_at = None
+        self.budget_exhausted = 0
+
+    @property
+    def built(self):
+        return self.built_at is not None
+
+    def _doc_words(self, producto):
+        weights = {}
+        for field, weight in self.fields.items():
+            for word in tokenize(producto.get(field)):
+                if word.isalpha() and weight > weights.get(word, 0.0):
+                    weights[word] = weight
+        return weights
+
+    def _discard(self, pid):
+        self._products.pop(pid, None)
+        self._sort_keys.pop(pid, None)
+        for word in self._words_by_id.pop(pid, ()):
+            posting = self._postings.get(word)
+            if posting is None:
+                continue
+            posting.pop(pid, None)
+            if posting:
+                continue
+            del self._postings[word]
+            for tri in padded_trigrams(word):
+                words = self._trigrams.get(tri)
+                if words is not None:
+                    words.discard(word)
+                    if not words:
+                        del self._trigrams[tri]
+
+    def _insert(self, producto):
+        pid = producto.get('id')
+        weights = self._doc_words(producto)
+        for word, weight in weights.items():
+            posting = self._postings.get(word)
+            if posting is None:
+                posting = self._postings[word] = {}
+                for tri in padded_trigrams(word):
+                    self._trigrams.setdefault(tri, set()).add(word)
+            posting[pid] = weight
+        self._products[pid] = producto
+        self._words_by_id[pid] = set(weights)
+        self._sort_keys[pid] = normalize(producto.get('Nombre_comercial'))
+
+    def build(self, productos):
+        with self._lock:
+            self._postings = {}
+            self._trigrams = {}
+            self._products = {}
+            self._words_by_id = {}
+            self._sort_keys = {}
+            for p in productos:
+                self._insert(p)
+            self.built_at = time.time()
+
+    def upsert(self, producto):
+        if not producto:
+            return
+        with self._lock:
+            self._discard(producto.get('id'))
+            self._insert(producto)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._discard(str(product_id))
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._trigrams = {}
+            self._products = {}
+            self._words_by_id = {}
+            self._sort_keys = {}
+            self.built_at = None
+
+    def _similar_words(self, word, max_dist, deadline):
+        """Palabras del índice a distancia <= max_dist de `word`: {palabra: distancia}."""
+        if max_dist <= 0:
+            return {word: 0} if word in self._postings else {}
+        tris = padded_trigrams(word)
+        shared = {}
+        for tri in tris:
+            for w in self._trigrams.get(tri, ()):
+                shared[w] = shared.get(w, 0) + 1
+        # lema de q-gramas: cada edición destruye como mucho 3 trigramas
+        out = {}
+        for w, n in sorted(shared.items(), key=lambda kv: -kv[1]):
+            if n < max(len(word), len(w)) + 1 - 3 * max_dist:
+                continue
+            if time.perf_counter() > deadline:
+                self.budget_exhausted += 1
+                break
+            d = levenshtein(word, w, max_dist)
+            if d is not None:
+                out[w] = d
+        return out
+
+    def search(self, term, limit=50, max_distance=None, budget_ms=15):
+        """Productos cuyos nombres contienen todas las palabras de `term` salvo
+        `max_distance` errores por palabra, de la más parecida a la menos.
+
+        Devuelve una lista de (producto, distancia total). Al agotar
+        `budget_ms` se devuelve lo encontrado hasta ese momento.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000.0
+        words = [w for w in dict.fromkeys(tokenize(term)) if w.isalpha()]
+        if not words or limit <= 0:
+            return []
+        cap = max(5 * limit, 500)
+        with self._lock:
+            postings = self._postings
+            matches = []
+            for word in words:
+                k = default_distance(word) if max_distance is None else min(int(max_distance), MAX_DISTANCE)
+                similar = self._similar_words(word, k, deadline)
+                if not similar:
+                    return []
+                matches.append((sum(len(postings[w]) for w in similar), similar))
+            # la palabra más selectiva define los candidatos; el resto solo filtra
+            matches.sort(key=lambda m: m[0])
+            first = matches[0][1]
+            scores = {}
+            for w, d in sorted(first.items(), key=lambda kv: kv[1]):
+                for pid, weight in postings[w].items():
+                    cur = scores.get(pid)
+                    if cur is None or (d, -weight) < cur:
+                        scores[pid] = (d, -weight)
+                if len(scores) >= cap:
+                    break
+            for _, similar in matches[1:]:
+                filtered = {}
+                for pid, (dist, weight) in scores.items():
+                    best = None
+                    for w in self._words_by_id[pid]:
+                        d = similar.get(w)
+                        if d is not None and (best is None or d < best):
+                            best = d
+                    if best is not None:
+                        filtered[pid] = (dist + best, weight)
+                scores = filtered
+                if not scores:
+                    return []
+            ranked = sorted((d, w, self._sort_keys[pid], pid) for pid, (d, w) in scores.items())
+            return [(dict(self._products[pid]), d) for d, _, _, pid in ranked[:limit]]
+
+    def stats(self):
+        return {
+            'documents': len(self._products),
+            'words': len(self._postings),
+            'trigrams': len(self._trigrams),
+            'budget_exhausted': self.budget_exhausted,
+            'built_at': self.built_at,
+        }
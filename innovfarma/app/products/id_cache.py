@@ -0,0 +1,111 @@
+"""Caché de resolución de identificadores de producto.
+
+Los productos llegan identificados de varias formas: `_id` (ObjectId en hex),
+el `id` legado de documentos antiguos o el `sql_id` que dejó la migración
+desde SQL. `mongo_models.find_product_docs` los resuelve al `_id` canónico y
+guarda aquí el resultado: un LRU acotado para los que existen y una caché
+negativa con caducidad para los que no (ids inválidos que se reintentan).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ENTRIES = 50000
+MAX_MISSING = 10000
+# segundos que se recuerda que un id no existe; antes la limpian las altas de este worker y
+# las de otros que aplica `sync_product_indexes`, y las escrituras no la consultan
+MISSING_TTL = 10
+
+MISSING = object()
+
+
+def cache_key(product_id):
+    return str(product_id)
+
+
+class ProductIdCache:
+    """Identificador entrante -> `_id` canónico (LRU) y caché negativa con TTL."""
+
+    def __init__(self, maxsize=MAX_ENTRIES, missing_maxsize=MAX_MISSING, missing_ttl=MISSING_TTL):
+        self.maxsize = maxsize
+        self.missing_maxsize = missing_maxsize
+        self.missing_ttl = missing_ttl
+        self._ids = OrderedDict()
+        self._missing = OrderedDict()
+        self._keys_by_oid = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.missing_hits = 0
+        self.evictions = 0
+
+    def get(self, product_id):
+        """`_id` cacheado, `MISSING` si se sabe que no existe, o None si no se sabe."""
+        key = cache_key(product_id)
+        with self._lock:
+            oid = self._ids.get(key)
+            if oid is not None:
+                self._ids.move_to_end(key)
+                self.hits += 1
+                return oid
+            expires = self._missing.get(key)
+            if expires is not None:
+                if expires > time.monotonic():
+                    self.missing_hits += 1
+                    return MISSING
+                del self._missing[key]
+            self.misses += 1
+            return None
+
+    def put(self, product_id, oid):
+        key = cache_key(product_id)
+        with self._lock:
+            self._missing.pop(key, None)
+            self._ids[key] = oid
+            self._ids.move_to_end(key)
+            self._keys_by_oid.setdefault(oid, set()).add(key)
+            while len(self._ids) > self.maxsize:
+                old_key, old_oid = self._ids.popitem(last=False)
+                keys = self._keys_by_oid.get(old_oid)
+                if keys is not None:
+                    keys.discard(old_key)
+                    if not keys:
+                        del self._keys_by_oid[old_oid]
+                self.evictions += 1
+
+    def put_missing(self, product_id):
+        key = cache_key(product_id)
+        with self._lock:
+            self._missing[key] = time.monotonic() + self.missing_ttl
+            self._missing.move_to_end(key)
+            while len(self._missing) > self.missing_maxsize:
+                self._missing.popitem(last=False)
+
+    def invalidate(self, oid):
+        """Olvidar todos los identificadores que apuntaban a `oid` (producto eliminado)."""
+        with self._lock:
+            for key in self._keys_by_oid.pop(oid, ()):
+                self._ids.pop(key, None)
+
+    def forget_missing(self):
+        """Vaciar la caché negativa (tras dar de alta productos)."""
+        with self._lock:
+            self._missing.clear()
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._missing.clear()
+            self._keys_by_oid.clear()
+
+    def stats(self):
+        total = self.hits + self.missing_hits + self.misses
+        return {
+            'entries': len(self._ids),
+            'missing': len(self._missing),
+            'hits': self.hits,
+            'missing_hits': self.missing_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': ((self.hits + self.missing_hits) / total) if total else 0.0,
+        }
@@ -0,0 +1,128 @@
+"""Cálculo de precios para el reprecio masivo (`POST /api/productos/reprecio`).
+
+Una regla aplica un porcentaje de cambio al costo (`Precio_compra`) de los
+productos que cumplen sus filtros y recalcula `Precio_venta` y
+`Margen_utilidad`. El margen es el recargo sobre el costo:
+`Precio_venta = Precio_compra * (1 + Margen_utilidad / 100)`.
+
+- Con `margen_objetivo`, todos los productos quedan con ese margen.
+- Sin él, el precio de venta sube en la misma proporción que el costo y cada
+  producto conserva su margen.
+
+El cálculo se hace en bloque con NumPy cuando está instalado (si no, con
+listas de Python y el mismo resultado).
+"""
+import math
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+FILTER_FIELDS = ('id_laboratorio', 'id_marca', 'id_subcategoria')
+ROUNDING_MODES = ('cercano', 'arriba', 'abajo')
+
+
+def parse_rule(data):
+    """Valida la regla recibida en el JSON. Devuelve (regla, None) o (None, error)."""
+    filtros = {f: data.get(f) for f in FILTER_FIELDS if data.get(f) not in (None, '')}
+    if not filtros:
+        return None, f'se requiere al menos un filtro: {", ".join(FILTER_FIELDS)}'
+    try:
+        porcentaje = float(data.get('porcentaje') or 0)
+        margen = data.get('margen_objetivo')
+        margen = None if margen in (None, '') else float(margen)
+        paso = float(data.get('redondeo') or 0.01)
+    except (TypeError, ValueError):
+        return None, 'porcentaje, margen_objetivo y redondeo deben ser numéricos'
+    if porcentaje <= -100:
+        return None, 'porcentaje debe ser mayor que -100'
+    if paso <= 0:
+        return None, 'redondeo debe ser mayor que 0'
+    modo = data.get('redondeo_modo') or 'cercano'
+    if modo not in ROUNDING_MODES:
+        return None, f'redondeo_modo inválido ({", ".join(ROUNDING_MODES)})'
+    return {
+        'filtros': filtros,
+        'porcentaje': porcentaje,
+        'margen_objetivo': margen,
+        'redondeo': paso,
+        'redondeo_modo': modo,
+    }, None
+
+
+def _num(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _cents(v):
+    """Redondeo a centavos con mitades hacia arriba (50.325 -> 50.33).
+
+    `round(v, 2)` y `np.round(v, 2)` no coinciden en las mitades (uno mira el
+    valor binario exacto, el otro multiplica por 100), así que ambas ramas
+    redondean así: primero se quita el ruido de coma flotante y luego se sube
+    la mitad.
+    """
+    return math.floor(round(v * 100, 6) + 0.5) / 100
+
+
+def _cents_np(a):
+    return np.floor(np.round(a * 100, 6) + 0.5) / 100
+
+
+def _round_list(values, paso, modo):
+    fn = {'cercano': round, 'arriba': math.ceil, 'abajo': math.floor}[modo]
+    # round(.., 9): que 10.0 / 0.1 = 100.00000000000001 no suba a 101 al redondear hacia arriba
+    return [_cents(fn(round(v / paso, 9)) * paso) for v in values]
+
+
+def compute(productos, regla):
+    """Nuevos (Precio_compra, Precio_venta, Margen_utilidad) para cada producto, en orden."""
+    if not productos:
+        return []
+    factor = 1 + regla['porcentaje'] / 100.0
+    margen = regla['margen_objetivo']
+    paso = regla['redondeo']
+    modo = regla['redondeo_modo']
+    compra = [_num(p.get('Precio_compra')) for p in productos]
+    venta = [_num(p.get('Precio_venta')) for p in productos]
+
+    if np is not None:
+        compra_a = _cents_np(np.asarray(compra, dtype=float) * factor)
+        if margen is not None:
+            venta_a = compra_a * (1 + margen / 100.0)
+        else:
+            venta_a = np.asarray(venta, dtype=float) * factor
+        rounder = {'cercano': np.rint, 'arriba': np.ceil, 'abajo': np.floor}[modo]
+        venta_a = _cents_np(rounder(np.round(venta_a / paso, 9)) * paso)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margen_a = np.where(compra_a > 0, (venta_a / compra_a - 1) * 100, 0.0)
+        margen_a = _cents_np(margen_a)
+        return list(zip(compra_a.tolist(), venta_a.tolist(), margen_a.tolist()))
+
+    compra_n = [_cents(c * factor) for c in compra]
+    if margen is not None:
+        venta_n = [c * (1 + margen / 100.0) for c in compra_n]
+    else:
+        venta_n = [v * factor for v in venta]
+    venta_n = _round_list(venta_n, paso, modo)
+    margen_n = [_cents((v / c - 1) * 100) if c > 0 else 0.0 for c, v in zip(compra_n, venta_n)]
+    return list(zip(compra_n, venta_n, margen_n))
+
+
+def preview(productos, nuevos, limit=50):
+    """Muestra de cambios (antes/después) para el modo de prueba."""
+    out = []
+    for p, (compra, venta, margen) in zip(productos[:limit], nuevos[:limit]):
+        out.append({
+            'id': str(p.get('_id') or p.get('id')),
+            'codigo': p.get('codigo'),
+            'Nombre_comercial': p.get('Nombre_comercial'),
+            'Precio_compra': {'antes': p.get('Precio_compra'), 'despues': compra},
+            'Precio_venta': {'antes': p.get('Precio_venta'), 'despues': venta},
+            'Margen_utilidad': {'antes': p.get('Margen_utilidad'), 'despues': margen},
+        })
+    return out
@@ -0,0 +1,206 @@
+"""Caché de resultados de búsqueda de productos (LRU acotado con TTL).
+
+Se pone delante de `filter_products` y `filter_advanced` (ver
+`products/routes.py`) con clave (tipo de consulta, consulta normalizada,
+límite, backend). Las escrituras la invalidan desde los helpers, solo en lo
+que pueden haber cambiado:
+
+- las entradas que contienen el producto escrito (`invalidate_product`):
+  basta para cambios de stock o precio y para los borrados;
+- si el producto es nuevo o su texto buscable cambió, las búsquedas en las
+  que ahora puede aparecer (`invalidate_matching`);
+- si cambian los valores de faceta de un producto (o aparece o desaparece
+  uno), las consultas del filtro avanzado, cuyos conteos dependen de todo el
+  catálogo (`invalidate_kind`).
+
+Cada invalidación avanza una generación: `get_or_compute` no guarda un
+resultado si hubo alguna mientras se calculaba, porque pudo leer datos de
+antes de la escritura. Cada worker tiene su propia copia y la invalidan
+también los cambios de otros workers que aplica `sync_product_indexes`; el
+TTL acota lo que tarda en verse una escritura en el backend SQL.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 1000
+DEFAULT_TTL = 30
+
+# tipos de consulta (primer elemento de la clave, ver products/routes.py): búsqueda por
+# término y filtro avanzado, cuyos conteos y páginas dependen de las facetas de todo el catálogo
+SEARCH_QUERY = 'filtrar'
+FACET_QUERIES = ('filtro-avanzado', 'filtro-avanzado-facets')
+
+
+def _productos(value):
+    """Productos de un resultado: la lista misma o `value['productos']` (filtro con facetas)."""
+    if isinstance(value, dict):
+        return value.get('productos') or []
+    return value or []
+
+
+def _copy(value):
+    """Copia que el llamador puede modificar sin tocar la entrada cacheada."""
+    if isinstance(value, dict):
+        out = {k: (dict(v) if isinstance(v, dict) else v) for k, v in value.items()}
+        out['productos'] = [dict(p) for p in _productos(value)]
+        return out
+    return [dict(p) for p in value]
+
+
+def _sizeof(obj):
+    """Tamaño aproximado en bytes (recorre dicts y listas; no cuenta objetos compartidos dos veces)."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+    return total
+
+
+class ResultCache:
+    """Clave -> (expira, resultado, tamaño); más id de producto -> {claves} para invalidar."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys_by_pid = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    def configure(self, maxsize=None, ttl=None):
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = int(maxsize)
+            if ttl is not None:
+                self.ttl = float(ttl)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[2]
+        for p in _productos(entry[1]):
+            keys = self._keys_by_pid.get(p.get('id'))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_pid[p.get('id')]
+
+    def get(self, key):
+        """Copia del resultado cacheado, o None si no hay entrada vigente."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return _copy(entry[1])
+
+    def put(self, key, value, generation=None):
+        """Guardar `value`; si se pasa `generation`, solo si desde entonces no hubo invalidaciones."""
+        if self.maxsize <= 0 or self.ttl <= 0 or value is None:
+            return
+        value = _copy(value)
+        size = _sizeof(value)
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                self.stale_puts += 1
+                return
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+            for p in _productos(value):
+                self._keys_by_pid.setdefault(p.get('id'), set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        try:
+            hash(key)
+        except TypeError:
+            # parámetros no hashables (p. ej. listas en el JSON): sin caché
+            return compute()
+        generation = self._generation
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value, generation)
+        return value
+
+    def invalidate_product(self, product_id):
+        """Descartar las entradas que contienen el producto `product_id`."""
+        with self._lock:
+            self._generation += 1
+            for key in list(self._keys_by_pid.get(product_id, ())):
+                self._drop(key)
+                self.invalidations += 1
+
+    def invalidate_matching(self, kind, predicate):
+        """Descartar las entradas de tipo `kind` cuya clave cumple `predicate(clave)`."""
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._entries if isinstance(k, tuple) and k and k[0] == kind]:
+                if predicate(key):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def invalidate_kind(self, *kinds):
+        """Descartar las entradas de esos tipos de consulta (primer elemento de la clave)."""
+        with self._lock:
+            self._generation += 1
+            for key in [k for k in self._entries if isinstance(k, tuple) and k and k[0] in kinds]:
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys_by_pid.clear()
+            self._bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits / total) if total else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'stale_puts': self.stale_puts,
+            'memory_bytes': self._bytes,
+        }
+
+
+# instancia compartida por los helpers de Mongo y SQL de este worker
+result_cache = ResultCache()
@@ -1,4 +1,5 @@
 from flask import Blueprint, request, jsonify, current_app
+from datetime import datetime
 from flask_login import login_required
 
 # Import both helper modules (one will be selected at request time based on app config).
@@ -9,6 +10,12 @@ except Exception:
     mongo_helpers = None
 
 from . import sql_helpers as sql_helpers
+from . import bulk, repricing
+from .result_cache import result_cache
+from ..pagination import decode_cursor, next_cursor
+from ..projection import parse_fields
+from ..etag import conditional_get
+from .. import batch
 
 products_bp = Blueprint('products', __name__)
 
@@ -24,21 +31,43 @@ def _helpers():
     return sql_helpers
 
 
+def _backend(h):
+    return 'mongo' if h is mongo_helpers else 'sql'
+
+
+def _normalize_term(term):
+    """Clave de caché del término: sin mayúsculas ni espacios sobrantes (ambos backends ignoran mayúsculas)."""
+    return ' '.join(str(term or '').lower().split())
+
+
 # ========== READ (GET) ==========
 
 @products_bp.route('/productos', methods=['GET'])
+@conditional_get('productos')
 def productos_index():
-    """Listar todos los productos con paginación"""
+    """Listar todos los productos con paginación
+
+    Paginación por `cursor` (valor de `next_cursor` de la página anterior);
+    `skip` se mantiene por compatibilidad. `fields` (separados por comas)
+    limita los campos devueltos, p. ej. `fields=Nombre_comercial,Precio_venta`.
+    """
     limit = request.args.get('limit', 100, type=int)
     skip = request.args.get('skip', 0, type=int)
-    
+    cursor = request.args.get('cursor')
+    fields = parse_fields(request.args.get('fields'))
+    try:
+        after_id = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     h = _helpers()
-    productos = h.list_products(limit=limit)
-    return jsonify({'productos': productos, 'total': len(productos)})
+    productos = h.list_products(limit=limit, skip=skip, after_id=after_id, fields=fields)
+    return jsonify({'productos': productos, 'total': len(productos), 'next_cursor': next_cursor(productos, limit)})
 
 
 @products_bp.route('/productos/<int:product_id>', methods=['GET'])
 @products_bp.route('/productos/<product_id>', methods=['GET'])
+@conditional_get('productos')
 def get_product_detail(product_id):
     """Obtener un producto por ID
 
@@ -58,6 +87,21 @@ def get_product_detail(product_id):
     return jsonify(producto)
 
 
+@products_bp.route('/productos/batch', methods=['POST'])
+def get_products_batch():
+    """Varios productos por id en una sola petición (carrito, pedido guardado)
+
+    Body: {"ids": [...]} (máx. 500; ObjectId, id legado o sql_id mezclados).
+    Devuelve `productos` en el orden pedido (null si no existe) y `no_encontrados`.
+    """
+    ids, error = batch.parse_ids(request.get_json() or {})
+    if error:
+        return jsonify({'error': error}), 400
+    h = _helpers()
+    productos, missing = batch.in_request_order(ids, h.get_products_batch(ids))
+    return jsonify({'productos': productos, 'no_encontrados': missing, 'total': len(ids) - len(missing)})
+
+
 @products_bp.route('/productos/detalle-completo/<int:product_id>', methods=['GET'])
 @products_bp.route('/productos/detalle-completo/<product_id>', methods=['GET'])
 def get_full_details(product_id):
@@ -73,6 +117,26 @@ def get_full_details(product_id):
     return jsonify(producto)
 
 
+@products_bp.route('/productos/<int:product_id>/sustitutos', methods=['GET'])
+@products_bp.route('/productos/<product_id>/sustitutos', methods=['GET'])
+def get_product_substitutes(product_id):
+    """Sustitutos genéricos de un producto (mismo principio activo, concentración y presentación)
+
+    Query params opcionales: `limit` (máx. 200) y `todos=1` para incluir los que no tienen stock.
+    """
+    try:
+        pid = int(product_id) if (isinstance(product_id, str) and product_id.isdigit()) else product_id
+    except Exception:
+        pid = product_id
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    solo_con_stock = request.args.get('todos', '0').lower() not in ('1', 'true', 'si')
+    h = _helpers()
+    sustitutos = h.get_substitutes(pid, limit=limit, solo_con_stock=solo_con_stock)
+    if sustitutos is None:
+        return jsonify({'error': 'Producto no encontrado'}), 404
+    return jsonify({'sustitutos': sustitutos, 'total': len(sustitutos)})
+
+
 @products_bp.route('/productos/codigo-barras/<codigo_barras>', methods=['GET'])
 def search_by_exact_barcode(codigo_barras):
     """Buscar un producto exacto por código de barras"""
@@ -83,24 +147,98 @@ def search_by_exact_barcode(codigo_barras):
     return jsonify(producto)
 
 
+@products_bp.route('/productos/cambios', methods=['GET'])
+def productos_cambios():
+    """Sincronización incremental del catálogo
+
+    `cursor`: el devuelto por la llamada anterior (sin él, desde el principio).
+    Devuelve los productos cambiados, los ids eliminados y el nuevo `cursor`.
+    `since` (última `rev`) se sigue aceptando de los terminales anteriores.
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 5000)
+    cursor = request.args.get('cursor')
+    try:
+        cursor = decode_cursor(cursor) if cursor else None
+        if cursor is not None:
+            ts, rev = cursor
+            datetime.fromisoformat(ts)
+            if not isinstance(rev, int):
+                raise ValueError(rev)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'cursor inválido'}), 400
+    h = _helpers()
+    if not hasattr(h, 'get_product_changes'):
+        return jsonify({'error': 'Sincronización incremental no disponible con este backend'}), 501
+    return jsonify(h.get_product_changes(since=since, limit=limit, cursor=cursor))
+
+
+@products_bp.route('/productos/indices', methods=['GET'])
+def productos_indices():
+    """Estadísticas de los índices en memoria de productos (hits/misses por worker)"""
+    h = _helpers()
+    if not hasattr(h, 'product_index_stats'):
+        return jsonify({})
+    return jsonify(h.product_index_stats())
+
+
+@products_bp.route('/productos/cache-busqueda', methods=['GET'])
+def productos_cache_busqueda():
+    """Estadísticas de la caché de resultados de búsqueda de este worker
+
+    Aciertos, `hit_ratio`, expulsiones por tamaño, caducadas por TTL,
+    invalidaciones y memoria aproximada (`memory_bytes`).
+    """
+    return jsonify(result_cache.stats())
+
+
 @products_bp.route('/productos/sugerencias-codigo/<codigo>', methods=['GET'])
 def sugerencias_por_codigo(codigo):
-    """Obtener sugerencias de productos por código de barras (parcial)"""
+    """Obtener sugerencias de productos por código de barras (parcial)
+
+    Query params opcionales: `limit` (máx. 50) y `modo` ('prefijo', 'sufijo' o 'contiene').
+    """
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    modo = request.args.get('modo', 'prefijo')
+    if modo not in ('prefijo', 'sufijo', 'contiene'):
+        return jsonify({'error': 'modo inválido (prefijo, sufijo o contiene)'}), 400
     h = _helpers()
-    productos = h.search_suggestions_by_barcode(codigo)
+    productos = h.search_suggestions_by_barcode(codigo, limit=limit, modo=modo)
     return jsonify(productos)
 
 
 @products_bp.route('/productos/filtrar', methods=['POST'])
 def productos_filtrar():
-    """Filtrar productos por término de búsqueda en múltiples campos"""
+    """Filtrar productos por término de búsqueda en múltiples campos
+
+    `fuzzy` opcional: true busca tolerando errores de tipeo en los nombres
+    (hasta `max_distance` por palabra); 'auto' solo lo hace si la búsqueda
+    normal no devuelve nada.
+    """
     import traceback
     data = request.get_json() or {}
     term = data.get('term') or data.get('q') or data.get('buscar', '')
     limit = data.get('limit', 200)
+    fuzzy = str(data.get('fuzzy', '')).lower()
+    max_distance = data.get('max_distance')
+    if max_distance is not None:
+        # entero >= 0 (número JSON o string de dígitos)
+        if isinstance(max_distance, str) and max_distance.strip().isdigit():
+            max_distance = int(max_distance)
+        if isinstance(max_distance, bool) or not isinstance(max_distance, int) or max_distance < 0:
+            return jsonify({'error': 'max_distance debe ser un entero >= 0'}), 400
     try:
         h = _helpers()
-        productos = h.filter_products(term, limit=limit)
+        usar_fuzzy = fuzzy in ('1', 'true', 'si') and hasattr(h, 'fuzzy_filter_products')
+        budget_ms = current_app.config.get('FUZZY_SEARCH_BUDGET_MS', 15)
+        if usar_fuzzy:
+            productos = h.fuzzy_filter_products(term, limit=limit, max_distance=max_distance, budget_ms=budget_ms)
+        else:
+            key = ('filtrar', _normalize_term(term), limit, _backend(h))
+            productos = result_cache.get_or_compute(key, lambda: h.filter_products(term, limit=limit))
+            if not productos and fuzzy == 'auto' and hasattr(h, 'fuzzy_filter_products'):
+                productos = h.fuzzy_filter_products(term, limit=limit, max_distance=max_distance, budget_ms=budget_ms)
+                usar_fuzzy = True
         # Debug: log count and sample keys to help diagnose frontend issues
         try:
             print(f"[DEBUG /api/productos/filtrar] found {len(productos)} productos")
@@ -112,7 +250,7 @@ def productos_filtrar():
                     print("[DEBUG sample producto type]", type(sample))
         except Exception:
             pass
-        return jsonify({'productos': productos, 'total': len(productos)})
+        return jsonify({'productos': productos, 'total': len(productos), 'fuzzy': usar_fuzzy})
     except Exception as e:
         tb = traceback.format_exc()
         print(f"[ERROR /api/productos/filtrar] {e}\n{tb}")
@@ -122,7 +260,12 @@ def productos_filtrar():
 
 @products_bp.route('/productos/filtro-avanzado', methods=['POST'])
 def filtro_avanzado():
-    """Filtrado avanzado por marca, categoría, forma, laboratorio"""
+    """Filtrado avanzado por marca, categoría, forma, laboratorio
+
+    Por defecto incluye `facets` (conteos por id_marca, id_laboratorio,
+    id_subcategoria e id_forma_farmaceutica) y `total_filtrados`; enviar
+    `facets: false` para obtener solo la página de productos.
+    """
     data = request.get_json() or {}
     marca_id = data.get('marca_id')
     categoria_id = data.get('categoria_id')
@@ -133,7 +276,22 @@ def filtro_avanzado():
     skip = data.get('skip', 0)
     
     h = _helpers()
-    productos = h.filter_advanced(
+    filtros = (marca_id, categoria_id, subcategoria_id, forma_id, laboratorio_id)
+    if data.get('facets', True) and hasattr(h, 'filter_advanced_facets'):
+        key = ('filtro-avanzado-facets', filtros, limit, skip, _backend(h))
+        res = result_cache.get_or_compute(key, lambda: h.filter_advanced_facets(
+            marca_id=marca_id,
+            categoria_id=categoria_id,
+            subcategoria_id=subcategoria_id,
+            forma_id=forma_id,
+            laboratorio_id=laboratorio_id,
+            limit=limit,
+            skip=skip
+        ))
+        res['total'] = len(res['productos'])
+        return jsonify(res)
+    key = ('filtro-avanzado', filtros, limit, skip, _backend(h))
+    productos = result_cache.get_or_compute(key, lambda: h.filter_advanced(
         marca_id=marca_id,
         categoria_id=categoria_id,
         subcategoria_id=subcategoria_id,
@@ -141,7 +299,7 @@ def filtro_avanzado():
         laboratorio_id=laboratorio_id,
         limit=limit,
         skip=skip
-    )
+    ))
     return jsonify({'productos': productos, 'total': len(productos)})
 
 
@@ -201,6 +359,60 @@ def create_new_product():
         return jsonify({'success': False, 'message': 'Error al guardar el producto', 'error': str(e)}), 500
 
 
+@products_bp.route('/productos/bulk', methods=['POST'])
+@login_required
+def bulk_upsert():
+    """Carga masiva de productos (alta o actualización por codigo / Cod_barrras)
+
+    Acepta NDJSON (`Content-Type: application/x-ndjson`, un producto por
+    línea, leído en streaming, sin tope de tamaño) o un arreglo JSON, que se
+    carga entero en memoria y por eso se limita a `BULK_JSON_MAX_BYTES`
+    (413 por encima, o sin Content-Length). Devuelve el resultado por fila.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+        rows = bulk.iter_ndjson(request.stream)
+    else:
+        max_bytes = current_app.config.get('BULK_JSON_MAX_BYTES', bulk.JSON_MAX_BYTES)
+        if request.content_length is None or request.content_length > max_bytes:
+            return jsonify({'error': f'Arreglo JSON de más de {max_bytes} bytes (o sin Content-Length): '
+                                     'enviarlo como NDJSON (application/x-ndjson)'}), 413
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            return jsonify({'error': 'Se espera un arreglo JSON o NDJSON'}), 400
+    try:
+        h = _helpers()
+        resultados = h.bulk_upsert_products(rows)
+    except Exception as e:
+        return jsonify({'success': False, 'message': 'Error en la carga masiva', 'error': str(e)}), 500
+    resumen = {'creados': 0, 'actualizados': 0, 'errores': 0}
+    for r in resultados:
+        resumen[{'creado': 'creados', 'actualizado': 'actualizados'}.get(r['estado'], 'errores')] += 1
+    return jsonify({'success': resumen['errores'] == 0, 'total': len(resultados), **resumen, 'resultados': resultados})
+
+
+@products_bp.route('/productos/reprecio', methods=['POST'])
+@login_required
+def reprecio_masivo():
+    """Reprecio masivo por laboratorio / marca / subcategoría
+
+    Body: filtros (id_laboratorio, id_marca, id_subcategoria), `porcentaje`
+    de cambio del costo, `margen_objetivo` opcional, `redondeo` (paso, p. ej.
+    0.1) y `redondeo_modo` (cercano, arriba, abajo). Por defecto es una prueba
+    (`dry_run: true`) que solo devuelve la muestra de cambios.
+    """
+    data = request.get_json() or {}
+    regla, error = repricing.parse_rule(data)
+    if error:
+        return jsonify({'error': error}), 400
+    dry_run = data.get('dry_run', True) not in (False, 'false', '0', 0)
+    try:
+        h = _helpers()
+        res = h.reprice_products(regla, dry_run=dry_run)
+    except Exception as e:
+        return jsonify({'success': False, 'message': 'Error en el reprecio', 'error': str(e)}), 500
+    return jsonify({'success': True, 'dry_run': dry_run, 'regla': regla, **res})
+
+
 # ========== UPDATE (PUT) ==========
 
 @products_bp.route('/productos/<int:product_id>', methods=['PUT'])
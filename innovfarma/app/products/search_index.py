@@ -0,0 +1,332 @@
+"""Motor de búsqueda de productos en memoria (índice invertido con ranking).
+
+Reemplaza los `$regex`/`ilike '%term%'` de `filter_products`. Los campos de
+texto se normalizan (minúsculas, sin tildes) y se parten en tokens; cada
+token apunta a los productos que lo contienen. Un término de búsqueda
+coincide con un token si es igual, prefijo o subcadena de él (también en
+códigos y códigos de barras: '234' encuentra '7791234567890'), así que el
+resultado cubre lo que devolvía la búsqueda por subcadena y además sale
+ordenado por relevancia.
+
+Como los demás índices de `app/products`, hay una copia por worker que se
+mantiene al día desde los helpers de escritura de `mongo_models`.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+
+# campo -> peso en el ranking
+SEARCH_FIELDS = {
+    'Nombre_comercial': 3.0,
+    'Nombre_generico': 2.5,
+    'Principio_activo': 2.0,
+    'codigo': 2.0,
+    'Cod_barrras': 1.5,
+    'Accion_terapeutica': 1.0,
+}
+
+# calidad de la coincidencia término -> token
+MATCH_EXACT = 1.0
+MATCH_PREFIX = 0.7
+MATCH_INFIX = 0.4
+
+# tope de tokens del vocabulario en que se expande cada término
+MAX_EXPANSIONS = 1000
+# mínimo de candidatos que se puntúan uno a uno antes de recortar (términos muy genéricos)
+MIN_SCORED = 400
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_PART_RE = re.compile(r'[a-z]+|[0-9]+')
+
+
+def normalize(text):
+    """Minúsculas y sin tildes/diacríticos ('Ácido' -> 'acido')."""
+    if text is None:
+        return ''
+    text = str(text)
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def index_tokens(text):
+    """Tokens a indexar: cada palabra y, si mezcla letras y dígitos, también sus
+    partes ('500mg' -> ['500mg', '500', 'mg']) para poder buscar por cualquiera."""
+    out = []
+    for tok in tokenize(text):
+        out.append(tok)
+        if not (tok.isalpha() or tok.isdigit()):
+            out.extend(_PART_RE.findall(tok))
+    return out
+
+
+def could_match(term, tokens):
+    """Si un producto con estos tokens puede salir al buscar `term` (cada
+    término tiene que ser subcadena de alguno; ver `_expand`)."""
+    return all(any(qt in tok for tok in tokens) for qt in tokenize(term))
+
+
+def trigrams(token):
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+class ProductSearchIndex:
+    """Índice invertido token -> {id producto: peso del mejor campo}."""
+
+    def __init__(self, fields=None):
+        self.fields = dict(fields or SEARCH_FIELDS)
+        self._postings = {}     # token -> {pid: peso}
+        self._vocab = []        # tokens ordenados (expansión por prefijo)
+        self._trigrams = {}     # trigrama -> {tokens} (expansión por subcadena)
+        self._products = {}     # pid -> producto serializado
+        self._tokens_by_id = {}  # pid -> {tokens}
+        self._sort_keys = {}    # pid -> nombre normalizado (desempate)
+        self._lock = threading.Lock()
+        self.built_at = None
+
+    @property
+    def built(self):
+        return self.built_at is not None
+
+    def __len__(self):
+        return len(self._products)
+
+    # --- mantenimiento ---
+
+    def _doc_tokens(self, producto):
+        weights = {}
+        for field, weight in self.fields.items():
+            for tok in index_tokens(producto.get(field)):
+                if weight > weights.get(tok, 0.0):
+                    weights[tok] = weight
+        return weights
+
+    def _add_token(self, tok, sort_vocab=True):
+        self._postings[tok] = {}
+        if sort_vocab:
+            bisect.insort(self._vocab, tok)
+        for tri in trigrams(tok):
+            self._trigrams.setdefault(tri, set()).add(tok)
+
+    def _drop_token(self, tok, sort_vocab=True):
+        del self._postings[tok]
+        if sort_vocab:
+            i = bisect.bisect_left(self._vocab, tok)
+            if i < len(self._vocab) and self._vocab[i] == tok:
+                del self._vocab[i]
+        for tri in trigrams(tok):
+            toks = self._trigrams.get(tri)
+            if toks is not None:
+                toks.discard(tok)
+                if not toks:
+                    del self._trigrams[tri]
+
+    def _discard(self, pid, sort_vocab=True):
+        self._products.pop(pid, None)
+        self._sort_keys.pop(pid, None)
+        for tok in self._tokens_by_id.pop(pid, ()):
+            posting = self._postings.get(tok)
+            if posting is None:
+                continue
+            posting.pop(pid, None)
+            if not posting:
+                self._drop_token(tok, sort_vocab)
+
+    def _raised(self, pid, weights):
+        """Tokens de `weights` que `pid` no tenía o tenía con menos peso (puede
+        subir en búsquedas en las que no estaba)."""
+        return {tok for tok, w in weights.items() if self._postings.get(tok, {}).get(pid, 0.0) < w}
+
+    def _insert(self, producto, sort_vocab=True):
+        pid = producto.get('id')
+        weights = self._doc_tokens(producto)
+        for tok, weight in weights.items():
+            if tok not in self._postings:
+                self._add_token(tok, sort_vocab)
+            self._postings[tok][pid] = weight
+        self._products[pid] = producto
+        self._tokens_by_id[pid] = set(weights)
+        self._sort_keys[pid] = normalize(producto.get('Nombre_comercial'))
+
+    def build(self, productos):
+        with self._lock:
+            self._postings = {}
+            self._vocab = []
+            self._trigrams = {}
+            self._products = {}
+            self._tokens_by_id = {}
+            self._sort_keys = {}
+            # construir sin insort: ordenar el vocabulario una sola vez al final
+            for p in productos:
+                pid = p.get('id')
+                weights = self._doc_tokens(p)
+                for tok, weight in weights.items():
+                    posting = self._postings.get(tok)
+                    if posting is None:
+                        posting = self._postings[tok] = {}
+                        for tri in trigrams(tok):
+                            self._trigrams.setdefault(tri, set()).add(tok)
+                    posting[pid] = weight
+                self._products[pid] = p
+                self._tokens_by_id[pid] = set(weights)
+                self._sort_keys[pid] = normalize(p.get('Nombre_comercial'))
+            self._vocab = sorted(self._postings)
+            self.built_at = time.time()
+
+    def upsert(self, producto):
+        """Indexar `producto`; devuelve los tokens nuevos o con más peso (ver `could_match`)."""
+        if not producto:
+            return set()
+        pid = producto.get('id')
+        with self._lock:
+            raised = self._raised(pid, self._doc_tokens(producto))
+            self._discard(pid)
+            self._insert(producto)
+        return raised
+
+    def upsert_many(self, productos):
+        """Como `upsert` para muchos productos: el vocabulario se reordena una sola vez.
+
+        Devuelve la unión de los tokens nuevos o con más peso de todos ellos.
+        """
+        raised = set()
+        with self._lock:
+            for p in productos:
+                if p:
+                    raised |= self._raised(p.get('id'), self._doc_tokens(p))
+                    self._discard(p.get('id'), sort_vocab=False)
+                    self._insert(p, sort_vocab=False)
+            self._vocab = sorted(self._postings)
+        return raised
+
+    def remove(self, product_id):
+        with self._lock:
+            self._discard(str(product_id))
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._vocab = []
+            self._trigrams = {}
+            self._products = {}
+            self._tokens_by_id = {}
+            self._sort_keys = {}
+            self.built_at = None
+
+    # --- consulta ---
+
+    def _expand(self, qt):
+        """Tokens del vocabulario que contienen `qt`, con la calidad de la coincidencia.
+
+        Igualdad y prefijo salen del vocabulario ordenado; la subcadena, del
+        índice de trigramas (términos de 3+ caracteres) o, para términos más
+        cortos, recorriendo el vocabulario.
+        """
+        out = []
+        vocab = self._vocab
+        i = bisect.bisect_left(vocab, qt)
+        while i < len(vocab) and len(out) < MAX_EXPANSIONS and vocab[i].startswith(qt):
+            tok = vocab[i]
+            out.append((tok, MATCH_EXACT if tok == qt else MATCH_PREFIX))
+            i += 1
+        tris = trigrams(qt)
+        if not tris:
+            for tok in vocab:
+                if len(out) >= MAX_EXPANSIONS:
+                    break
+                if qt in tok and not tok.startswith(qt):
+                    out.append((tok, MATCH_INFIX))
+            return out
+        sets = []
+        for tri in tris:
+            toks = self._trigrams.get(tri)
+            if not toks:
+                return out
+            sets.append(toks)
+        for tok in min(sets, key=len):
+            if len(out) >= MAX_EXPANSIONS:
+                break
+            if qt in tok and not tok.startswith(qt):
+                out.append((tok, MATCH_INFIX))
+        return out
+
+    def _preselect(self, exp, cap, candidates=None):
+        """Quedarse con hasta `cap` candidatos, empezando por las mejores coincidencias de `exp`."""
+        picked = set()
+        for tok, _ in sorted(exp, key=lambda e: (-e[1], len(e[0]))):
+            posting = self._postings[tok]
+            for pid in (posting if candidates is None else candidates.intersection(posting)):
+                picked.add(pid)
+                if len(picked) >= cap:
+                    return picked
+        return picked
+
+    def _search_ids(self, term, limit):
+        qtokens = list(dict.fromkeys(tokenize(term)))
+        if not qtokens or limit <= 0:
+            return []
+        postings = self._postings
+        terms = []
+        for qt in qtokens:
+            exp = self._expand(qt)
+            if not exp:
+                return []
+            terms.append((sum(len(postings[tok]) for tok, _ in exp), exp))
+        # del término más selectivo al más genérico
+        terms.sort(key=lambda t: t[0])
+        expansions = [exp for _, exp in terms]
+        # términos muy genéricos: se puntúan solo los `cap` mejores candidatos
+        cap = max(2 * limit, MIN_SCORED)
+
+        # candidatos: productos que casan con todos los términos
+        if len(terms) == 1 and terms[0][0] > cap:
+            candidates = self._preselect(expansions[0], cap)
+        else:
+            candidates = set().union(*(postings[tok] for tok, _ in expansions[0]))
+            for exp in expansions[1:]:
+                candidates &= set().union(*(postings[tok] for tok, _ in exp))
+                if not candidates:
+                    return []
+            if len(candidates) > cap:
+                candidates = self._preselect(expansions[0], cap, candidates)
+
+        # puntuación: por término, la mejor coincidencia (calidad x peso del campo)
+        scores = dict.fromkeys(candidates, 0.0)
+        for exp in expansions:
+            best = {}
+            for tok, quality in exp:
+                posting = postings[tok]
+                for pid in candidates.intersection(posting):
+                    s = quality * posting[pid]
+                    if s > best.get(pid, 0.0):
+                        best[pid] = s
+            for pid, s in best.items():
+                scores[pid] += s
+        sort_keys = self._sort_keys
+        ranked = sorted((-s, sort_keys[pid], pid) for pid, s in scores.items())
+        return [pid for _, _, pid in ranked[:limit]]
+
+    def search_ids(self, term, limit=200):
+        """Ids de los productos que contienen todos los tokens de `term`, por relevancia."""
+        with self._lock:
+            return self._search_ids(term, limit)
+
+    def search(self, term, limit=200):
+        """Como `search_ids` pero devuelve copias de los productos serializados."""
+        with self._lock:
+            return [dict(self._products[pid]) for pid in self._search_ids(term, limit)]
+
+    def stats(self):
+        return {
+            'documents': len(self._products),
+            'tokens': len(self._postings),
+            'trigrams': len(self._trigrams),
+            'built_at': self.built_at,
+        }
@@ -0,0 +1,113 @@
+"""Búsqueda de texto completo (SQLite FTS5) para el backend SQL de productos.
+
+`productos_fts` es una tabla virtual FTS5 de contenido externo sobre
+`productos`: guarda solo el índice de las columnas buscables y la mantienen
+al día triggers de INSERT/UPDATE/DELETE, así que cualquier escritura (ORM,
+`bulk_update_mappings`, scripts) queda indexada sin tocar los helpers.
+
+Se crea la primera vez que se busca (y se llena con 'rebuild'). Si la base
+no es SQLite o el SQLite no trae FTS5, `search_ids` devuelve None y
+`filter_products` sigue con `ilike`. Otros fallos (p. ej. la tabla
+`productos` aún no creada) solo afectan a esa búsqueda: se reintenta en la
+siguiente.
+"""
+import re
+import threading
+
+from sqlalchemy import text
+
+FTS_TABLE = 'productos_fts'
+FTS_COLUMNS = (
+    'Nombre_comercial', 'codigo', 'Nombre_generico', 'Cod_barrras', 'Accion_terapeutica',
+    'Principio_activo', 'Concentracion', 'Presentacion', 'Cod_nandina',
+)
+# pesos de bm25 por columna, en el orden de FTS_COLUMNS
+FTS_WEIGHTS = (10.0, 8.0, 6.0, 8.0, 1.0, 4.0, 1.0, 1.0, 1.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_lock = threading.Lock()
+_ready = None  # None: sin comprobar; True/False: FTS5 disponible o no
+
+
+def _ddl():
+    cols = ', '.join(FTS_COLUMNS)
+    new = ', '.join(f'new.{c}' for c in FTS_COLUMNS)
+    old = ', '.join(f'old.{c}' for c in FTS_COLUMNS)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"{cols}, content='productos', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON productos BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON productos BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON productos BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {FTS_TABLE}(rowid, {cols}) VALUES (new.id, {new}); END",
+    ]
+
+
+def ensure_fts(engine):
+    """Crear la tabla FTS5 y sus triggers si faltan. Devuelve True si se puede usar."""
+    global _ready
+    if _ready is not None:
+        return _ready
+    with _lock:
+        if _ready is not None:
+            return _ready
+        if engine.dialect.name != 'sqlite':
+            _ready = False
+            return _ready
+        try:
+            with engine.begin() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:n"), {'n': FTS_TABLE}
+                ).first() is not None
+                for stmt in _ddl():
+                    conn.execute(text(stmt))
+                if not exists:
+                    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+            _ready = True
+        except Exception as e:
+            if 'no such module: fts5' in str(e).lower():
+                # SQLite compilado sin FTS5: no cambiará mientras viva el proceso
+                _ready = False
+            # otro error (sin tabla productos todavía, base bloqueada...): ilike por
+            # ahora y se vuelve a intentar en la próxima búsqueda
+            return False
+    return _ready
+
+
+def rebuild(engine):
+    """Reconstruir el índice desde `productos` (tras cargas hechas con los triggers ausentes)."""
+    if not ensure_fts(engine):
+        return False
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    return True
+
+
+def match_query(term):
+    """Término del usuario -> expresión MATCH: cada palabra como prefijo, todas requeridas."""
+    tokens = _TOKEN_RE.findall(str(term or ''))
+    return ' '.join(f'"{t}"*' for t in tokens)
+
+
+def search_ids(session, term, limit=200):
+    """Ids de productos que coinciden con `term`, de más a menos relevante (bm25).
+
+    None si FTS5 no está disponible (el llamador debe usar otra búsqueda).
+    """
+    if not ensure_fts(session.get_bind()):
+        return None
+    q = match_query(term)
+    if not q:
+        return []
+    weights = ', '.join(str(w) for w in FTS_WEIGHTS)
+    rows = session.execute(
+        text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :q "
+             f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT :limit"),
+        {'q': q, 'limit': int(limit)},
+    )
+    return [r[0] for r in rows]
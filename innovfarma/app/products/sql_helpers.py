@@ -1,5 +1,9 @@
 # Funciones helper para productos con SQLAlchemy
 from ..models import db, Product
+from ..projection import pick_rows, sql_columns
+from . import bulk, repricing, sql_fts
+from .result_cache import result_cache, SEARCH_QUERY, FACET_QUERIES
+from .search_index import could_match, index_tokens
 
 def _product_to_dict(p):
     """Convertir producto a diccionario"""
@@ -36,16 +40,56 @@ def _product_to_dict(p):
         'Solo_compra': p.Solo_compra,
     }
 
-def list_products(limit=100):
-    """Listar todos los productos"""
-    productos = Product.query.limit(limit).all()
+# columnas en las que busca `filter_products`
+SEARCH_COLUMNS = ('Nombre_comercial', 'codigo', 'Nombre_generico', 'Cod_barrras', 'Accion_terapeutica',
+                  'Principio_activo', 'Concentracion', 'Presentacion', 'Cod_nandina')
+
+def _invalidate_results(p, campos=None):
+    """Descartar de `result_cache` lo que pudo cambiar al escribir `p` (`campos` = los editados; None = alta)"""
+    result_cache.invalidate_product(p.id)
+    if campos is None or set(campos) & set(SEARCH_COLUMNS):
+        tokens = {tok for c in SEARCH_COLUMNS for tok in index_tokens(getattr(p, c, None))}
+        result_cache.invalidate_matching(SEARCH_QUERY, lambda key: could_match(key[1], tokens))
+    if campos is None or set(campos) & set(FACET_FIELDS):
+        result_cache.invalidate_kind(*FACET_QUERIES)
+
+def list_products(limit=100, skip=0, after_id=None, fields=None):
+    """Listar todos los productos (por id; `after_id` pagina por cursor)
+
+    Con `fields` solo se seleccionan esas columnas.
+    """
+    if fields is not None:
+        query = db.session.query(*sql_columns(Product, fields)).order_by(Product.id)
+    else:
+        query = Product.query.order_by(Product.id)
+    if after_id is not None:
+        productos = query.filter(Product.id > after_id).limit(limit).all()
+    else:
+        productos = query.offset(skip).limit(limit).all()
+    if fields is not None:
+        return pick_rows(productos, _product_to_dict, fields)
     return [_product_to_dict(p) for p in productos]
 
 def filter_products(term, limit=200):
-    """Filtrar productos por término de búsqueda en múltiples campos"""
+    """Filtrar productos por término de búsqueda en múltiples campos
+
+    En SQLite usa el índice FTS5 (`sql_fts`): cada palabra como prefijo y
+    resultados ordenados por relevancia (bm25). Si FTS5 no está disponible o
+    no encuentra nada (p. ej. un fragmento a mitad de un código) se busca con
+    `ilike '%term%'` como antes.
+    """
     if not term:
         return list_products(limit)
-    
+
+    try:
+        ids = sql_fts.search_ids(db.session, term, limit=limit)
+    except Exception:
+        db.session.rollback()
+        ids = None
+    if ids:
+        por_id = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()}
+        return [_product_to_dict(por_id[i]) for i in ids if i in por_id]
+
     # Búsqueda en múltiples campos
     productos = Product.query.filter(
         (Product.Nombre_comercial.ilike(f'%{term}%')) |
@@ -79,6 +123,33 @@ def filter_advanced(marca_id=None, categoria_id=None, subcategoria_id=None, form
     productos = query.offset(skip).limit(limit).all()
     return [_product_to_dict(p) for p in productos]
 
+FACET_FIELDS = ('id_marca', 'id_laboratorio', 'id_subcategoria', 'id_forma_farmaceutica')
+
+def filter_advanced_facets(marca_id=None, categoria_id=None, subcategoria_id=None, forma_id=None,
+                           laboratorio_id=None, limit=100, skip=0):
+    """Filtrado avanzado más conteos por faceta (cada faceta sin su propio filtro)"""
+    filters = {
+        'id_marca': marca_id,
+        'id_forma_farmaceutica': forma_id,
+        'id_laboratorio': laboratorio_id,
+        'id_subcategoria': subcategoria_id,
+    }
+    filters = {k: v for k, v in filters.items() if v}
+    query = Product.query.filter_by(**filters)
+    productos = query.order_by(Product.id).offset(skip).limit(limit).all()
+    facets = {}
+    for field in FACET_FIELDS:
+        others = {k: v for k, v in filters.items() if k != field}
+        column = getattr(Product, field)
+        rows = db.session.query(column, db.func.count(Product.id)).filter_by(**others) \
+            .filter(column.isnot(None)).group_by(column).order_by(db.func.count(Product.id).desc()).all()
+        facets[field] = {valor: n for valor, n in rows}
+    return {
+        'productos': [_product_to_dict(p) for p in productos],
+        'facets': facets,
+        'total_filtrados': query.count(),
+    }
+
 def get_product(product_id):
     """Obtener un producto por ID con detalles completos"""
     p = Product.query.get(product_id)
@@ -86,6 +157,24 @@ def get_product(product_id):
         return None
     return _product_to_dict(p)
 
+def get_substitutes(product_id, limit=50, solo_con_stock=True):
+    """Productos con el mismo principio activo, concentración y presentación, por precio"""
+    p = Product.query.get(product_id)
+    if not p:
+        return None
+    if not p.Principio_activo:
+        return []
+    query = Product.query.filter(
+        Product.id != p.id,
+        Product.Principio_activo == p.Principio_activo,
+        Product.Concentracion == p.Concentracion,
+        Product.Presentacion == p.Presentacion,
+    )
+    if solo_con_stock:
+        query = query.filter(Product.existencia > 0)
+    productos = query.order_by(Product.Precio_venta).limit(limit).all()
+    return [_product_to_dict(p) for p in productos]
+
 def get_product_by_barcode(codigo_barras):
     """Buscar producto por código de barras"""
     p = Product.query.filter_by(Cod_barrras=codigo_barras).first()
@@ -93,19 +182,22 @@ def get_product_by_barcode(codigo_barras):
         return None
     return _product_to_dict(p)
 
-def search_by_barcode(codigo_barras):
-    """Buscar productos que contengan el código de barras (parcial)"""
+def search_by_barcode(codigo_barras, limit=10, modo='prefijo'):
+    """Buscar productos por código de barras parcial ('prefijo', 'sufijo' o 'contiene')"""
+    if modo == 'prefijo':
+        patron = f'{codigo_barras}%'
+    elif modo == 'sufijo':
+        patron = f'%{codigo_barras}'
+    else:
+        patron = f'%{codigo_barras}%'
     productos = Product.query.filter(
-        Product.Cod_barrras.ilike(f'%{codigo_barras}%')
-    ).limit(10).all()
+        Product.Cod_barrras.ilike(patron)
+    ).order_by(Product.Cod_barrras).limit(limit).all()
     return [_product_to_dict(p) for p in productos]
 
-def search_suggestions_by_barcode(codigo_barras):
+def search_suggestions_by_barcode(codigo_barras, limit=10, modo='prefijo'):
     """Obtener sugerencias de productos por código de barras"""
-    productos = Product.query.filter(
-        Product.Cod_barrras.ilike(f'%{codigo_barras}%')
-    ).limit(10).all()
-    return [_product_to_dict(p) for p in productos]
+    return search_by_barcode(codigo_barras, limit=limit, modo=modo)
 
 def create_product(codigo, Nombre_comercial, Nombre_generico=None, Precio_venta=0, 
                   Precio_compra=0, **kwargs):
@@ -143,8 +235,82 @@ def create_product(codigo, Nombre_comercial, Nombre_generico=None, Precio_venta=
 
     db.session.add(producto)
     db.session.commit()
+    _invalidate_results(producto)
     return producto.id
 
+def bulk_upsert_products(rows):
+    """Alta/actualización masiva por `codigo` (o `Cod_barrras`), un commit por lote"""
+    results = []
+    for batch in bulk.batches(rows):
+        docs = []
+        seen = set()
+        for i, row in batch:
+            doc, error = bulk.clean_row(row)
+            if error is None and bulk.upsert_key(doc) in seen:
+                error = f'{bulk.upsert_key(doc)[0]} repetido en el mismo lote'
+            if error is not None:
+                results.append({'fila': i, 'estado': 'error', 'error': error})
+                continue
+            seen.add(bulk.upsert_key(doc))
+            docs.append((i, doc))
+        if not docs:
+            continue
+        codigos = [d['codigo'] for _, d in docs if d.get('codigo')]
+        barras = [d['Cod_barrras'] for _, d in docs if not d.get('codigo')]
+        existing = {}
+        if codigos:
+            for p in Product.query.filter(Product.codigo.in_(codigos)).all():
+                existing.setdefault(('codigo', p.codigo), p)
+        if barras:
+            for p in Product.query.filter(Product.Cod_barrras.in_(barras)).all():
+                existing.setdefault(('Cod_barrras', p.Cod_barrras), p)
+        rows_out = []
+        docs_by_fila = dict(docs)
+        for i, doc in docs:
+            p = existing.get(bulk.upsert_key(doc))
+            estado = 'actualizado'
+            if p is None and not doc.get('Nombre_comercial'):
+                results.append({'fila': i, 'estado': 'error', 'error': bulk.NEW_WITHOUT_NAME})
+                continue
+            if p is None:
+                p = Product()
+                db.session.add(p)
+                estado = 'creado'
+            for k, v in doc.items():
+                if hasattr(p, k):
+                    setattr(p, k, v)
+            rows_out.append((i, estado, p))
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            results.extend({'fila': i, 'estado': 'error', 'error': str(e)} for i, _, _ in rows_out)
+            continue
+        results.extend({'fila': i, 'estado': estado, 'id': p.id} for i, estado, p in rows_out)
+        for i, estado, p in rows_out:
+            _invalidate_results(p, None if estado == 'creado' else docs_by_fila[i])
+    results.sort(key=lambda r: r['fila'])
+    return results
+
+def reprice_products(regla, dry_run=True):
+    """Reprecio masivo según `regla`; en modo prueba solo devuelve la muestra"""
+    columnas = [Product.id, Product.codigo, Product.Nombre_comercial,
+                Product.Precio_compra, Product.Precio_venta, Product.Margen_utilidad]
+    productos = [row._asdict() for row in db.session.query(*columnas).filter_by(**regla['filtros']).all()]
+    nuevos = repricing.compute(productos, regla)
+    out = {'total': len(productos), 'actualizados': 0, 'muestra': repricing.preview(productos, nuevos)}
+    if dry_run or not productos:
+        return out
+    db.session.bulk_update_mappings(Product, [
+        {'id': p['id'], 'Precio_compra': compra, 'Precio_venta': venta, 'Margen_utilidad': margen}
+        for p, (compra, venta, margen) in zip(productos, nuevos)
+    ])
+    db.session.commit()
+    for p in productos:
+        result_cache.invalidate_product(p['id'])
+    out['actualizados'] = len(productos)
+    return out
+
 def update_product(product_id, **kwargs):
     """Actualizar un producto con validación"""
     producto = Product.query.get(product_id)
@@ -164,11 +330,14 @@ def update_product(product_id, **kwargs):
         'Granel', 'Medicamento_controlado', 'Solo_compra'
     ]
     
+    editados = []
     for key, value in kwargs.items():
         if key in campos_permitidos and hasattr(producto, key):
             setattr(producto, key, value)
+            editados.append(key)
     
     db.session.commit()
+    _invalidate_results(producto, editados)
     return True
 
 def delete_product(product_id):
@@ -177,10 +346,27 @@ def delete_product(product_id):
     if not producto:
         return False
     
+    pid = producto.id
     db.session.delete(producto)
     db.session.commit()
+    # fuera de las entradas que lo contienen, solo cambian los totales y conteos por faceta
+    result_cache.invalidate_product(pid)
+    result_cache.invalidate_kind(*FACET_QUERIES)
     return True
 
+def get_products_batch(product_ids):
+    """{id pedido: producto} para varios ids (un solo `IN`)"""
+    por_int = {}
+    for pid in product_ids:
+        try:
+            por_int[pid] = int(pid)
+        except (TypeError, ValueError):
+            continue
+    if not por_int:
+        return {}
+    productos = {p.id: p for p in Product.query.filter(Product.id.in_(set(por_int.values()))).all()}
+    return {pid: _product_to_dict(productos[i]) for pid, i in por_int.items() if i in productos}
+
 def get_product_full_details(product_id):
     """Obtener detalles completos de un producto"""
     p = Product.query.get(product_id)
@@ -0,0 +1,122 @@
+"""Grupos de equivalencia para sustitutos genéricos.
+
+Dos productos son sustitutos si comparten `Principio_activo`,
+`Concentracion` y `Presentacion` (normalizados: sin tildes, sin mayúsculas
+y sin espacios, así '500 mg' y '500MG' caen en el mismo grupo). El índice
+guarda clave -> {ids} por worker y se mantiene desde los helpers de
+escritura de `mongo_models`, igual que los demás índices de productos.
+"""
+import threading
+import time
+
+from .search_index import tokenize
+
+GROUP_FIELDS = ('Principio_activo', 'Concentracion', 'Presentacion')
+
+
+def group_key(producto):
+    """Clave del grupo de equivalencia, o None si falta el principio activo."""
+    parts = tuple(''.join(tokenize(producto.get(f))) for f in GROUP_FIELDS)
+    if not parts[0]:
+        return None
+    return parts
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('inf')
+
+
+def in_stock(producto):
+    try:
+        return float(producto.get('existencia') or 0) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def price_order(producto):
+    return (_as_float(producto.get('Precio_venta')), str(producto.get('Nombre_comercial') or ''), producto.get('id'))
+
+
+class SubstituteIndex:
+    """Clave (principio activo, concentración, presentación) -> {ids de producto}."""
+
+    def __init__(self):
+        self._groups = {}
+        self._key_by_id = {}
+        self._products = {}
+        self._lock = threading.Lock()
+        self.built_at = None
+
+    @property
+    def built(self):
+        return self.built_at is not None
+
+    def _discard(self, pid):
+        self._products.pop(pid, None)
+        key = self._key_by_id.pop(pid, None)
+        if key is None:
+            return
+        members = self._groups.get(key)
+        if members is not None:
+            members.discard(pid)
+            if not members:
+                del self._groups[key]
+
+    def _insert(self, producto):
+        pid = producto.get('id')
+        key = group_key(producto)
+        if key is None:
+            return
+        self._groups.setdefault(key, set()).add(pid)
+        self._key_by_id[pid] = key
+        self._products[pid] = producto
+
+    def build(self, productos):
+        with self._lock:
+            self._groups = {}
+            self._key_by_id = {}
+            self._products = {}
+            for p in productos:
+                self._insert(p)
+            self.built_at = time.time()
+
+    def upsert(self, producto):
+        if not producto:
+            return
+        with self._lock:
+            self._discard(producto.get('id'))
+            self._insert(producto)
+
+    def remove(self, product_id):
+        with self._lock:
+            self._discard(str(product_id))
+
+    def clear(self):
+        with self._lock:
+            self._groups = {}
+            self._key_by_id = {}
+            self._products = {}
+            self.built_at = None
+
+    def substitutes(self, producto, limit=50, solo_con_stock=True):
+        """Otros productos del grupo de `producto`, del más barato al más caro (`limit=None`: todos)."""
+        key = group_key(producto)
+        if key is None or (limit is not None and limit <= 0):
+            return []
+        pid = producto.get('id')
+        with self._lock:
+            members = [self._products[m] for m in self._groups.get(key, ()) if m != pid]
+        if solo_con_stock:
+            members = [m for m in members if in_stock(m)]
+        members.sort(key=price_order)
+        return [dict(m) for m in members[:limit]]
+
+    def stats(self):
+        return {
+            'groups': len(self._groups),
+            'entries': len(self._key_by_id),
+            'built_at': self.built_at,
+        }
@@ -0,0 +1,70 @@
+"""Proyección de campos (`fields=`) para los listados.
+
+`?fields=Nombre_comercial,Precio_venta,existencia` se convierte en una
+proyección de Mongo o en una selección de columnas en SQL, de modo que solo
+se leen, convierten y serializan los campos pedidos. `id` siempre se
+incluye. Los campos calculados (p. ej. `display_id` a partir de `numero`) se
+declaran como {campo: (campos de origen)} y se expanden con `expand`.
+"""
+
+
+def parse_fields(raw):
+    """'a, b,c' -> ['id', 'a', 'b', 'c']; None si no se pidió proyección."""
+    if not raw:
+        return None
+    fields = ['id']
+    for f in str(raw).split(','):
+        f = f.strip()
+        if f and f not in fields:
+            fields.append(f)
+    return fields
+
+
+def expand(fields, derived):
+    """Añade a `fields` los campos de origen de los campos calculados pedidos."""
+    if fields is None:
+        return None
+    out = list(fields)
+    for f in fields:
+        for src in derived.get(f, ()):
+            if src not in out:
+                out.append(src)
+    return out
+
+
+def mongo_projection(fields):
+    if fields is None:
+        return None
+    projection = {'_id': 1}
+    for f in fields:
+        if f not in ('id', '_id'):
+            projection[f] = 1
+    return projection
+
+
+def sql_columns(model, fields):
+    """Columnas de `model` correspondientes a `fields` (se ignoran las desconocidas)."""
+    names = model.__table__.columns.keys()
+    return [getattr(model, f) for f in fields if f in names]
+
+
+def pick(d, fields):
+    if fields is None or not isinstance(d, dict):
+        return d
+    return {k: d[k] for k in fields if k in d}
+
+
+class _PartialRow:
+    """Fila con solo algunas columnas; las no seleccionadas se leen como None."""
+
+    def __init__(self, row):
+        self._values = row._asdict()
+
+    def __getattr__(self, name):
+        return self._values.get(name)
+
+
+def pick_rows(rows, to_dict, fields):
+    """Filas de `sql_columns` pasadas por el serializador normal (`to_dict`) y
+    recortadas a `fields`, con las mismas claves y formatos que sin proyección."""
+    return [pick(to_dict(_PartialRow(row)), fields) for row in rows]
@@ -0,0 +1,64 @@
+"""Números correlativos (`numero`) repartidos por bloques.
+
+Pedir cada número con `get_next_sequence` hace que todas las altas
+concurrentes (facturas, clientes, compras, proveedores) esperen turno sobre
+el mismo documento de `counters`. `BlockAllocator` reserva de una vez un
+bloque de `block_size` números con un solo `$inc` (`reserve_sequence`) y los
+va entregando desde memoria; solo vuelve a Mongo cuando el bloque se acaba.
+
+Cada worker tiene sus propios bloques, así que los números siguen siendo
+únicos pero no estrictamente crecientes entre workers, y los que no se
+llegan a usar (al reiniciar) quedan como huecos.
+"""
+import os
+import threading
+
+DEFAULT_BLOCK_SIZE = 100
+
+
+class BlockAllocator:
+    """Contador -> bloque reservado [siguiente, fin) en este proceso."""
+
+    def __init__(self, reserve, block_size=DEFAULT_BLOCK_SIZE):
+        self._reserve = reserve  # reserve(nombre, cantidad) -> primero del bloque
+        self.block_size = max(1, int(block_size or 1))
+        self._lock = threading.Lock()
+        self._blocks = {}
+        self._pid = os.getpid()
+        self.reservas = 0
+        self.entregados = 0
+
+    def configure(self, block_size=None):
+        if block_size is not None:
+            self.block_size = max(1, int(block_size))
+
+    def next(self, name):
+        with self._lock:
+            if self._pid != os.getpid():
+                # proceso hijo (fork): los bloques del padre no son nuestros
+                self._blocks = {}
+                self._pid = os.getpid()
+            nxt, end = self._blocks.get(name, (0, 0))
+            if nxt >= end:
+                nxt = self._reserve(name, self.block_size)
+                end = nxt + self.block_size
+                self.reservas += 1
+            self._blocks[name] = (nxt + 1, end)
+            self.entregados += 1
+            return nxt
+
+    def stats(self):
+        with self._lock:
+            return {
+                'block_size': self.block_size,
+                'reservas': self.reservas,
+                'entregados': self.entregados,
+                'disponibles': {name: end - nxt for name, (nxt, end) in self._blocks.items()},
+            }
+
+
+def series_name(name, id_sucursal=None):
+    """Nombre del contador: una serie por sucursal (`facturas:3`) o la global."""
+    if id_sucursal in (None, ''):
+        return name
+    return f'{name}:{id_sucursal}'
@@ -25,3 +25,34 @@ class Config:
     # (e.g. for local dev or CI). Defaults to False in production.
     FRONTEND_DEMO_PREFILL = os.environ.get('FRONTEND_DEMO_PREFILL', 'False').lower() in ('1', 'true', 'yes')
 
+    # Índices en memoria de productos (código de barras, etc.), construidos por worker al arrancar.
+    # Desactivar con PRODUCT_INDEX_WARMUP=False para diferir la carga al primer uso.
+    PRODUCT_INDEX_WARMUP = os.environ.get('PRODUCT_INDEX_WARMUP', 'True').lower() in ('1', 'true', 'yes')
+    # Presupuesto de tiempo (ms) por consulta de la búsqueda tolerante a errores
+    FUZZY_SEARCH_BUDGET_MS = int(os.environ.get('FUZZY_SEARCH_BUDGET_MS', '15'))
+    # Caché de resultados de /productos/filtrar y /productos/filtro-avanzado (por worker).
+    # SEARCH_CACHE_SIZE=0 la desactiva; el TTL (s) acota lo que tarda en verse una escritura de otro worker.
+    SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', '1000'))
+    SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', '30'))
+    # Comprobantes TXT de facturas (backend SQL): hilos que los generan en segundo plano
+    # y carpeta donde se escriben (por defecto innovfarma/receipts, junto a su cola pendientes.sqlite).
+    RECEIPT_WORKERS = int(os.environ.get('RECEIPT_WORKERS', '2'))
+    RECEIPTS_DIR = os.environ.get('RECEIPTS_DIR') or None
+    # POST /productos/bulk como arreglo JSON se lee entero en memoria: tope en bytes del cuerpo
+    # (las cargas más grandes van como NDJSON, que se procesa en streaming y no tiene tope).
+    BULK_JSON_MAX_BYTES = int(os.environ.get('BULK_JSON_MAX_BYTES', str(10 * 1024 * 1024)))
+    # Respuestas guardadas por Idempotency-Key (POST /facturas, /compras): segundos que se conservan
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', str(24 * 3600)))
+    # Números correlativos (facturas, clientes, compras, proveedores): cada worker reserva
+    # bloques de SEQUENCE_BLOCK_SIZE (1 = uno a uno, sin huecos pero con más contención).
+    # SEQUENCE_PER_SUCURSAL=True numera facturas y compras por sucursal.
+    SEQUENCE_BLOCK_SIZE = int(os.environ.get('SEQUENCE_BLOCK_SIZE', '100'))
+    SEQUENCE_PER_SUCURSAL = os.environ.get('SEQUENCE_PER_SUCURSAL', 'False').lower() in ('1', 'true', 'yes')
+    # /api/productos/cambios solo publica cambios con más de PRODUCT_SYNC_LAG segundos, para no
+    # adelantar el cursor a una escritura que sigue en curso (debe cubrir la escritura más lenta
+    # más la diferencia de reloj entre servidores).
+    PRODUCT_SYNC_LAG = float(os.environ.get('PRODUCT_SYNC_LAG', '30'))
+    # Índices en memoria de productos: cada worker mira como mucho cada PRODUCT_INDEX_SYNC_INTERVAL
+    # segundos si otro worker, instancia o script cambió productos y aplica esos cambios
+    # (relee PRODUCT_SYNC_LAG segundos hacia atrás por las escrituras que confirman tarde).
+    PRODUCT_INDEX_SYNC_INTERVAL = float(os.environ.get('PRODUCT_INDEX_SYNC_INTERVAL', '1'))
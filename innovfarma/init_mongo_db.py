@@ -57,10 +57,13 @@ COLLECTIONS = {
         ],
         'indices': [
             ('codigo', False),
+            ('Cod_barrras', False),
             ('Nombre_comercial', False),
             ('id_subcategoria', False),
             ('id_marca', False),
             ('id_laboratorio', False),
+            ([('updated_at', 1), ('rev', 1)], False),
+            ([('Principio_activo', 1), ('Concentracion', 1), ('Presentacion', 1), ('Precio_venta', 1), ('existencia', 1)], False),
         ]
     },
     'clientes': {
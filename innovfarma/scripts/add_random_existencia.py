@@ -14,8 +14,9 @@ import os
 import sys
 import argparse
 import random
+from datetime import datetime
 
-from pymongo import MongoClient, UpdateOne
+from pymongo import MongoClient, UpdateOne, ReturnDocument
 
 try:
     from config import Config
@@ -76,13 +77,21 @@ def main(yes=False):
             print('Operación cancelada por el usuario.')
             return
 
+    # sellar cada cambio con rev/updated_at (un bloque de `productos_rev` con un solo $inc)
+    # para que los workers de la app lo apliquen a sus índices en memoria
+    counter = db.counters.find_one_and_update({'_id': 'productos_rev'}, {'$inc': {'seq': total}},
+                                              upsert=True, return_document=ReturnDocument.AFTER)
+    rev = int(counter.get('seq', total)) - total
+    now = datetime.utcnow()
+
     updated = 0
     batch = []
     BATCH_SIZE = 500
-    cursor = col.find({}, {'_id': 1})
+    cursor = col.find({}, {'_id': 1}).limit(total)
     for doc in cursor:
         val = random.randint(0, 100)
-        batch.append(UpdateOne({'_id': doc['_id']}, {'$set': {'existencia': val}}))
+        rev += 1
+        batch.append(UpdateOne({'_id': doc['_id']}, {'$set': {'existencia': val, 'rev': rev, 'updated_at': now}}))
         if len(batch) >= BATCH_SIZE:
             res = col.bulk_write(batch)
             updated += res.modified_count
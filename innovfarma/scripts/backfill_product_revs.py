@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Script para asignar `rev`/`updated_at` a los productos que aún no los tienen
+(creados antes de la sincronización incremental `/api/productos/cambios`),
+completar `updated_at` en los tombstones antiguos y crear los índices que usa
+ese endpoint.
+
+Reserva de una vez un bloque del contador `productos_rev` para no chocar con
+las revisiones que asigne la app mientras corre el script. Es idempotente:
+solo toca documentos sin `rev`.
+
+Uso:
+  python backfill_product_revs.py [--yes]
+"""
+import os
+import sys
+import argparse
+from datetime import datetime
+
+from pymongo import MongoClient, UpdateOne, ReturnDocument, ASCENDING
+
+try:
+    from config import Config
+except Exception:
+    Config = None
+
+
+def get_mongo_uri():
+    uri = None
+    if Config is not None:
+        uri = getattr(Config, 'MONGO_URI', None)
+    uri = uri or os.environ.get('MONGO_URI') or os.environ.get('DATABASE_URL_MONGO') or os.environ.get('MONGO_URL')
+    return uri
+
+
+def main(yes=False):
+    uri = get_mongo_uri()
+    if not uri:
+        print("No se encontró MONGO_URI en config ni en variables de entorno.")
+        sys.exit(1)
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    try:
+        client.admin.command('ping')
+    except Exception as e:
+        print('Error conectando a Mongo:', e)
+        sys.exit(1)
+
+    try:
+        db = client.get_default_database()
+    except Exception:
+        db = None
+    if db is None:
+        dbname = os.environ.get('MONGO_DBNAME')
+        if not dbname:
+            print('No se detectó base de datos por defecto en la URI (define MONGO_DBNAME).')
+            sys.exit(1)
+        db = client[dbname]
+
+    col = db.productos
+    col.create_index([('rev', ASCENDING)], name='rev_1')
+    db.productos_eliminados.create_index([('rev', ASCENDING)], name='rev_1')
+    # orden de /api/productos/cambios
+    col.create_index([('updated_at', ASCENDING), ('rev', ASCENDING)], name='updated_at_1_rev_1')
+    db.productos_eliminados.create_index([('updated_at', ASCENDING), ('rev', ASCENDING)], name='updated_at_1_rev_1')
+    res = db.productos_eliminados.update_many({'updated_at': {'$exists': False}}, [{'$set': {'updated_at': '$deleted_at'}}])
+    if res.modified_count:
+        print(f'Tombstones completados con updated_at: {res.modified_count}')
+
+    q = {'rev': {'$exists': False}}
+    total = col.count_documents(q)
+    print(f"Base de datos: {db.name} | productos sin rev: {total}")
+    if total == 0:
+        return
+
+    if not yes:
+        confirm = input(f"¿Asignar rev a {total} productos? (y/N): ")
+        if confirm.lower() != 'y':
+            print('Operación cancelada por el usuario.')
+            return
+
+    # reservar el bloque [fin - total + 1, fin] con un único $inc
+    counter = db.counters.find_one_and_update({'_id': 'productos_rev'}, {'$inc': {'seq': total}},
+                                              upsert=True, return_document=ReturnDocument.AFTER)
+    rev = int(counter.get('seq', total)) - total
+    now = datetime.utcnow()
+
+    updated = 0
+    batch = []
+    BATCH_SIZE = 500
+    for doc in col.find(q, {'_id': 1}).sort('_id', 1).limit(total):
+        rev += 1
+        batch.append(UpdateOne({'_id': doc['_id'], 'rev': {'$exists': False}}, {'$set': {'rev': rev, 'updated_at': now}}))
+        if len(batch) >= BATCH_SIZE:
+            updated += col.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += col.bulk_write(batch, ordered=False).modified_count
+
+    print(f'Backfill finalizado. Productos actualizados: {updated}/{total}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Asignar rev a productos sin versión en MongoDB')
+    parser.add_argument('-y', '--yes', action='store_true', help='No pedir confirmación, ejecutar directamente')
+    args = parser.parse_args()
+    main(yes=args.yes)
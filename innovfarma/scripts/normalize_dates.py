@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Script para convertir a fechas BSON las fechas guardadas como string
+(`facturas.fecha`, `compras.fecha`, `lotes.caducidad`...; ver
+`app.dates.DATE_FIELDS`) y crear los índices de los filtros por rango.
+
+Se puede interrumpir y volver a ejecutar: recorre cada campo por `_id` en
+lotes y guarda el último `_id` convertido en la colección `migraciones`, de
+donde continúa la siguiente vez. Los valores que no se pueden interpretar
+se dejan como están y se listan al final.
+
+Uso:
+  python scripts/normalize_dates.py [--yes] [--batch-size N] [--restart]
+"""
+import os
+import sys
+import argparse
+
+from pymongo import MongoClient, UpdateOne
+
+# make project root importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+try:
+    from config import Config
+except Exception:
+    Config = None
+
+from app.dates import DATE_FIELDS, DATE_INDEXES, parse_date, parse_day
+
+CHECKPOINTS = 'migraciones'
+# campos que son un día (sin hora)
+DAY_FIELDS = {('lotes', 'caducidad')}
+
+
+def get_mongo_uri():
+    uri = None
+    if Config is not None:
+        uri = getattr(Config, 'MONGO_URI', None)
+    uri = uri or os.environ.get('MONGO_URI') or os.environ.get('DATABASE_URL_MONGO') or os.environ.get('MONGO_URL')
+    return uri
+
+
+def checkpoint_id(col, field):
+    return f'normalize_dates:{col}.{field}'
+
+
+def normalize_field(db, col, field, batch_size=1000, restart=False):
+    """Convertir `col.field` de string a fecha. Devuelve (convertidos, [ids no convertibles])."""
+    cp_id = checkpoint_id(col, field)
+    if restart:
+        db[CHECKPOINTS].delete_one({'_id': cp_id})
+    cp = db[CHECKPOINTS].find_one({'_id': cp_id}) or {}
+    q = {field: {'$type': 'string'}}
+    if cp.get('last_id') is not None:
+        q['_id'] = {'$gt': cp['last_id']}
+    parse = parse_day if (col, field) in DAY_FIELDS else parse_date
+
+    converted = 0
+    invalid = []
+    batch = []
+    last_id = None
+
+    def flush():
+        if batch:
+            db[col].bulk_write(batch, ordered=False)
+        if last_id is not None:
+            db[CHECKPOINTS].update_one({'_id': cp_id}, {'$set': {'last_id': last_id}}, upsert=True)
+
+    for doc in db[col].find(q, {field: 1}).sort('_id', 1):
+        last_id = doc['_id']
+        value = parse(doc.get(field))
+        if value is None:
+            invalid.append(doc['_id'])
+        else:
+            # condicionado al string leído, por si la app lo cambió entretanto
+            batch.append(UpdateOne({'_id': doc['_id'], field: doc.get(field)}, {'$set': {field: value}}))
+            converted += 1
+        if len(batch) >= batch_size:
+            flush()
+            batch = []
+    flush()
+    return converted, invalid
+
+
+def main(yes=False, batch_size=1000, restart=False):
+    uri = get_mongo_uri()
+    if not uri:
+        print("No se encontró MONGO_URI en config ni en variables de entorno.")
+        sys.exit(1)
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    try:
+        client.admin.command('ping')
+    except Exception as e:
+        print('Error conectando a Mongo:', e)
+        sys.exit(1)
+
+    try:
+        db = client.get_default_database()
+    except Exception:
+        db = None
+    if db is None:
+        dbname = os.environ.get('MONGO_DBNAME')
+        if not dbname:
+            print('No se detectó base de datos por defecto en la URI (define MONGO_DBNAME).')
+            sys.exit(1)
+        db = client[dbname]
+
+    pending = {}
+    for col, fields in DATE_FIELDS.items():
+        for field in fields:
+            pending[f'{col}.{field}'] = db[col].count_documents({field: {'$type': 'string'}})
+    print(f"Base de datos: {db.name}")
+    for name, n in pending.items():
+        print(f"  {name}: {n} fechas como string")
+    if not yes:
+        confirm = input("¿Convertir estas fechas a fechas BSON? (y/N): ")
+        if confirm.lower() != 'y':
+            print('Operación cancelada por el usuario.')
+            return
+
+    for col, fields in DATE_FIELDS.items():
+        for field in fields:
+            converted, invalid = normalize_field(db, col, field, batch_size=batch_size, restart=restart)
+            print(f'{col}.{field}: {converted} convertidas, {len(invalid)} no válidas')
+            for _id in invalid[:20]:
+                print(f'  sin convertir: {_id}')
+            if len(invalid) > 20:
+                print(f'  ... y {len(invalid) - 20} más')
+
+    for col, keys in DATE_INDEXES:
+        name = db[col].create_index(keys)
+        print(f'Índice {col}.{name} listo')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convertir fechas string a fechas BSON y crear índices de fecha')
+    parser.add_argument('-y', '--yes', action='store_true', help='No pedir confirmación, ejecutar directamente')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Documentos por bulk_write (por defecto 1000)')
+    parser.add_argument('--restart', action='store_true', help='Ignorar los checkpoints y recorrer todo de nuevo')
+    args = parser.parse_args()
+    main(yes=args.yes, batch_size=args.batch_size, restart=args.restart)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Script para construir (o reconstruir) los rollups `ventas_diarias` desde
+`facturas` y `detalle_factura`, y crear sus índices.
+
+La primera ejecución es el backfill: hasta entonces `/api/facturas/informe`
+se calcula sobre las facturas. Después la app los mantiene al crear cada
+factura; volver a ejecutarlo solo hace falta si se editan o importan
+facturas por fuera de la app. Reconstruye en una colección temporal y la
+intercambia al final, así el informe no se queda sin datos mientras corre.
+
+Uso:
+  python scripts/rebuild_ventas_diarias.py [--yes]
+"""
+import os
+import sys
+import argparse
+
+from pymongo import MongoClient
+
+# make project root importable
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+try:
+    from config import Config
+except Exception:
+    Config = None
+
+from app.invoices import ventas_diarias
+
+
+def get_mongo_uri():
+    uri = None
+    if Config is not None:
+        uri = getattr(Config, 'MONGO_URI', None)
+    uri = uri or os.environ.get('MONGO_URI') or os.environ.get('DATABASE_URL_MONGO') or os.environ.get('MONGO_URL')
+    return uri
+
+
+def main(yes=False):
+    uri = get_mongo_uri()
+    if not uri:
+        print("No se encontró MONGO_URI en config ni en variables de entorno.")
+        sys.exit(1)
+
+    client = MongoClient(uri, serverSelectionTimeoutMS=5000)
+    try:
+        client.admin.command('ping')
+    except Exception as e:
+        print('Error conectando a Mongo:', e)
+        sys.exit(1)
+
+    try:
+        db = client.get_default_database()
+    except Exception:
+        db = None
+    if db is None:
+        dbname = os.environ.get('MONGO_DBNAME')
+        if not dbname:
+            print('No se detectó base de datos por defecto en la URI (define MONGO_DBNAME).')
+            sys.exit(1)
+        db = client[dbname]
+
+    total = db.facturas.estimated_document_count()
+    print(f"Base de datos: {db.name} | facturas: {total}")
+    if not yes:
+        confirm = input(f"¿Reconstruir {ventas_diarias.COLLECTION} desde {total} facturas? (y/N): ")
+        if confirm.lower() != 'y':
+            print('Operación cancelada por el usuario.')
+            return
+
+    n = ventas_diarias.rebuild(db)
+    ventas_diarias.ensure_indexes(db)
+    print(f'Rollups reconstruidos. Facturas procesadas: {n}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Construir los rollups ventas_diarias del informe de ventas')
+    parser.add_argument('-y', '--yes', action='store_true', help='No pedir confirmación, ejecutar directamente')
+    args = parser.parse_args()
+    main(yes=args.yes)
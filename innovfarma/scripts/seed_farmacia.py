@@ -15,7 +15,7 @@ from datetime import datetime, timedelta
 import random
 import os
 import argparse
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from bson import ObjectId
 
 
@@ -113,7 +113,8 @@ def seed(db, force=False):
             lote = {
                 'producto_id': str(pid),
                 'lote': f'L{random.randint(1000,9999)}',
-                'caducidad': cad.isoformat(),
+                # fecha BSON (día), como la guarda la API (ver app/dates.py)
+                'caducidad': datetime(cad.year, cad.month, cad.day),
                 'cantidad': cantidad,
                 'created_at': datetime.utcnow(),
                 'seeded_by': SEED_TAG
@@ -123,8 +124,12 @@ def seed(db, force=False):
         res = db.lotes.insert_many(lote_docs)
         print(f'Inserted {len(res.inserted_ids)} lotes')
 
-    # update product existencia based on lotes
+    # update product existencia based on lotes (with rev/updated_at so running workers pick it up)
+    counter = db.counters.find_one_and_update({'_id': 'productos_rev'}, {'$inc': {'seq': len(prod_ids)}},
+                                              upsert=True, return_document=ReturnDocument.AFTER)
+    rev = int(counter.get('seq', len(prod_ids))) - len(prod_ids)
     for pid in prod_ids:
+        rev += 1
         pid_str = str(pid)
         total = db.lotes.aggregate([
             {'$match': {'producto_id': pid_str}},
@@ -133,7 +138,7 @@ def seed(db, force=False):
         total_val = 0
         for t in total:
             total_val = int(t.get('sum', 0))
-        db.productos.update_one({'_id': pid}, {'$set': {'existencia': total_val}})
+        db.productos.update_one({'_id': pid}, {'$set': {'existencia': total_val, 'rev': rev, 'updated_at': datetime.utcnow()}})
 
     # create stock_sucursal documents (split existencia across sucursales)
     print('Creating stock_sucursal entries...')
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# `innovfarma` se importa como paquete desde la raíz del repo (igual que run.py)
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
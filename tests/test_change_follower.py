@@ -0,0 +1,104 @@
+"""Puesta al día de los índices en memoria con las escrituras de otros workers."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from innovfarma.app.products.change_follower import ChangeFollower
+
+
+class Source:
+    """Versión y sellos (id, rev, eliminado, updated_at) como los ve Mongo."""
+
+    def __init__(self):
+        self.version = 0
+        self.stamps = []
+        self.reads = []
+        self.applied = []
+        self.fail = False
+
+    def read_version(self):
+        return self.version
+
+    def read_stamps(self, since):
+        self.reads.append(since)
+        if self.fail:
+            raise RuntimeError('mongo caído')
+        return [(pid, rev, deleted) for pid, rev, deleted, ts in self.stamps if ts >= since]
+
+    def apply(self, changed, deleted):
+        self.applied.append((sorted(changed), sorted(deleted)))
+
+    def write(self, pid, deleted=False, ts=None):
+        self.version += 1
+        self.stamps.append((pid, self.version, deleted, ts or datetime.utcnow()))
+
+
+def _poll(follower, src):
+    return follower.poll(src.read_version, src.read_stamps, src.apply)
+
+
+@pytest.fixture
+def follower():
+    f = ChangeFollower(interval=0, overlap=30)
+    f.reset(0, datetime.utcnow())
+    return f
+
+
+def test_applies_other_workers_writes_once(follower):
+    src = Source()
+    src.write('a')
+    src.write('b')
+    assert _poll(follower, src) == 2
+    assert src.applied == [(['a', 'b'], [])]
+    # la ventana se solapa: se vuelven a leer los sellos, pero no se reaplican
+    assert _poll(follower, src) == 0
+    assert src.applied == [(['a', 'b'], [])]
+
+
+def test_deletes_and_late_commits(follower):
+    src = Source()
+    src.write('a')
+    _poll(follower, src)
+    # un cambio con updated_at anterior a la última lectura que se confirma después
+    src.write('b', ts=datetime.utcnow() - timedelta(seconds=5))
+    src.write('a', deleted=True)
+    assert _poll(follower, src) == 2
+    assert src.applied[-1] == (['b'], ['a'])
+
+
+def test_quiet_catalog_only_reads_the_version(follower):
+    src = Source()
+    follower.reset(0, datetime.utcnow())
+    follower._active_until = 0  # pasó la ventana de escrituras en curso
+    assert _poll(follower, src) == 0
+    assert src.reads == []
+
+
+def test_own_writes_are_not_reapplied(follower):
+    src = Source()
+    src.write('a')
+    follower.note('a', src.version)
+    assert _poll(follower, src) == 0
+    assert src.applied == []
+
+
+def test_failed_read_does_not_skip_changes(follower):
+    src = Source()
+    src.write('a')
+    src.fail = True
+    with pytest.raises(RuntimeError):
+        _poll(follower, src)
+    src.fail = False
+    assert _poll(follower, src) == 1
+    assert src.reads[0] == src.reads[1]
+
+
+def test_interval_limits_reads():
+    f = ChangeFollower(interval=60, overlap=30)
+    f.reset(0, datetime.utcnow())
+    src = Source()
+    src.write('a')
+    assert _poll(f, src) == 1
+    src.write('b')
+    assert _poll(f, src) == 0
+    assert len(src.reads) == 1
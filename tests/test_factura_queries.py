@@ -0,0 +1,141 @@
+"""Lectura de una factura (Mongo): consultas por petición y forma del JSON.
+
+`get_factura` debe costar cuatro consultas (factura, vendedor, detalles y
+productos) tenga una línea o treinta.
+"""
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from innovfarma.app import mongo_models
+from innovfarma.app.products.id_cache import ProductIdCache
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        if key == '$or':
+            if not any(_matches(doc, q) for q in cond):
+                return False
+        elif isinstance(cond, dict) and '$in' in cond:
+            if key not in doc or doc[key] not in cond['$in']:
+                return False
+        elif doc.get(key) != cond:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    keep = {k for k, v in projection.items() if v} | {'_id'}
+    return {k: v for k, v in doc.items() if k in keep}
+
+
+class FakeCollection:
+    def __init__(self, db, docs):
+        self._db = db
+        self._docs = docs
+
+    def find(self, query=None, projection=None):
+        self._db.queries += 1
+        return [_project(d, projection) for d in self._docs if _matches(d, query or {})]
+
+    def find_one(self, query=None, projection=None):
+        self._db.queries += 1
+        for d in self._docs:
+            if _matches(d, query or {}):
+                return _project(d, projection)
+        return None
+
+
+class FakeDB:
+    """Colecciones en memoria que cuentan cada `find`/`find_one`."""
+
+    def __init__(self, **collections):
+        self.queries = 0
+        self._collections = {name: FakeCollection(self, docs) for name, docs in collections.items()}
+
+    def __getitem__(self, name):
+        return self._collections.setdefault(name, FakeCollection(self, []))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+
+def _fixture(lines):
+    seller = {'_id': ObjectId(), 'nombre': 'Ana Vendedora', 'username': 'ana'}
+    factura = {
+        '_id': ObjectId(), 'numero': 7, 'id_usuario': str(seller['_id']), 'id_cliente': 'c1',
+        'id_sucursal': 1, 'fecha': datetime(2024, 1, 31, 10, 30), 'total': 10.0 * lines,
+    }
+    fid = str(factura['_id'])
+    productos, detalles = [], []
+    for n in range(lines):
+        if n % 3 == 2:
+            # producto migrado que se referencia por su `id` legado
+            prod = {'_id': ObjectId(), 'id': f'legacy-{n}', 'Nombre_comercial': f'Producto {n}'}
+            ref = prod['id']
+        else:
+            prod = {'_id': ObjectId(), 'Nombre_comercial': f'Producto {n}'}
+            ref = str(prod['_id'])
+        productos.append(prod)
+        detalles.append({
+            '_id': ObjectId(), 'id_factura': fid, 'id_producto': ref,
+            'cantidad': 1, 'precio_unitario': 10.0, 'subtotal': 10.0,
+        })
+    db = FakeDB(facturas=[factura], usuarios=[seller], detalle_factura=detalles, productos=productos)
+    return db, fid
+
+
+@pytest.fixture(autouse=True)
+def fresh_id_cache(monkeypatch):
+    monkeypatch.setattr(mongo_models, 'product_ids', ProductIdCache())
+
+
+@pytest.mark.parametrize('lines', [1, 30])
+def test_get_factura_constant_queries(monkeypatch, lines):
+    db, fid = _fixture(lines)
+    monkeypatch.setattr(mongo_models, 'get_db', lambda: db)
+
+    factura = mongo_models.get_factura(fid)
+
+    assert db.queries == 4
+    assert len(factura['detalles']) == lines
+
+
+@pytest.mark.parametrize('lines', [1, 30])
+def test_get_detalles_factura_constant_queries(monkeypatch, lines):
+    db, fid = _fixture(lines)
+    monkeypatch.setattr(mongo_models, 'get_db', lambda: db)
+
+    detalles = mongo_models.get_detalles_factura(fid)
+
+    assert db.queries == 2
+    assert len(detalles) == lines
+
+
+def test_get_factura_json_shape(monkeypatch):
+    db, fid = _fixture(3)
+    monkeypatch.setattr(mongo_models, 'get_db', lambda: db)
+
+    factura = mongo_models.get_factura(fid)
+
+    assert set(factura) == {
+        '_id', 'id', 'short_id', 'numero', 'display_id', 'id_usuario', 'id_cliente', 'id_sucursal',
+        'fecha', 'total', 'vendedor_nombre', 'detalles',
+    }
+    assert factura['id'] == fid
+    assert factura['short_id'] == fid[:8]
+    assert factura['display_id'] == '7'
+    assert factura['fecha'] == '2024-01-31T10:30:00'
+    assert factura['vendedor_nombre'] == 'Ana Vendedora'
+    for n, d in enumerate(factura['detalles']):
+        assert set(d) == {
+            '_id', 'id', 'short_id', 'id_factura', 'id_producto', 'cantidad', 'precio_unitario',
+            'subtotal', 'producto_nombre', 'producto_short_id',
+        }
+        assert d['producto_nombre'] == f'Producto {n}'
+        assert d['short_id'] == d['id'][:8]
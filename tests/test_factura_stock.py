@@ -0,0 +1,253 @@
+"""Escrituras de stock (Mongo): alta de facturas, `rev` y ETags.
+
+- Si el stock cambia entre la validación y el descuento, sin transacciones
+  (servidor standalone) las líneas ya descontadas se compensan y nunca se
+  inserta un producto.
+- Cada escritura sobre `productos` asigna una `rev` nueva y mueve
+  `collection_version('productos')`, la base de los ETags.
+"""
+import pytest
+from bson import ObjectId
+from flask import Flask, jsonify
+
+from innovfarma.app import mongo_models
+from innovfarma.app.etag import conditional_get
+from innovfarma.app.products.id_cache import ProductIdCache
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        if key == '$or':
+            if not any(_matches(doc, q) for q in cond):
+                return False
+        elif isinstance(cond, dict) and ('$in' in cond or '$gte' in cond):
+            if '$in' in cond and (key not in doc or doc[key] not in cond['$in']):
+                return False
+            if '$gte' in cond and not (key in doc and doc[key] >= cond['$gte']):
+                return False
+        elif doc.get(key) != cond:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    keep = {k for k, v in projection.items() if v} | {'_id'}
+    return {k: v for k, v in doc.items() if k in keep}
+
+
+def _update(doc, update):
+    for key, n in update.get('$inc', {}).items():
+        doc[key] = doc.get(key, 0) + n
+    doc.update(update.get('$set', {}))
+
+
+class BulkResult:
+    def __init__(self, matched):
+        self.matched_count = matched
+        self.modified_count = matched
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self._db = db
+        self.name = name
+        self.docs = []
+
+    def _log(self, op):
+        self._db.ops.append((self.name, op))
+
+    def find(self, query=None, projection=None, session=None):
+        self._log('find')
+        return [_project(d, projection) for d in self.docs if _matches(d, query or {})]
+
+    def find_one(self, query=None, projection=None, session=None):
+        self._log('find_one')
+        found = [d for d in self.docs if _matches(d, query or {})]
+        return _project(found[0], projection) if found else None
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None, session=None):
+        self._log('find_one_and_update')
+        found = [d for d in self.docs if _matches(d, query)]
+        if not found:
+            found = [dict(query)]
+            self.docs.append(found[0])
+        _update(found[0], update)
+        return dict(found[0])
+
+    def update_one(self, query, update, upsert=False, session=None):
+        self._log('update_one')
+        found = [d for d in self.docs if _matches(d, query)]
+        if found:
+            _update(found[0], update)
+        return BulkResult(len(found))
+
+    def insert_one(self, doc, session=None):
+        self._log('insert_one')
+        doc.setdefault('_id', ObjectId())
+        self.docs.append(doc)
+
+    def insert_many(self, docs, ordered=True, session=None):
+        self._log('insert_many')
+        for doc in docs:
+            self.insert_one(doc)
+
+    def delete_one(self, query, session=None):
+        self._log('delete_one')
+        found = [d for d in self.docs if _matches(d, query)]
+        if found:
+            self.docs.remove(found[0])
+
+    def delete_many(self, query, session=None):
+        self._log('delete_many')
+        self.docs = [d for d in self.docs if not _matches(d, query)]
+
+    def bulk_write(self, ops, ordered=True, session=None):
+        self._log('bulk_write')
+        if self._db.before_bulk_write:
+            hook, self._db.before_bulk_write = self._db.before_bulk_write, None
+            hook(self._db)
+        matched = 0
+        for op in ops:
+            assert not op._upsert
+            found = [d for d in self.docs if _matches(d, op._filter)]
+            if found:
+                _update(found[0], op._doc)
+                matched += 1
+        return BulkResult(matched)
+
+
+class FakeDB:
+    """Colecciones en memoria; `before_bulk_write(db)` simula otra escritura justo antes del descuento."""
+
+    def __init__(self):
+        self.ops = []
+        self.before_bulk_write = None
+        self._collections = {}
+
+    def __getitem__(self, name):
+        return self._collections.setdefault(name, FakeCollection(self, name))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(mongo_models, 'get_db', lambda: db)
+    monkeypatch.setattr(mongo_models, '_transactions_supported', False)
+    monkeypatch.setattr(mongo_models, 'product_ids', ProductIdCache())
+    monkeypatch.setattr(mongo_models, '_index_products', lambda productos, note=True: None)
+    monkeypatch.setattr(mongo_models, '_index_product', lambda producto: None)
+    return db
+
+
+def _producto(db, existencia):
+    doc = {'_id': ObjectId(), 'Nombre_comercial': f'Producto {len(db.productos.docs)}', 'existencia': existencia, 'rev': 0}
+    db.productos.docs.append(doc)
+    return doc
+
+
+def _vender(*lineas, **kwargs):
+    items = [{'id_producto': str(p['_id']), 'cantidad': n, 'precio_unitario': 1, 'subtotal': n} for p, n in lineas]
+    return mongo_models.create_factura(None, 'c1', 1, items, sum(n for _, n in lineas), **kwargs)
+
+
+def test_descuenta_stock_y_guarda_factura(db):
+    a, b = _producto(db, 5), _producto(db, 3)
+
+    fid = _vender((a, 2), (b, 3))
+
+    assert (a['existencia'], b['existencia']) == (3, 0)
+    assert a['rev'] != b['rev'] and a['rev'] > 0
+    assert [str(f['_id']) for f in db.facturas.docs] == [fid]
+    assert len(db.detalle_factura.docs) == 2
+
+
+def test_stock_insuficiente_al_descontar_compensa_las_lineas_aplicadas(db):
+    a, b = _producto(db, 5), _producto(db, 3)
+    # otra venta se lleva el stock de `b` entre la validación y el descuento
+    db.before_bulk_write = lambda db: b.update(existencia=1)
+
+    with pytest.raises(ValueError, match='Stock insuficiente'):
+        _vender((a, 2), (b, 3))
+
+    assert (a['existencia'], b['existencia']) == (5, 1)
+    assert len(db.productos.docs) == 2
+    assert db.facturas.docs == [] and db.detalle_factura.docs == []
+
+
+def test_producto_eliminado_al_descontar_no_crea_un_documento(db):
+    a, b = _producto(db, 5), _producto(db, 3)
+    db.before_bulk_write = lambda db: db.productos.docs.remove(b)
+
+    with pytest.raises(ValueError, match='no encontrado'):
+        _vender((a, 2), (b, 1))
+
+    assert db.productos.docs == [a]
+    assert a['existencia'] == 5
+    assert db.facturas.docs == []
+
+
+def test_usuario_ya_leido_no_se_vuelve_a_buscar(db):
+    a = _producto(db, 5)
+    vendedor = {'_id': ObjectId(), 'nombre': 'Ana Vendedora'}
+
+    items = [{'id_producto': str(a['_id']), 'cantidad': 1}]
+    mongo_models.create_factura(str(vendedor['_id']), 'c1', 1, items, 1, usuario=vendedor)
+
+    assert ('usuarios', 'find_one') not in db.ops
+    assert db.facturas.docs[0]['vendedor_nombre'] == 'Ana Vendedora'
+    # el carrito se lee una vez para validar y no se relee tras el descuento
+    assert db.ops.count(('productos', 'find')) == 1
+
+
+def _version():
+    return mongo_models.collection_version('productos')
+
+
+def test_cada_escritura_mueve_la_version_y_la_rev_crece(db):
+    a, b = _producto(db, 5), _producto(db, 5)
+    v0 = _version()
+
+    _vender((a, 1))
+    assert _version() > v0
+    assert a['rev'] == _version()
+
+    v1 = _version()
+    assert mongo_models.update_product(str(a['_id']), Precio_venta=9.5)
+    assert _version() > v1
+    assert a['rev'] == _version()
+
+    v2 = _version()
+    _vender((a, 1), (b, 1))
+    assert v2 < a['rev'] < b['rev'] <= _version()
+
+
+def test_etag_de_productos_cambia_con_cada_venta(db):
+    a = _producto(db, 5)
+    app = Flask(__name__)
+    app.config['MONGO_URI'] = 'mongodb://pruebas'
+    lecturas = []
+
+    @app.route('/productos')
+    @conditional_get('productos')
+    def listar():
+        lecturas.append(1)
+        return jsonify({'existencia': a['existencia']})
+
+    client = app.test_client()
+    tag = client.get('/productos').headers['ETag']
+    assert client.get('/productos', headers={'If-None-Match': tag}).status_code == 304
+
+    _vender((a, 2))
+
+    resp = client.get('/productos', headers={'If-None-Match': tag})
+    assert resp.status_code == 200
+    assert resp.get_json() == {'existencia': 3}
+    assert resp.headers['ETag'] != tag
+    assert len(lecturas) == 2
@@ -0,0 +1,155 @@
+"""`Idempotency-Key` en las altas: reintento repetido, en curso (409) y otro cuerpo (422)."""
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask, jsonify
+from pymongo.errors import DuplicateKeyError
+
+from innovfarma.app import idempotency, mongo_models
+from innovfarma.app.idempotency import idempotent
+
+
+def _matches(doc, query):
+    for key, cond in query.items():
+        if isinstance(cond, dict) and '$lt' in cond:
+            if not (key in doc and doc[key] < cond['$lt']):
+                return False
+        elif doc.get(key) != cond:
+            return False
+    return True
+
+
+class UpdateResult:
+    def __init__(self, matched):
+        self.matched_count = matched
+
+
+class FakeCollection:
+    """Lo mínimo de `idempotencia`: `_id` único, como en Mongo."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def insert_one(self, doc):
+        if doc['_id'] in self.docs:
+            raise DuplicateKeyError('E11000 duplicate key')
+        self.docs[doc['_id']] = dict(doc)
+
+    def find_one(self, query, projection=None):
+        found = [d for d in self.docs.values() if _matches(d, query)]
+        return dict(found[0]) if found else None
+
+    def find_one_and_update(self, query, update):
+        doc = self.find_one(query)
+        if doc is not None:
+            self.docs[doc['_id']].update(update['$set'])
+        return doc
+
+    def update_one(self, query, update):
+        doc = self.find_one(query)
+        if doc is not None:
+            self.docs[doc['_id']].update(update['$set'])
+        return UpdateResult(1 if doc else 0)
+
+    def delete_one(self, query):
+        doc = self.find_one(query)
+        if doc is not None:
+            del self.docs[doc['_id']]
+
+
+@pytest.fixture
+def col(monkeypatch):
+    col = FakeCollection()
+    monkeypatch.setattr(mongo_models, 'get_db', lambda: {idempotency.COLLECTION: col})
+    return col
+
+
+@pytest.fixture
+def app(col):
+    app = Flask(__name__)
+    app.config['MONGO_URI'] = 'mongodb://pruebas'
+    app.altas = []
+
+    @app.route('/facturas', methods=['POST'])
+    @idempotent('facturas')
+    def alta():
+        app.altas.append(1)
+        if app.durante:
+            app.durante()
+        if app.falla:
+            return jsonify({'error': 'Stock insuficiente'}), 400
+        return jsonify({'id_factura': len(app.altas)}), 201
+
+    app.falla = False
+    app.durante = None
+    return app
+
+
+def _post(client, body, key='k1'):
+    return client.post('/facturas', json=body, headers={'Idempotency-Key': key})
+
+
+def test_reintento_repite_la_respuesta_sin_ejecutar_la_vista(app, col):
+    client = app.test_client()
+
+    primera = _post(client, {'items': [1]})
+    segunda = _post(client, {'items': [1]})
+
+    assert primera.status_code == segunda.status_code == 201
+    assert segunda.get_json() == primera.get_json() == {'id_factura': 1}
+    assert segunda.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in primera.headers
+    assert len(app.altas) == 1
+    assert [d['estado'] for d in col.docs.values()] == ['hecho']
+
+
+def test_misma_clave_con_otro_cuerpo_es_422(app):
+    client = app.test_client()
+    _post(client, {'items': [1]})
+
+    resp = _post(client, {'items': [2]})
+
+    assert resp.status_code == 422
+    assert len(app.altas) == 1
+
+
+def test_reintento_mientras_la_original_sigue_en_curso_es_409(app):
+    client = app.test_client()
+    reintentos = []
+    # el reintento llega mientras la primera petición sigue dentro de la vista
+    app.durante = lambda: reintentos.append(_post(client, {'items': [1]}))
+
+    assert _post(client, {'items': [1]}).status_code == 201
+    assert [r.status_code for r in reintentos] == [409]
+    assert reintentos[0].headers['Retry-After'] == '1'
+    assert len(app.altas) == 1
+
+
+def test_reserva_sin_latido_se_toma_y_se_ejecuta(app, col):
+    client = app.test_client()
+    _post(client, {'items': [1]})
+    doc = next(iter(col.docs.values()))
+    # un worker que murió a mitad: 'en_curso' y sin latir desde hace rato
+    viejo = datetime.utcnow() - timedelta(seconds=idempotency.IN_PROGRESS_TIMEOUT + 1)
+    doc.update(estado='en_curso', latido=viejo, owner='muerto')
+
+    resp = _post(client, {'items': [1]})
+
+    assert resp.status_code == 201
+    assert 'Idempotent-Replayed' not in resp.headers
+    assert len(app.altas) == 2
+    assert doc['estado'] == 'hecho'
+
+
+def test_fallo_libera_la_clave(app, col):
+    client = app.test_client()
+    app.falla = True
+    assert _post(client, {'items': [1]}).status_code == 400
+    assert col.docs == {}
+
+    app.falla = False
+    assert _post(client, {'items': [1]}).status_code == 201
+    assert len(app.altas) == 2
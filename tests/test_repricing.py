@@ -0,0 +1,42 @@
+"""Reprecio masivo: la rama NumPy y la de listas de Python dan los mismos precios."""
+import random
+
+import pytest
+
+from innovfarma.app.products import repricing
+
+np = pytest.importorskip('numpy')
+
+
+def _regla(**kw):
+    return dict({'porcentaje': 10.0, 'margen_objetivo': None, 'redondeo': 0.01, 'redondeo_modo': 'cercano'}, **kw)
+
+
+def _sin_numpy(monkeypatch, productos, regla):
+    monkeypatch.setattr(repricing, 'np', None)
+    out = repricing.compute(productos, regla)
+    monkeypatch.setattr(repricing, 'np', np)
+    return out
+
+
+def test_mitades_de_centavo_hacia_arriba(monkeypatch):
+    productos = [{'Precio_compra': 45.75, 'Precio_venta': 60}]
+    regla = _regla(margen_objetivo=12.5)
+    # 45.75 * 1.1 = 50.325
+    assert repricing.compute(productos, regla)[0][0] == 50.33
+    assert _sin_numpy(monkeypatch, productos, regla)[0][0] == 50.33
+
+
+@pytest.mark.parametrize('modo', repricing.ROUNDING_MODES)
+@pytest.mark.parametrize('margen', [None, 30.0])
+@pytest.mark.parametrize('paso', [0.01, 0.05, 0.1, 1.0])
+@pytest.mark.parametrize('porcentaje', [10.0, -7.5, 3.33])
+def test_numpy_y_python_coinciden(monkeypatch, modo, margen, paso, porcentaje):
+    rnd = random.Random(1)
+    productos = [{'Precio_compra': round(rnd.uniform(0, 200), 2), 'Precio_venta': round(rnd.uniform(0, 300), 2)}
+                 for _ in range(500)]
+    productos += [{'Precio_compra': None, 'Precio_venta': 10}, {'Precio_compra': 'x', 'Precio_venta': None},
+                  {'Precio_compra': 0, 'Precio_venta': 5}]
+    regla = _regla(porcentaje=porcentaje, margen_objetivo=margen, redondeo=paso, redondeo_modo=modo)
+
+    assert repricing.compute(productos, regla) == _sin_numpy(monkeypatch, productos, regla)